@@ -1,37 +1,47 @@
 from __future__ import annotations
 
-import asyncio
-import json
+import os
+import time
 import urllib.parse
-import urllib.request
-from typing import Any, Dict, List
+from collections import OrderedDict
+from typing import Any, Dict, List, Tuple
 
-FASTNEAR_BASE = "https://api.fastnear.com/v0"
+from blockchain.near_rpc import near_rpc
+from utils.nft_cache import nft_cache
 
+FASTNEAR_BASE = "https://api.fastnear.com/v0"
 
-def _fetch_json(url: str, timeout: float = 20.0) -> Any:
-    req = urllib.request.Request(
-        url,
-        headers={
-            "accept": "application/json",
-            "user-agent": "card-clash/1.0",
-        },
-        method="GET",
-    )
-    with urllib.request.urlopen(req, timeout=timeout) as resp:
-        raw = resp.read().decode("utf-8", errors="replace")
-        return json.loads(raw)
+# Инвентарь аккаунта у индексера: кэш на NFT_INVENTORY_TTL_SECONDS, чтобы
+# повторные открытия инвентаря не ходили в FastNEAR каждый раз.
+NFT_INVENTORY_TTL_SECONDS = float(os.getenv("NFT_INVENTORY_TTL_SECONDS", "30"))
+NFT_INVENTORY_CACHE_MAX = 5000
+_inventory: "OrderedDict[Tuple[str, int], Tuple[float, List[Dict[str, Any]]]]" = OrderedDict()
 
 
 async def fetch_nfts_for_owner(account_id: str, limit: int = 50) -> List[Dict[str, Any]]:
     """
     FastNEAR indexer: GET /account/{account_id}/nfts?limit=...
-    Без httpx/requests — только stdlib, чтобы не ломать деплой.
+    Через общий пул соединений blockchain.near_rpc; ответ кэшируется на
+    NFT_INVENTORY_TTL_SECONDS, одновременные запросы одного аккаунта
+    склеиваются в один.
     """
+    key = (account_id.strip(), int(limit))
+    hit = _inventory.get(key)
+    if hit is not None and time.monotonic() - hit[0] < NFT_INVENTORY_TTL_SECONDS:
+        return hit[1]
+    items = await nft_cache.once(("inventory",) + key, lambda: _fetch_nfts(*key))
+    _inventory[key] = (time.monotonic(), items)
+    _inventory.move_to_end(key)
+    while len(_inventory) > NFT_INVENTORY_CACHE_MAX:
+        _inventory.popitem(last=False)
+    return items
+
+
+async def _fetch_nfts(account_id: str, limit: int) -> List[Dict[str, Any]]:
     safe_account = urllib.parse.quote(account_id.strip())
     url = f"{FASTNEAR_BASE}/account/{safe_account}/nfts?limit={int(limit)}"
 
-    data = await asyncio.to_thread(_fetch_json, url)
+    data = await near_rpc.get_json(url, timeout=20.0)
 
     # возможные формы ответа:
     # - list
@@ -0,0 +1,190 @@
+"""Общий клиент NEAR RPC: один долгоживущий httpx.AsyncClient на процесс.
+
+Раньше каждый view-вызов (картинка NFT, владелец токена, инвентарь пула,
+проверка оплаты кейса, балансы) открывал свой AsyncClient — новое TCP+TLS
+соединение на запрос, а прокси /api/near/rpc и индексер ходили через
+блокирующий urllib в потоке. Теперь все идут через пул keep-alive соединений
+(HTTP/1.1, по NEAR_RPC_HTTP2=1 — HTTP/2, если установлен пакет h2) с едиными
+таймаутами.
+
+Помощники:
+  * call(payload)  — сырой JSON-RPC (для прокси), ответ как есть;
+  * rpc / query / view_call / view_account — ошибки RPC и контракта
+    поднимаются как NearRpcError, HTTP-ошибки (429/5xx) — httpx.HTTPStatusError;
+  * tx_status(tx_hash, sender) — метод "tx";
+  * get_json(url) — GET к REST-индексеру (FastNEAR) тем же пулом."""
+from __future__ import annotations
+
+import base64
+import json
+import logging
+import os
+import time
+from collections import deque
+from typing import Any, Deque, Dict, Optional, Tuple
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+# Устойчивый NEAR RPC (публичный rpc.mainnet.near.org ложится при большом онлайне).
+NEAR_RPC_URL = os.getenv("NEAR_RPC_URL", "https://free.rpc.fastnear.com").strip() or "https://free.rpc.fastnear.com"
+NEAR_RPC_TIMEOUT_SECONDS = float(os.getenv("NEAR_RPC_TIMEOUT_SECONDS", "15"))
+NEAR_RPC_CONNECT_TIMEOUT_SECONDS = float(os.getenv("NEAR_RPC_CONNECT_TIMEOUT_SECONDS", "5"))
+NEAR_RPC_MAX_CONNECTIONS = int(os.getenv("NEAR_RPC_MAX_CONNECTIONS", "50"))
+NEAR_RPC_KEEPALIVE_CONNECTIONS = int(os.getenv("NEAR_RPC_KEEPALIVE_CONNECTIONS", "20"))
+NEAR_RPC_HTTP2 = os.getenv("NEAR_RPC_HTTP2", "0") == "1"
+
+_LATENCY_WINDOW = 512
+
+
+class NearRpcError(Exception):
+    """RPC ответил ошибкой (или упал view-вызов контракта)."""
+
+
+def _http2_available() -> bool:
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+class NearRpc:
+    def __init__(self, url: str = NEAR_RPC_URL):
+        self.url = url
+        self._client: Optional[httpx.AsyncClient] = None
+        self.requests: Dict[str, int] = {}
+        self.errors = 0
+        self._latency_s: Deque[float] = deque(maxlen=_LATENCY_WINDOW)
+
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None or self._client.is_closed:
+            http2 = NEAR_RPC_HTTP2 and _http2_available()
+            if NEAR_RPC_HTTP2 and not http2:
+                logger.warning("[NEAR_RPC] NEAR_RPC_HTTP2=1, but h2 is not installed — using HTTP/1.1")
+            self._client = httpx.AsyncClient(
+                http2=http2,
+                timeout=httpx.Timeout(NEAR_RPC_TIMEOUT_SECONDS, connect=NEAR_RPC_CONNECT_TIMEOUT_SECONDS),
+                limits=httpx.Limits(
+                    max_connections=NEAR_RPC_MAX_CONNECTIONS,
+                    max_keepalive_connections=NEAR_RPC_KEEPALIVE_CONNECTIONS,
+                ),
+                headers={"user-agent": "card-clash/1.0"},
+            )
+        return self._client
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    # ── JSON-RPC ─────────────────────────────────────────────────
+
+    async def call(self, payload: Dict[str, Any], timeout: Optional[float] = None) -> Any:
+        """Сырой JSON-RPC: ответ как есть, вместе с полем error и при любом
+        HTTP-статусе (для прокси /api/near/rpc)."""
+        return await self._post(payload, timeout, check_status=False)
+
+    async def rpc(self, method: str, params: Any, timeout: Optional[float] = None) -> Any:
+        """Поле result ответа; ошибка RPC — NearRpcError, HTTP 429/5xx —
+        httpx.HTTPStatusError."""
+        data = await self._post(
+            {"jsonrpc": "2.0", "id": "1", "method": method, "params": params}, timeout, check_status=True
+        )
+        if "error" in data:
+            self.errors += 1
+            raise NearRpcError(str(data["error"]))
+        return data.get("result")
+
+    async def query(self, params: Dict[str, Any], timeout: Optional[float] = None) -> Dict[str, Any]:
+        result = await self.rpc("query", params, timeout) or {}
+        # Ошибки исполнения view-вызова приходят внутри result.
+        if isinstance(result, dict) and "error" in result:
+            self.errors += 1
+            raise NearRpcError(str(result["error"]))
+        return result
+
+    async def view_call(self, contract_id: str, method_name: str, args: Dict[str, Any],
+                        finality: str = "final", timeout: Optional[float] = None) -> Any:
+        """View-метод контракта; возвращает декодированный JSON результата."""
+        value, _ = await self.view_call_with_height(contract_id, method_name, args, finality, timeout)
+        return value
+
+    async def view_call_with_height(self, contract_id: str, method_name: str, args: Dict[str, Any],
+                                    finality: str = "final",
+                                    timeout: Optional[float] = None) -> Tuple[Any, int]:
+        """То же, плюс высота блока, на которой RPC посчитал ответ."""
+        result = await self.query({
+            "request_type": "call_function",
+            "finality": finality,
+            "account_id": contract_id,
+            "method_name": method_name,
+            "args_base64": base64.b64encode(json.dumps(args).encode()).decode(),
+        }, timeout)
+        raw = result.get("result")
+        if raw is None:
+            raise NearRpcError(f"unexpected response: {result}")
+        value = json.loads(bytes(raw).decode()) if raw else None
+        return value, int(result.get("block_height") or 0)
+
+    async def view_account(self, account_id: str, finality: str = "final",
+                           timeout: Optional[float] = None) -> Dict[str, Any]:
+        return await self.query({
+            "request_type": "view_account",
+            "finality": finality,
+            "account_id": account_id,
+        }, timeout)
+
+    async def tx_status(self, tx_hash: str, sender_id: str, timeout: Optional[float] = None) -> Dict[str, Any]:
+        return await self.rpc("tx", [tx_hash, sender_id], timeout) or {}
+
+    async def _post(self, payload: Dict[str, Any], timeout: Optional[float], check_status: bool) -> Any:
+        method = str(payload.get("method", "?"))
+        self.requests[method] = self.requests.get(method, 0) + 1
+        t0 = time.monotonic()
+        try:
+            kwargs = {"timeout": timeout} if timeout is not None else {}
+            resp = await self.client().post(self.url, json=payload, **kwargs)
+            if check_status:
+                resp.raise_for_status()
+            return resp.json()
+        except Exception:
+            self.errors += 1
+            raise
+        finally:
+            self._latency_s.append(time.monotonic() - t0)
+
+    # ── REST-индексер ────────────────────────────────────────────
+
+    async def get_json(self, url: str, timeout: Optional[float] = None) -> Any:
+        self.requests["GET"] = self.requests.get("GET", 0) + 1
+        t0 = time.monotonic()
+        try:
+            kwargs = {"timeout": timeout} if timeout is not None else {}
+            resp = await self.client().get(url, headers={"accept": "application/json"}, **kwargs)
+            resp.raise_for_status()
+            return resp.json()
+        except Exception:
+            self.errors += 1
+            raise
+        finally:
+            self._latency_s.append(time.monotonic() - t0)
+
+    def stats(self) -> dict:
+        lat = sorted(s * 1000 for s in self._latency_s)
+
+        def pct(q: float) -> float:
+            return round(lat[min(len(lat) - 1, int(q * len(lat)))], 1) if lat else 0.0
+
+        return {
+            "url": self.url,
+            "requests": dict(self.requests),
+            "errors": self.errors,
+            "latency_ms_p50": pct(0.5),
+            "latency_ms_p95": pct(0.95),
+            "http2": bool(self._client is not None and NEAR_RPC_HTTP2 and _http2_available()),
+        }
+
+
+near_rpc = NearRpc()
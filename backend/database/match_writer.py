@@ -0,0 +1,192 @@
+"""Запись матчей в PvPMatch: только изменённые поля и со склейкой всплесков.
+
+Раньше каждое save_match открывало сессию, грузило весь PvPMatch, делало
+setattr на каждый ключ (с большими JSON-колодами) и коммитило. Теперь:
+
+  * для каждого матча помним, что уже лежит в БД (снимок колонок после
+    последней удачной записи или загрузки). Сохранение сравнивает match_data
+    со снимком и шлёт один UPDATE только изменившихся колонок; ничего не
+    поменялось — в БД не идём вовсе;
+  * матча в снимках ещё нет (новый или подгружен не целиком) —
+    INSERT ... ON CONFLICT (id) DO UPDATE по переданным колонкам;
+  * сохранения одного матча, пришедшие в пределах MATCH_WRITE_COALESCE_MS,
+    склеиваются в одну запись: все ждут один и тот же результат. Записи
+    одного матча идут строго по очереди, чтобы старая не обогнала новую.
+
+Строки ISO-времени из match_data (created_at, escrow_timeout_at, ...)
+приводятся к datetime колонок DateTime; нераспознанная строка в запись не
+попадает (колонка в БД остаётся как была)."""
+from __future__ import annotations
+
+import asyncio
+import copy
+import logging
+import os
+from datetime import datetime, timezone
+from typing import Dict, Optional, Tuple
+
+from sqlalchemy import DateTime, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from database.models.pvp_match import PvPMatch
+from database.session import get_session
+
+logger = logging.getLogger(__name__)
+
+MATCH_WRITE_COALESCE_MS = float(os.getenv("MATCH_WRITE_COALESCE_MS", "5"))
+
+_COLUMNS = {c.name: c for c in PvPMatch.__table__.columns if c.name != "id"}
+_DATETIME_COLUMNS = {name for name, c in _COLUMNS.items() if isinstance(c.type, DateTime)}
+
+
+_UNPARSEABLE = object()
+
+
+def _to_datetime(value):
+    if isinstance(value, str):
+        try:
+            value = datetime.fromisoformat(value.replace("Z", "+00:00"))
+        except ValueError:
+            return _UNPARSEABLE
+    if isinstance(value, datetime) and value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def match_row(match_data: Dict) -> Dict:
+    """Колонки PvPMatch из match_data (лишние ключи игнорируются)."""
+    row = {}
+    for key, value in match_data.items():
+        if key not in _COLUMNS:
+            continue
+        if key in _DATETIME_COLUMNS:
+            parsed = _to_datetime(value)
+            if parsed is _UNPARSEABLE:
+                # Кривая строка в памяти не должна затереть время в БД NULL-ом.
+                logger.warning("[MATCH_WRITER] match=%s bad %s=%r, column skipped",
+                               match_data.get("match_id"), key, value)
+                continue
+            value = parsed
+        row[key] = value
+    return row
+
+
+class MatchWriter:
+    def __init__(self, coalesce_ms: float = MATCH_WRITE_COALESCE_MS):
+        self.delay = coalesce_ms / 1000.0
+        # match_id -> {колонка: значение в БД}; JSON-значения — копии, т.к.
+        # match_data правится на месте.
+        self._persisted: Dict[str, Dict] = {}
+        self._pending: Dict[str, Tuple[Dict, asyncio.Future]] = {}
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self.saves = 0
+        self.coalesced = 0
+        self.skipped = 0
+        self.updates = 0
+        self.upserts = 0
+        self.columns_written = 0
+        self.failures = 0
+
+    async def save(self, match_data: Dict) -> bool:
+        mid = match_data["match_id"]
+        self.saves += 1
+        pending = self._pending.get(mid)
+        if pending is not None:
+            # Запись уже запланирована — пишем самое свежее состояние.
+            self.coalesced += 1
+            fut = pending[1]
+            self._pending[mid] = (match_data, fut)
+        else:
+            loop = asyncio.get_running_loop()
+            fut = loop.create_future()
+            self._pending[mid] = (match_data, fut)
+            loop.call_later(self.delay, self._start_flush, mid)
+        return await asyncio.shield(fut)
+
+    def seed(self, match_data: Dict):
+        """Матч только что прочитан из БД целиком — это и есть его снимок."""
+        mid = match_data.get("match_id")
+        if mid and mid not in self._persisted:
+            self._persisted[mid] = self._snapshot(match_row(match_data))
+
+    def forget(self, match_id: str):
+        self._persisted.pop(match_id, None)
+
+    # ── внутреннее ────────────────────────────────────────────────
+
+    def _start_flush(self, mid: str):
+        prev = self._inflight.get(mid)
+        self._inflight[mid] = asyncio.ensure_future(self._flush(mid, prev))
+
+    async def _flush(self, mid: str, prev: Optional[asyncio.Task]):
+        if prev is not None:
+            try:
+                await prev
+            except Exception:
+                pass
+        match_data, fut = self._pending.pop(mid)
+        try:
+            ok = await self._write(mid, match_data)
+        except Exception as e:
+            self.failures += 1
+            logger.warning("[MATCH_WRITER] save failed match=%s: %s", mid, e)
+            ok = False
+        if not fut.done():
+            fut.set_result(ok)
+        if self._inflight.get(mid) is asyncio.current_task():
+            del self._inflight[mid]
+
+    async def _write(self, mid: str, match_data: Dict) -> bool:
+        row = match_row(match_data)
+        snap = self._persisted.get(mid)
+        async for session in get_session():
+            if snap is not None:
+                changed = {k: v for k, v in row.items() if k not in snap or snap[k] != v}
+                if not changed:
+                    self.skipped += 1
+                    return True
+                result = await session.execute(
+                    update(PvPMatch).where(PvPMatch.id == mid).values(**changed)
+                )
+                if result.rowcount:
+                    await session.commit()
+                    self.updates += 1
+                    self.columns_written += len(changed)
+                    snap.update(self._snapshot(changed))
+                    return True
+                # Строки нет (удалили руками?) — вставим целиком ниже.
+            stmt = pg_insert(PvPMatch).values(id=mid, **row)
+            if row:
+                stmt = stmt.on_conflict_do_update(index_elements=[PvPMatch.id], set_=row)
+            else:
+                stmt = stmt.on_conflict_do_nothing(index_elements=[PvPMatch.id])
+            await session.execute(stmt)
+            await session.commit()
+            self.upserts += 1
+            self.columns_written += len(row)
+            if snap is None:
+                self._persisted[mid] = self._snapshot(row)
+            else:
+                snap.update(self._snapshot(row))
+            return True
+        return False
+
+    @staticmethod
+    def _snapshot(row: Dict) -> Dict:
+        return {k: copy.deepcopy(v) if isinstance(v, (list, dict)) else v for k, v in row.items()}
+
+    def stats(self) -> dict:
+        return {
+            "saves": self.saves,
+            "coalesced": self.coalesced,
+            "skipped_unchanged": self.skipped,
+            "updates": self.updates,
+            "upserts": self.upserts,
+            "columns_written": self.columns_written,
+            "failures": self.failures,
+            "tracked": len(self._persisted),
+            "pending": len(self._pending),
+        }
+
+
+match_writer = MatchWriter()
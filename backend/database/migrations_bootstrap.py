@@ -82,6 +82,21 @@ async def ensure_all_tables(engine):
             await conn.execute(text("""
                 CREATE INDEX IF NOT EXISTS idx_user_decks_user_id ON user_decks(user_id)
             """))
+            for col_name, col_type in (("deck_rating", "INTEGER"), ("deck_rating_sig", "VARCHAR(64)")):
+                try:
+                    check = await conn.execute(text(f"""
+                        SELECT EXISTS (
+                            SELECT FROM information_schema.columns
+                            WHERE table_name = 'user_decks' AND column_name = '{col_name}'
+                        )
+                    """))
+                    if not check.scalar():
+                        await conn.execute(text(
+                            f"ALTER TABLE user_decks ADD COLUMN {col_name} {col_type}"
+                        ))
+                        logger.info(f"[user_decks] Added column: {col_name}")
+                except Exception as e:
+                    logger.warning(f"[user_decks] Column {col_name}: {e}")
 
             # ── pvp_matches ────────────────────────────────────────────
             # Создаю таблицу если нет (с новой структурой)
@@ -136,6 +151,7 @@ async def ensure_all_tables(engine):
                 ("player1_hand",             "JSON",         "NULL"),
                 ("player2_hand",             "JSON",         "NULL"),
                 ("moves_count",              "INTEGER",      "0"),
+                ("event_log",                "JSON",         "NULL"),
                 ("player1_escrow_confirmed", "BOOLEAN",      "FALSE"),
                 ("player2_escrow_confirmed", "BOOLEAN",      "FALSE"),
                 ("player1_near_wallet",      "VARCHAR(255)", "NULL"),
@@ -209,6 +225,12 @@ async def ensure_all_tables(engine):
             await conn.execute(text("""
                 CREATE INDEX IF NOT EXISTS idx_match_deposits_player_id ON match_deposits(player_id)
             """))
+            # Реконсайлер возвратов читает только невозвращённые депозиты —
+            # частичный индекс остаётся крошечным, сколько бы матчей ни сыграли.
+            await conn.execute(text("""
+                CREATE INDEX IF NOT EXISTS idx_match_deposits_unrefunded
+                ON match_deposits(match_id) WHERE refunded = FALSE
+            """))
 
         logger.info("All tables ensured")
     except Exception as e:
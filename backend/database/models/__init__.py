@@ -3,6 +3,7 @@ from database.models.user import User
 from database.models.user_deck import UserDeck
 from database.models.pvp_match import PvPMatch
 from database.models.match_deposit import MatchDeposit
+from database.models.nft_token import NftToken
 from database.models.tournament import (
     Tournament,
     TournamentParticipant,
@@ -15,6 +16,7 @@ __all__ = [
     "UserDeck",
     "PvPMatch",
     "MatchDeposit",
+    "NftToken",
     "Tournament",
     "TournamentParticipant",
     "TournamentMatch",
@@ -0,0 +1,18 @@
+from sqlalchemy import Column, String, Integer, DateTime
+from sqlalchemy.sql import func
+from database.base import Base
+
+
+class NftToken(Base):
+    """Метаданные NFT (картинка, название, ранг из nft.json) и последний
+    известный владелец — нижний уровень кэша utils.nft_cache."""
+    __tablename__ = "nft_tokens"
+
+    contract_id = Column(String, primary_key=True)
+    token_id = Column(String, primary_key=True)
+    media = Column(String, nullable=True)
+    title = Column(String, nullable=True)
+    rank = Column(Integer, nullable=True)
+    owner_id = Column(String, nullable=True)
+    owner_checked_at = Column(DateTime, nullable=True)
+    updated_at = Column(DateTime, server_default=func.now(), onupdate=func.now())
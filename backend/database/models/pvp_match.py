@@ -24,6 +24,8 @@ class PvPMatch(Base):
     player1_hand = Column(JSON, default=list)
     player2_hand = Column(JSON, default=list)
     moves_count = Column(Integer, default=0)
+    # Журнал событий для реплея: сид, стартовые руки, ходы (см. game.replay)
+    event_log = Column(JSON, nullable=True)
 
     # Escrow
     player1_escrow_confirmed = Column(Boolean, default=False)
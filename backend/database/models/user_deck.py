@@ -10,4 +10,8 @@ class UserDeck(Base):
     user_id = Column(String, nullable=False, unique=True, index=True)
     cards = Column(JSON, default=list)      
     full_cards = Column(JSON, default=list)
+    # Рейтинг колоды по симуляции (game.balance) и сигнатура карт, для
+    # которых он посчитан: сменилась колода — сигнатура не совпадёт.
+    deck_rating = Column(Integer, nullable=True)
+    deck_rating_sig = Column(String, nullable=True)
     updated_at = Column(DateTime, server_default=func.now(), onupdate=func.now())
\ No newline at end of file
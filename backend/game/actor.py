@@ -0,0 +1,112 @@
+"""Актор живого матча: одна задача и один входящий ящик на партию.
+
+Ходы, подключения, дропы, срабатывания таймеров и отмены приходят сюда
+сообщениями и выполняются строго по очереди, поэтому MatchState никогда не
+меняют две корутины одновременно и ad-hoc локи не нужны. Заодно это
+единственное место, где видно, сколько сообщение простояло в очереди.
+
+post() — «выстрелил и забыл» (ход из сокета, таймер), call() — дождаться
+результата. call() изнутри самого актора выполняется сразу, без очереди,
+иначе актор ждал бы сам себя."""
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class MatchActor:
+    __slots__ = (
+        "match_id", "idle_timeout", "_inbox", "_task", "_on_exit",
+        "processed", "delay_last", "delay_max", "delay_total",
+    )
+
+    def __init__(
+            self,
+            match_id: str,
+            on_exit: Optional[Callable[["MatchActor"], None]] = None,
+            idle_timeout: float = 60.0,
+    ):
+        self.match_id = match_id
+        self.idle_timeout = idle_timeout
+        self._inbox: asyncio.Queue = asyncio.Queue()
+        self._task: Optional[asyncio.Task] = None
+        self._on_exit = on_exit
+        # Метрики очереди: сколько сообщений разобрано и их задержка в ящике.
+        self.processed = 0
+        self.delay_last = 0.0
+        self.delay_max = 0.0
+        self.delay_total = 0.0
+
+    @property
+    def depth(self) -> int:
+        return self._inbox.qsize()
+
+    def in_actor(self) -> bool:
+        return self._task is not None and asyncio.current_task() is self._task
+
+    def post(self, fn: Callable[..., Awaitable[Any]], *args,
+             _fut: Optional[asyncio.Future] = None):
+        self._inbox.put_nowait((time.perf_counter(), fn, args, _fut))
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def call(self, fn: Callable[..., Awaitable[Any]], *args) -> Any:
+        if self.in_actor():
+            return await fn(*args)
+        fut = asyncio.get_running_loop().create_future()
+        self.post(fn, *args, _fut=fut)
+        return await fut
+
+    async def _run(self):
+        inbox = self._inbox
+        while True:
+            try:
+                enqueued, fn, args, fut = await asyncio.wait_for(inbox.get(), self.idle_timeout)
+            except asyncio.TimeoutError:
+                if inbox.empty():
+                    # Между проверкой и выходом нет await — post() не потеряется:
+                    # он увидит завершённую задачу и поднимет новую.
+                    if self._on_exit is not None:
+                        self._on_exit(self)
+                    return
+                continue
+            except asyncio.CancelledError:
+                return
+
+            delay = time.perf_counter() - enqueued
+            self.processed += 1
+            self.delay_last = delay
+            self.delay_total += delay
+            if delay > self.delay_max:
+                self.delay_max = delay
+
+            if fut is not None and fut.cancelled():
+                continue
+            try:
+                result = await fn(*args)
+            except asyncio.CancelledError:
+                if fut is not None and not fut.done():
+                    fut.cancel()
+                return
+            except Exception as e:
+                if fut is not None and not fut.done():
+                    fut.set_exception(e)
+                else:
+                    logger.exception("[ACTOR] match=%s %s failed: %s",
+                                     self.match_id, getattr(fn, "__name__", fn), e)
+                continue
+            if fut is not None and not fut.done():
+                fut.set_result(result)
+
+    def stats(self) -> dict:
+        return {
+            "inbox": self.depth,
+            "processed": self.processed,
+            "queue_delay_last_ms": round(self.delay_last * 1000, 3),
+            "queue_delay_max_ms": round(self.delay_max * 1000, 3),
+            "queue_delay_avg_ms": round(self.delay_total / self.processed * 1000, 3) if self.processed else 0.0,
+        }
@@ -0,0 +1,410 @@
+"""Серверный бот: поиск хода по полю 3x3 в пуле процессов.
+
+Рука соперника боту не видна (клиенту тоже приходит только её размер),
+поэтому поиск — expectiminimax с узлом случайности в корне: неизвестные
+карты соперника разыгрываются из того же распределения рангов, что и
+случайная рука, для каждой такой раздачи считается negamax с альфа-бета
+отсечением, и оценки ходов усредняются. Уровень сложности (TIERS) задаёт
+глубину, бюджет времени на ход, число раздач и долю «зевков»; «hard»
+играет с открытыми картами соперника.
+
+Позиция внутри поиска — плоские списки owners/eff, как в game.engine, плюс
+битовые маски рук. Таблица транспозиций ключуется 64-битным Zobrist-хэшем
+(карта в клетке + владелец клетки + чей ход), хэш обновляется XOR-ом на
+каждом ходе/откате. Глубина растёт итеративно, пока не кончится бюджет
+времени на ход; берётся результат последней завершённой глубины.
+
+search() — чистая функция над picklable-позицией: её гоняет
+ProcessPoolExecutor, и цикл событий не блокируется ни на миллисекунду."""
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from game.engine import _EFF, ACE_VALUE, EMPTY, NEIGHBORS, P1, P2, MatchState, cell_elements
+
+logger = logging.getLogger(__name__)
+
+BOT_POOL_WORKERS = int(os.getenv("BOT_POOL_WORKERS", "2"))
+BOT_DEFAULT_TIER = os.getenv("BOT_DEFAULT_TIER", "normal")
+BOT_ID_PREFIX = "bot:"
+
+# Размер таблицы транспозиций на одну раздачу (записей), дальше — сброс.
+_TT_MAX = 200_000
+_WIN = 1000
+_INF = 10 ** 6
+
+
+class Tier(NamedTuple):
+    depth: int        # предельная глубина (полуходов)
+    budget: float     # секунд на ход
+    samples: int      # раздач неизвестной руки соперника
+    blunder: float    # вероятность сыграть случайный ход
+    peek: bool        # играет с открытыми картами соперника
+
+
+TIERS: Dict[str, Tier] = {
+    "easy": Tier(depth=1, budget=0.15, samples=1, blunder=0.35, peek=False),
+    "normal": Tier(depth=3, budget=0.6, samples=4, blunder=0.05, peek=False),
+    # Глубже с угаданной рукой соперника поиск почти не усиливается — шум
+    # раздач съедает выигрыш. «Сложный» бот поэтому видит руку целиком.
+    "hard": Tier(depth=9, budget=1.5, samples=1, blunder=0.0, peek=True),
+}
+
+
+def bot_id(tier: str) -> str:
+    return BOT_ID_PREFIX + (tier if tier in TIERS else BOT_DEFAULT_TIER)
+
+
+def is_bot(player_id) -> bool:
+    return str(player_id or "").startswith(BOT_ID_PREFIX)
+
+
+def tier_of(player_id) -> str:
+    tier = str(player_id)[len(BOT_ID_PREFIX):]
+    return tier if tier in TIERS else BOT_DEFAULT_TIER
+
+
+# ── позиция ────────────────────────────────────────────────────────
+
+def position_for(state: MatchState, player_id: str, peek: bool = False) -> dict:
+    """Всё, что видно игроку player_id, в picklable-виде для пула процессов.
+    peek — добавить и руку соперника (opp_hand), иначе только её размер."""
+    me = state.owner_code(player_id)
+    opp_hand = state.player2_hand if me == P1 else state.player1_hand
+    return {
+        "me": me,
+        "owners": list(state.owners),
+        "eff": list(state.eff),
+        "cell_elems": cell_elements(state.board_elements),
+        "hand": [(c.sides, c.element) for c in state.get_hand(player_id)],
+        "opp_count": len(opp_hand),
+        "opp_hand": [(c.sides, c.element) for c in opp_hand] if peek else None,
+    }
+
+
+# Распределение рангов случайной руки (как _make_random_hand в ws_match).
+_RANKS = ((1, 5, 0.0, 30), (2, 7, 0.0, 35), (3, 8, 0.20, 25), (4, 9, 0.50, 10))
+_ELEMENTS = ("Earth", "Fire", "Water", "Poison", "Holy", "Thunder", "Wind", "Ice")
+
+
+def _sample_card(rng: random.Random) -> tuple:
+    lo, hi, ace, _ = rng.choices(_RANKS, weights=[r[3] for r in _RANKS], k=1)[0]
+    sides = [rng.randint(lo, hi) for _ in range(4)]
+    if ace and rng.random() < ace:
+        sides[rng.randrange(4)] = ACE_VALUE
+    return tuple(sides), rng.choice(_ELEMENTS)
+
+
+# Zobrist: слот карты (0..4 — мои, 5..9 — соперника) в клетке, владелец
+# клетки, очередь хода. Сид фиксированный — ключи одинаковы во всех воркерах.
+_zr = random.Random(0x5EED)
+_Z_CARD = tuple(tuple(_zr.getrandbits(64) for _ in range(10)) for _ in range(9))
+_Z_OWN = tuple((0, _zr.getrandbits(64), _zr.getrandbits(64)) for _ in range(9))
+_Z_TURN = _zr.getrandbits(64)
+del _zr
+
+
+class _Timeout(Exception):
+    pass
+
+
+class _Search:
+    """Один прогон negamax по одной раздаче. Состояние мутируется и
+    откатывается на месте — без копий на узел."""
+
+    def __init__(self, pos: dict, opp_cards: List[tuple], deadline: float):
+        self.me = pos["me"]
+        self.opp = P2 if self.me == P1 else P1
+        self.owners = list(pos["owners"])
+        self.eff = list(pos["eff"])
+        elems = pos["cell_elems"]
+        cards = list(pos["hand"]) + list(opp_cards)
+        self.n_mine = len(pos["hand"])
+        # card_eff[slot][cell] — стороны карты с учётом стихии клетки.
+        self.card_eff = []
+        for sides, element in cards:
+            per_cell = []
+            for cell in range(9):
+                ce = elems[cell]
+                row = _EFF[0] if not ce else (_EFF[1] if element == ce else _EFF[-1])
+                per_cell.append(tuple(row[s] for s in sides))
+            self.card_eff.append(per_cell)
+        self.masks = {
+            self.me: (1 << self.n_mine) - 1,
+            self.opp: ((1 << len(cards)) - 1) ^ ((1 << self.n_mine) - 1),
+        }
+        self.filled = sum(1 for o in self.owners if o != EMPTY)
+        self.hash = 0
+        for cell, o in enumerate(self.owners):
+            if o != EMPTY:
+                self.hash ^= _Z_OWN[cell][o]
+        self.tt: Dict[int, tuple] = {}
+        self.deadline = deadline
+        self.nodes = 0
+        self.tt_hits = 0
+
+    # ── ход / откат ────────────────────────────────────────────────
+
+    def _do(self, side: int, slot: int, cell: int) -> List[int]:
+        owners, eff = self.owners, self.eff
+        base = cell * 4
+        eff[base:base + 4] = self.card_eff[slot][cell]
+        owners[cell] = side
+        h = self.hash ^ _Z_CARD[cell][slot] ^ _Z_OWN[cell][side] ^ _Z_TURN
+        flipped = []
+        for ni, a, b in NEIGHBORS[cell]:
+            o = owners[ni]
+            if o != EMPTY and o != side and eff[a] > eff[b]:
+                owners[ni] = side
+                h ^= _Z_OWN[ni][o] ^ _Z_OWN[ni][side]
+                flipped.append(ni)
+        self.hash = h
+        self.masks[side] ^= 1 << slot
+        self.filled += 1
+        return flipped
+
+    def _undo(self, side: int, slot: int, cell: int, flipped: List[int]):
+        other = P2 if side == P1 else P1
+        owners = self.owners
+        h = self.hash ^ _Z_CARD[cell][slot] ^ _Z_OWN[cell][side] ^ _Z_TURN
+        for ni in flipped:
+            owners[ni] = other
+            h ^= _Z_OWN[ni][side] ^ _Z_OWN[ni][other]
+        owners[cell] = EMPTY
+        self.hash = h
+        self.masks[side] ^= 1 << slot
+        self.filled -= 1
+
+    def _moves(self, side: int) -> List[Tuple[int, int]]:
+        mask = self.masks[side]
+        slots = [s for s in range(10) if mask >> s & 1]
+        empty = [c for c in range(9) if self.owners[c] == EMPTY]
+        return [(s, c) for s in slots for c in empty]
+
+    # ── оценка ─────────────────────────────────────────────────────
+
+    def _evaluate(self, side: int) -> int:
+        owners, eff = self.owners, self.eff
+        mine = theirs = 0
+        exposure = 0
+        for cell in range(9):
+            o = owners[cell]
+            if o == EMPTY:
+                continue
+            if o == side:
+                mine += 1
+            else:
+                theirs += 1
+            # Слабые стороны, смотрящие в пустые клетки, — будущие захваты.
+            for ni, a, _ in NEIGHBORS[cell]:
+                if owners[ni] == EMPTY:
+                    d = eff[a] - 5
+                    exposure += d if o == side else -d
+        if self.filled == 9:
+            # Ничья по правилам движка — победа player1.
+            p1 = mine if side == P1 else theirs
+            p2 = theirs if side == P1 else mine
+            won = (P2 if p2 > p1 else P1) == side
+            return (_WIN if won else -_WIN) + (mine - theirs)
+        return 8 * (mine - theirs) + exposure
+
+    # ── negamax ────────────────────────────────────────────────────
+
+    def negamax(self, side: int, depth: int, alpha: int, beta: int) -> int:
+        self.nodes += 1
+        if self.nodes & 1023 == 0 and time.perf_counter() > self.deadline:
+            raise _Timeout()
+        if depth == 0 or self.filled == 9 or not self.masks[side]:
+            return self._evaluate(side)
+
+        key = self.hash
+        entry = self.tt.get(key)
+        best_move = None
+        if entry is not None:
+            e_depth, e_val, e_flag, best_move = entry
+            if e_depth >= depth:
+                self.tt_hits += 1
+                if e_flag == 0:
+                    return e_val
+                if e_flag > 0:
+                    alpha = max(alpha, e_val)
+                else:
+                    beta = min(beta, e_val)
+                if alpha >= beta:
+                    return e_val
+
+        moves = self._moves(side)
+        if best_move in moves:
+            moves.remove(best_move)
+            moves.insert(0, best_move)
+
+        other = P2 if side == P1 else P1
+        alpha0 = alpha
+        best = -_INF
+        for move in moves:
+            slot, cell = move
+            flipped = self._do(side, slot, cell)
+            try:
+                val = -self.negamax(other, depth - 1, -beta, -alpha)
+            finally:
+                self._undo(side, slot, cell, flipped)
+            if val > best:
+                best, best_move = val, move
+            if val > alpha:
+                alpha = val
+            if alpha >= beta:
+                break
+
+        flag = 0 if alpha0 < best < beta else (1 if best >= beta else -1)
+        if len(self.tt) >= _TT_MAX:
+            self.tt.clear()
+        self.tt[key] = (depth, best, flag, best_move)
+        return best
+
+    def root(self, depth: int) -> Dict[Tuple[int, int], int]:
+        """Точные оценки каждого хода из корня (полное окно: их потом
+        усредняем по раздачам, границы тут не годятся)."""
+        out = {}
+        side, other = self.me, self.opp
+        for slot, cell in self._moves(side):
+            flipped = self._do(side, slot, cell)
+            try:
+                out[(slot, cell)] = -self.negamax(other, depth - 1, -_INF, _INF)
+            finally:
+                self._undo(side, slot, cell, flipped)
+        return out
+
+
+def search(pos: dict, tier: str = BOT_DEFAULT_TIER, seed: Optional[int] = None,
+           budget: Optional[float] = None) -> dict:
+    """Выбор хода для позиции position_for(). Возвращает card_index (в руке),
+    cell_index и статистику поиска. Выполняется в процессе пула."""
+    t0 = time.perf_counter()
+    cfg = TIERS.get(tier) or TIERS[BOT_DEFAULT_TIER]
+    budget = cfg.budget if budget is None else budget
+    rng = random.Random(seed)
+    empty = [c for c in range(9) if pos["owners"][c] == EMPTY]
+    if not pos["hand"] or not empty:
+        return {"card_index": None, "cell_index": None}
+
+    max_depth = min(cfg.depth, len(empty))
+    # Раздачи фиксируем заранее и углубляемся по ним синхронно: усреднять
+    # можно только оценки одной глубины (чёт/нечет полуходов смещают оценку).
+    deadline = t0 + budget
+    if pos.get("opp_hand") is not None:
+        searches = [_Search(pos, pos["opp_hand"], deadline)]
+    else:
+        searches = [
+            _Search(pos, [_sample_card(rng) for _ in range(pos["opp_count"])], deadline)
+            for _ in range(max(1, cfg.samples))
+        ]
+    totals: Dict[Tuple[int, int], int] = {}
+    reached = 0
+    for depth in range(1, max_depth + 1):
+        layer: Dict[Tuple[int, int], int] = {}
+        try:
+            for s in searches:
+                for move, val in s.root(depth).items():
+                    layer[move] = layer.get(move, 0) + val
+        except _Timeout:
+            break
+        totals, reached = layer, depth
+    if not reached:
+        # Не успели даже глубину 1 — её и досчитываем без лимита.
+        for s in searches:
+            s.deadline = float("inf")
+            for move, val in s.root(1).items():
+                totals[move] = totals.get(move, 0) + val
+        reached = 1
+    done = len(searches)
+    nodes = sum(s.nodes for s in searches)
+    tt_hits = sum(s.tt_hits for s in searches)
+
+    ranked = sorted(totals.items(), key=lambda kv: kv[1], reverse=True)
+    if cfg.blunder and rng.random() < cfg.blunder:
+        (slot, cell), _ = rng.choice(ranked)
+    else:
+        top = ranked[0][1]
+        (slot, cell), _ = rng.choice([kv for kv in ranked if kv[1] == top])
+    return {
+        "card_index": slot,
+        "cell_index": cell,
+        "value": totals[(slot, cell)] / done,
+        "depth": reached,
+        "samples": done,
+        "nodes": nodes,
+        "tt_hits": tt_hits,
+        "ms": round((time.perf_counter() - t0) * 1000, 3),
+    }
+
+
+# ── пул процессов ──────────────────────────────────────────────────
+
+_pool: Optional[ProcessPoolExecutor] = None
+_stats = {"searches": 0, "fallbacks": 0, "pool_restarts": 0, "ms_last": 0.0, "ms_max": 0.0, "nodes_total": 0}
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=BOT_POOL_WORKERS)
+    return _pool
+
+
+def _drop_pool(pool: ProcessPoolExecutor):
+    """Сломанный или зависший пул — выбрасываем, следующий ход поднимет новый.
+    Воркер, застрявший в поиске, доработает и выйдет сам, а новые ходы не
+    встанут в очередь за ним."""
+    global _pool
+    if _pool is pool:
+        _pool = None
+        _stats["pool_restarts"] += 1
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+async def choose_move(state: MatchState, player_id: str) -> Tuple[Optional[int], Optional[int]]:
+    """Ход бота player_id в текущей позиции: (card_index, cell_index).
+    Поиск — в пуле процессов; если пул недоступен, мелкий поиск в потоке."""
+    tier = tier_of(player_id)
+    pos = position_for(state, player_id, peek=TIERS[tier].peek)
+    seed = random.getrandbits(32)
+    budget = TIERS[tier].budget
+    loop = asyncio.get_running_loop()
+    pool = _get_pool()
+    try:
+        fut = loop.run_in_executor(pool, search, pos, tier, seed)
+        result = await asyncio.wait_for(fut, budget + 2.0)
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        if isinstance(e, (BrokenProcessPool, asyncio.TimeoutError)):
+            _drop_pool(pool)
+        logger.warning("[BOT] pool search failed (%r), match=%s tier=%s downgraded to easy",
+                       e, state.match_id, tier)
+        _stats["fallbacks"] += 1
+        # Не в event loop: даже короткий поиск не должен держать остальные матчи.
+        result = await asyncio.to_thread(search, pos, "easy", seed, 0.02)
+    _stats["searches"] += 1
+    _stats["ms_last"] = result.get("ms", 0.0)
+    _stats["ms_max"] = max(_stats["ms_max"], _stats["ms_last"])
+    _stats["nodes_total"] += result.get("nodes", 0)
+    logger.debug("[BOT] match=%s tier=%s move=%s", state.match_id, tier, result)
+    return result["card_index"], result["cell_index"]
+
+
+def shutdown():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+def stats() -> dict:
+    return {"workers": BOT_POOL_WORKERS, "pool_started": _pool is not None, **_stats}
@@ -0,0 +1,300 @@
+"""Рейтинг колоды по симуляции партий (замена суммы сторон deck_power).
+
+Сумма сторон не видит ни стихий, ни тузов (10), ни стихий клеток поля.
+Здесь колода играет пачку партий против фиксированного эталонного пула
+колод (сид постоянный — рейтинг воспроизводим), и рейтинг — это доля побед
+в промилле: 500 — «средняя» случайная колода, 1000 — выигрывает всё.
+
+Партии идут пачкой в массивах NumPy: G партий сразу, один шаг цикла — один
+полуход во всех партиях. Правила те же, что у game.engine (та же таблица
+_EFF для стихий, те же соседи и строгое «больше» при захвате, ничья — победа
+player1). Ходы — жадная политика с шумом: карта/клетка с максимумом захватов
+на этом ходу, при равенстве случайно; greedy=0 даёт чисто случайную игру.
+
+Без NumPy работает медленный запасной путь на самом game.engine с меньшим
+числом партий — шкала та же, только шумнее."""
+from __future__ import annotations
+
+import hashlib
+import os
+import random
+import time
+from collections import OrderedDict
+from typing import List, Optional, Sequence, Tuple
+
+from game.engine import _EFF, ELEMENTS, EMPTY, NEIGHBORS, MatchState, normalize_card
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - numpy не установлен
+    np = None
+
+DECK_RATING_GAMES = int(os.getenv("DECK_RATING_GAMES", "2048"))
+DECK_RATING_GREEDY = float(os.getenv("DECK_RATING_GREEDY", "1.0"))
+# Версия шкалы: меняется вместе с пулом/политикой — старые рейтинги в БД
+# тогда пересчитываются (она входит в сигнатуру колоды).
+RATING_VERSION = 1
+
+_REFERENCE_DECKS = 64
+_REFERENCE_SEED = 20240611
+_ELEMENT_CHANCE = 0.38  # как board_elements в try_start_game
+_CACHE_MAX = 4096
+_CHUNK = 2048
+
+_OPP_SIDE = (2, 3, 0, 1)  # top<->bottom, right<->left
+
+
+def _neighbor_table() -> List[List[int]]:
+    """NBR[cell][side] — соседняя клетка в сторону side, 9 = за краем поля."""
+    table = []
+    for idx in range(9):
+        x, y = idx % 3, idx // 3
+        row = []
+        for dx, dy in ((0, -1), (1, 0), (0, 1), (-1, 0)):
+            nx, ny = x + dx, y + dy
+            row.append(ny * 3 + nx if 0 <= nx <= 2 and 0 <= ny <= 2 else 9)
+        table.append(row)
+    return table
+
+
+_NBR = _neighbor_table()
+
+
+# ── колода → массивы ───────────────────────────────────────────────
+
+def deck_cards(deck: Sequence[dict]) -> List[Tuple[tuple, int]]:
+    """Карты колоды в том виде, в каком их увидит движок: (стороны, индекс стихии)."""
+    out = []
+    for card in list(deck or [])[:5]:
+        rec = normalize_card(card if isinstance(card, dict) else {})
+        out.append((rec.sides, ELEMENTS.index(rec.element)))
+    return out
+
+
+def deck_signature(deck: Sequence[dict]) -> str:
+    """Ключ кэша рейтинга: порядок карт в колоде на рейтинг не влияет."""
+    cards = sorted(deck_cards(deck))
+    raw = f"v{RATING_VERSION}:" + ";".join(f"{s}/{e}" for s, e in cards)
+    return hashlib.sha1(raw.encode()).hexdigest()[:32]
+
+
+def _reference_pool() -> List[List[Tuple[tuple, int]]]:
+    """Эталонные соперники: случайные руки из того же распределения рангов,
+    что и у _make_random_hand/бота."""
+    from game.ai import _sample_card
+
+    rng = random.Random(_REFERENCE_SEED)
+    pool = []
+    for _ in range(_REFERENCE_DECKS):
+        pool.append([(sides, ELEMENTS.index(elem))
+                     for sides, elem in (_sample_card(rng) for _ in range(5))])
+    return pool
+
+
+_POOL = _reference_pool()
+
+
+# ── пакетная симуляция (NumPy) ─────────────────────────────────────
+
+if np is not None:
+    _EFF_NP = np.array(_EFF, dtype=np.int8)          # [бонус 0/+1/-1][база]
+    _NBR_NP = np.array(_NBR, dtype=np.intp)           # (9, 4)
+    _OPP_NP = np.array(_OPP_SIDE, dtype=np.intp)      # (4,)
+    _POOL_SIDES = np.array([[s for s, _ in d] for d in _POOL], dtype=np.int8)  # (R, 5, 4)
+    _POOL_ELEMS = np.array([[e for _, e in d] for d in _POOL], dtype=np.int8)  # (R, 5)
+
+
+def play_batch(sides1, elems1, sides2, elems2, cell_elems, p1_first, rng, greedy: float = 1.0):
+    """G партий разом. sides* — (G, 5, 4) базовые значения сторон, elems* —
+    (G, 5) индексы стихий карт, cell_elems — (G, 9) стихия клетки или -1,
+    p1_first — (G,) bool. Возвращает (G,) bool: победил player1."""
+    G = sides1.shape[0]
+    ar = np.arange(G)
+    rows = ar[:, None]
+    p1_first = np.asarray(p1_first, dtype=bool)
+
+    # Эффективные стороны каждой карты в каждой клетке: (G, 5, 9, 4).
+    def eff_cards(sides, elems):
+        ce = cell_elems[:, None, :]                    # (G, 1, 9)
+        bonus = np.where(ce < 0, 0, np.where(elems[:, :, None] == ce, 1, 2))  # (G, 5, 9)
+        return _EFF_NP[bonus[..., None], sides[:, :, None, :]]
+
+    # Внутри цикла стороны — не player1/player2, а «кто ходит первым» (1) и
+    # «вторым» (2): тогда на чётном шаге ходит 1, на нечётном 2 во ВСЕХ
+    # партиях сразу, и руку не надо выбирать по партиям на каждом шаге.
+    e1, e2 = eff_cards(sides1, elems1), eff_cards(sides2, elems2)
+    pick = p1_first[:, None, None, None]
+    hands = (np.where(pick, e1, e2), np.where(pick, e2, e1))
+
+    owners = np.zeros((G, 10), dtype=np.int8)          # клетка 9 — «за краем»
+    eff = np.zeros((G, 10, 4), dtype=np.int8)
+    used = (np.zeros((G, 5), dtype=bool), np.zeros((G, 5), dtype=bool))
+    noise = rng.random((9, G, 5, 9), dtype=np.float32)
+
+    for step in range(9):
+        side = step % 2
+        mover, other = (1, 2) if side == 0 else (2, 1)
+        effm = hands[side]                             # (G, 5, 9, 4)
+
+        valid = ~used[side][:, :, None] & (owners[:, None, :9] == EMPTY)  # (G, 5, 9)
+        score = noise[step]
+        if greedy:
+            defend = eff[:, _NBR_NP, _OPP_NP]          # (G, 9, 4)
+            enemy = owners[:, _NBR_NP] == other
+            flips = ((effm > defend[:, None]) & enemy[:, None]).sum(-1, dtype=np.int8)
+            score = score + np.float32(greedy) * flips
+        score = np.where(valid, score, np.float32(-1.0))
+        choice = score.reshape(G, -1).argmax(1)
+        k, cell = choice // 9, choice % 9
+
+        placed = effm[ar, k, cell]                     # (G, 4)
+        eff[ar, cell] = placed
+        owners[ar, cell] = mover
+        used[side][ar, k] = True
+
+        nbr = _NBR_NP[cell]                            # (G, 4)
+        cap = (owners[rows, nbr] == other) & (placed > eff[rows, nbr, _OPP_NP])
+        owners[rows, nbr] = np.where(cap, np.int8(mover), owners[rows, nbr])
+
+    board = owners[:, :9]
+    first, second = (board == 1).sum(1), (board == 2).sum(1)
+    p1, p2 = np.where(p1_first, first, second), np.where(p1_first, second, first)
+    return p2 <= p1
+
+
+def _rate_numpy(cards: List[Tuple[tuple, int]], games: int, seed: int) -> float:
+    rng = np.random.default_rng(seed)
+    R = len(_POOL)
+    half = max(1, games // 2)
+    mine_sides = np.array([s for s, _ in cards], dtype=np.int8)
+    mine_elems = np.array([e for _, e in cards], dtype=np.int8)
+    wins = 0
+    # Кусками по _CHUNK партий: массивы остаются в кэше процессора, а офлайн-
+    # прогон на миллионы партий не съедает гигабайты памяти.
+    for start in range(0, half, _CHUNK):
+        n = min(_CHUNK, half - start)
+        ref = np.arange(start, start + n) % R
+        sides = np.broadcast_to(mine_sides, (n, 5, 4))
+        elems = np.broadcast_to(mine_elems, (n, 5))
+        cell_elems = np.where(rng.random((2 * n, 9)) < _ELEMENT_CHANCE,
+                              rng.integers(0, len(ELEMENTS), (2 * n, 9)), -1).astype(np.int8)
+        first = rng.random(2 * n) < 0.5
+        # Половина партий — колода за player1, половина — за player2 (ничья
+        # достаётся player1, иначе рейтинг зависел бы от места).
+        won_as_p1 = play_batch(sides, elems, _POOL_SIDES[ref], _POOL_ELEMS[ref],
+                               cell_elems[:n], first[:n], rng, DECK_RATING_GREEDY)
+        won_as_p2 = ~play_batch(_POOL_SIDES[ref], _POOL_ELEMS[ref], sides, elems,
+                                cell_elems[n:], first[n:], rng, DECK_RATING_GREEDY)
+        wins += int(won_as_p1.sum()) + int(won_as_p2.sum())
+    return wins / (2 * half)
+
+
+# ── запасной путь без NumPy ────────────────────────────────────────
+
+def _to_records(cards: List[Tuple[tuple, int]]) -> list:
+    return [normalize_card({"id": f"s{i}",
+                            "values": dict(zip(("top", "right", "bottom", "left"), sides)),
+                            "element": ELEMENTS[e]})
+            for i, (sides, e) in enumerate(cards)]
+
+
+def _policy_move(st: MatchState, pid: str, rng: random.Random) -> Tuple[int, int]:
+    """Та же политика, что в play_batch: шум [0, 1) + greedy * захваты."""
+    code = st.owner_code(pid)
+    owners, eff = st.owners, st.eff
+    best, best_move = -1.0, (0, 0)
+    for k, card in enumerate(st.get_hand(pid)):
+        for cell in range(9):
+            if owners[cell] != EMPTY:
+                continue
+            score = rng.random()
+            if DECK_RATING_GREEDY:
+                ce = st._cell_elems[cell]
+                row = _EFF[0] if not ce else (_EFF[1] if card.element == ce else _EFF[-1])
+                flips = 0
+                for ni, a_off, b_off in NEIGHBORS[cell]:
+                    o = owners[ni]
+                    if o != EMPTY and o != code and row[card.sides[a_off - cell * 4]] > eff[b_off]:
+                        flips += 1
+                score += DECK_RATING_GREEDY * flips
+            if score > best:
+                best, best_move = score, (k, cell)
+    return best_move
+
+
+def _rate_python(cards: List[Tuple[tuple, int]], games: int, seed: int) -> float:
+    rng = random.Random(seed)
+    wins = 0
+    for g in range(games):
+        ref = _POOL[(g // 2) % len(_POOL)]
+        mine_p1 = g % 2 == 0
+        h1, h2 = (cards, ref) if mine_p1 else (ref, cards)
+        board = [rng.choice(ELEMENTS) if rng.random() < _ELEMENT_CHANCE else None for _ in range(9)]
+        st = MatchState("sim", "a", "b", _to_records(h1), _to_records(h2), board, rng.choice(("a", "b")))
+        while st.status == "active":
+            pid = st.current_turn
+            st.apply_move(pid, *_policy_move(st, pid, rng))
+        wins += (st.winner == "a") == mine_p1
+    return wins / games
+
+
+# ── API ────────────────────────────────────────────────────────────
+
+_cache: "OrderedDict[str, int]" = OrderedDict()
+_stats = {"rated": 0, "cache_hits": 0, "ms_last": 0.0, "ms_max": 0.0}
+
+
+def rate_deck(deck: Sequence[dict], games: Optional[int] = None) -> int:
+    """Рейтинг колоды 0..1000 (промилле побед против эталонного пула).
+    Сид выводится из сигнатуры — одна и та же колода всегда получает один
+    и тот же рейтинг. CPU-bound: из async-кода звать через to_thread."""
+    sig = deck_signature(deck)
+    cached = _cache.get(sig)
+    if cached is not None:
+        _cache.move_to_end(sig)
+        _stats["cache_hits"] += 1
+        return cached
+
+    cards = deck_cards(deck)
+    if len(cards) < 5:
+        return 0
+    t0 = time.perf_counter()
+    seed = int(sig[:8], 16)
+    if np is not None:
+        p = _rate_numpy(cards, games or DECK_RATING_GAMES, seed)
+    else:
+        p = _rate_python(cards, min(games or DECK_RATING_GAMES, 128), seed)
+    rating = int(round(float(p) * 1000))
+
+    ms = (time.perf_counter() - t0) * 1000
+    _stats["rated"] += 1
+    _stats["ms_last"] = ms
+    _stats["ms_max"] = max(_stats["ms_max"], ms)
+    _cache[sig] = rating
+    if len(_cache) > _CACHE_MAX:
+        _cache.popitem(last=False)
+    return rating
+
+
+def cached_rating(deck: Sequence[dict]) -> Optional[int]:
+    """Рейтинг из памяти процесса без симуляции; None — ещё не считали."""
+    rating = _cache.get(deck_signature(deck))
+    if rating is not None:
+        _stats["cache_hits"] += 1
+    return rating
+
+
+def remember(deck: Sequence[dict], rating: int):
+    """Положить в кэш рейтинг, уже посчитанный ранее (например, из БД)."""
+    _cache[deck_signature(deck)] = int(rating)
+    if len(_cache) > _CACHE_MAX:
+        _cache.popitem(last=False)
+
+
+def stats() -> dict:
+    return {
+        "numpy": np is not None,
+        "games_per_rating": DECK_RATING_GAMES,
+        "cached": len(_cache),
+        **{k: round(v, 3) if isinstance(v, float) else v for k, v in _stats.items()},
+    }
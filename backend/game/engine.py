@@ -0,0 +1,465 @@
+"""Компактный игровой движок партии 3x3 (серверная авторитетная логика).
+
+Поле хранится не списком словарей, а плоскими массивами: владелец клетки
+(bytearray, 0 = пусто, 1 = player1, 2 = player2) и эффективные значения
+сторон уже выложенных карт (bytearray по 4 байта на клетку). Элемент клетки
+не меняется, карта после выкладки не двигается — поэтому бонус/штраф стихии
+считается ОДИН раз при выкладке, а захват превращается в сравнение двух байт
+по статической таблице соседей. Правила 1:1 совпадают с прежними
+WSManager._resolve_placement / _check_game_over."""
+from __future__ import annotations
+
+import random
+from typing import Any, List, NamedTuple, Optional, Sequence
+
+from game.wire import compose, dumps
+
+ACE_VALUE = 10
+ELEMENTS = ("Earth", "Fire", "Water", "Poison", "Holy", "Thunder", "Wind", "Ice")
+SIDES = ("top", "right", "bottom", "left")
+TOP, RIGHT, BOTTOM, LEFT = range(4)
+
+EMPTY, P1, P2 = 0, 1, 2
+
+
+def _build_neighbors() -> tuple:
+    """Для каждой клетки: кортеж (ni, смещение атакующей стороны, смещение
+    защищающейся стороны) в массиве eff. Порядок обхода тот же, что был в
+    _get_neighbors (верх, право, низ, лево) — от него зависит порядок captured."""
+    dirs = (
+        (0, -1, TOP, BOTTOM),
+        (1, 0, RIGHT, LEFT),
+        (0, 1, BOTTOM, TOP),
+        (-1, 0, LEFT, RIGHT),
+    )
+    table = []
+    for idx in range(9):
+        x, y = idx % 3, idx // 3
+        row = []
+        for dx, dy, a, b in dirs:
+            nx, ny = x + dx, y + dy
+            if 0 <= nx <= 2 and 0 <= ny <= 2:
+                ni = ny * 3 + nx
+                row.append((ni, idx * 4 + a, ni * 4 + b))
+        table.append(tuple(row))
+    return tuple(table)
+
+
+NEIGHBORS = _build_neighbors()
+
+
+def safe_val(raw) -> int:
+    try:
+        v = int(raw)
+        return max(1, min(ACE_VALUE, v))
+    except (TypeError, ValueError):
+        return 5
+
+
+def effective_val(base: int, card_elem: Optional[str], cell_elem: Optional[str]) -> int:
+    if base == ACE_VALUE:
+        return ACE_VALUE
+    if cell_elem:
+        bonus = +1 if card_elem == cell_elem else -1
+    else:
+        bonus = 0
+    return max(1, min(9, base + bonus))
+
+
+# _EFF[bonus][base] == effective_val для base 1..10 и бонуса -1/0/+1
+# (индекс -1 у кортежа — это как раз строка штрафа).
+_EFF = tuple(
+    tuple(ACE_VALUE if b == ACE_VALUE else max(1, min(9, b + bonus)) for b in range(ACE_VALUE + 1))
+    for bonus in (0, 1, -1)
+)
+
+
+class CardRecord(NamedTuple):
+    """Каноничная неизменяемая карта партии. Собирается ОДИН раз при старте
+    матча: значения сторон уже зажаты в 1..10, стихия и картинка найдены.
+    body — готовый JSON карты без owner (и без открывающей скобки), чтобы
+    каждая последующая отправка просто вклеивала строку."""
+    id: Any
+    token_id: Any
+    sides: tuple  # (top, right, bottom, left)
+    element: str
+    rank: str
+    rank_label: str
+    image: str
+    body: str
+
+    def to_dict(self, owner: str) -> dict:
+        top, right, bottom, left = self.sides
+        return {
+            "id": self.id,
+            "token_id": self.token_id,
+            "owner": str(owner),
+            "values": {"top": top, "right": right, "bottom": bottom, "left": left},
+            "element": self.element,
+            "rank": self.rank,
+            "rankLabel": self.rank_label,
+            "imageUrl": self.image,
+            "image": self.image,
+        }
+
+    def to_json(self, owner: str) -> str:
+        return owner_prefix(owner) + self.body
+
+    def to_row(self) -> list:
+        """Компактная строка для журнала/снапшота (без body — он восстановим)."""
+        return [self.id, self.token_id, list(self.sides), self.element,
+                self.rank, self.rank_label, self.image]
+
+
+def owner_prefix(owner: str) -> str:
+    return '{"owner":' + dumps(str(owner)) + ","
+
+
+def normalize_card(card: dict) -> CardRecord:
+    """Приводит сырую карту/NFT (values|stats, metadata, nftData...) к CardRecord."""
+    raw = card.get("values") or card.get("stats") or {}
+    sides = (
+        safe_val(raw.get("top", 5)),
+        safe_val(raw.get("right", 5)),
+        safe_val(raw.get("bottom", 5)),
+        safe_val(raw.get("left", 5)),
+    )
+    elem = card.get("element")
+    if not elem or elem not in ELEMENTS:
+        card_id = str(card.get("id") or card.get("token_id") or "x")
+        h = sum(ord(c) for c in card_id)
+        elem = ELEMENTS[h % len(ELEMENTS)]
+
+    # Картинку ищем во ВСЕХ возможных местах NFT, иначе карта пустая.
+    meta = card.get("metadata") if isinstance(card.get("metadata"), dict) else {}
+    nftd = card.get("nftData") if isinstance(card.get("nftData"), dict) else {}
+    nftd_meta = nftd.get("metadata") if isinstance(nftd.get("metadata"), dict) else {}
+    img = (card.get("imageUrl") or card.get("image")
+           or meta.get("media") or meta.get("image") or meta.get("originalMedia")
+           or nftd.get("imageUrl") or nftd.get("image")
+           or nftd_meta.get("media") or nftd_meta.get("image") or "")
+
+    rank_raw = card.get("rank") or card.get("rarity")
+    rec = CardRecord(
+        id=card.get("id") or card.get("token_id") or f"card_{random.randint(1000, 9999)}",
+        token_id=card.get("token_id") or card.get("id") or "",
+        sides=sides,
+        element=elem,
+        rank=str(rank_raw or "common"),
+        rank_label=card.get("rankLabel") or (str(rank_raw or "c")[:1].upper()),
+        image=img,
+        body="",
+    )
+    return _with_body(rec)
+
+
+def card_from_row(row: Sequence) -> CardRecord:
+    card_id, token_id, sides, element, rank, rank_label, image = row
+    return _with_body(CardRecord(card_id, token_id, tuple(sides), element,
+                                 rank, rank_label, image, ""))
+
+
+def _with_body(rec: CardRecord) -> CardRecord:
+    body = dumps({k: v for k, v in rec.to_dict("").items() if k != "owner"})
+    return rec._replace(body=body[1:])
+
+
+class MatchState:
+    __slots__ = (
+        "match_id", "player1_id", "player2_id",
+        "board_elements", "player1_hand", "player2_hand",
+        "current_turn", "status", "winner", "moves_count", "seq",
+        "owners", "eff", "cells", "filled", "_cell_elems",
+        "_prefix", "_hand_json", "_board_json",
+        "opening", "moves",
+    )
+
+    def __init__(
+            self,
+            match_id: str,
+            player1_id: str,
+            player2_id: str,
+            player1_hand: List[CardRecord],
+            player2_hand: List[CardRecord],
+            board_elements: list,
+            first_turn: str,
+    ):
+        self.match_id = match_id
+        self.player1_id = str(player1_id)
+        self.player2_id = str(player2_id)
+        self.board_elements: List[Optional[str]] = board_elements
+        self.player1_hand: List[CardRecord] = player1_hand
+        self.player2_hand: List[CardRecord] = player2_hand
+        self.current_turn: str = str(first_turn)
+        self.status: str = "active"
+        self.winner: Optional[str] = None
+        self.moves_count: int = 0
+        # Версия состояния: растёт на каждое изменение (ход, форфейт). Клиент
+        # применяет дельты строго по порядку и по дыре в seq просит снапшот.
+        self.seq: int = 0
+
+        self.owners = bytearray(9)
+        self.eff = bytearray(36)
+        # Карта в клетке (как её выложили); владелец — только в owners.
+        self.cells: List[Optional[CardRecord]] = [None] * 9
+        self.filled = 0
+        self._cell_elems = cell_elements(board_elements)
+        # Кэш готовых JSON-фрагментов: «owner»-префиксы игроков, руки, поле.
+        # Руку сбрасываем, когда из неё ушла карта, поле — на каждом ходе.
+        self._prefix = (None, owner_prefix(self.player1_id), owner_prefix(self.player2_id))
+        self._hand_json: List[Optional[str]] = [None, None, None]
+        self._board_json: Optional[str] = None
+        # Журнал событий партии для реплея: стартовые руки + первый ход
+        # (сид) и упорядоченные ходы (код игрока, индекс в руке, клетка).
+        self.opening = (tuple(player1_hand), tuple(player2_hand), first_turn)
+        self.moves: List[tuple] = []
+
+    # ── игроки / руки ──────────────────────────────────────────────
+
+    def owner_code(self, player_id: str) -> int:
+        return P1 if str(player_id) == self.player1_id else P2
+
+    def owner_id(self, code: int) -> Optional[str]:
+        if code == P1:
+            return self.player1_id
+        if code == P2:
+            return self.player2_id
+        return None
+
+    def get_hand(self, player_id: str) -> list:
+        if str(player_id) == self.player1_id:
+            return self.player1_hand
+        return self.player2_hand
+
+    def remove_from_hand(self, player_id: str, card_index: int):
+        hand = self.get_hand(player_id)
+        if 0 <= card_index < len(hand):
+            hand.pop(card_index)
+            self._hand_json[self.owner_code(player_id)] = None
+
+    # ── поле ───────────────────────────────────────────────────────
+
+    @property
+    def board(self) -> List[Optional[dict]]:
+        """Поле в прежнем «проводном» виде: карта с актуальным owner."""
+        out: List[Optional[dict]] = []
+        for i in range(9):
+            card = self.cells[i]
+            if card is None:
+                out.append(None)
+            else:
+                out.append(card.to_dict(self.owner_id(self.owners[i])))
+        return out
+
+    def hand_json(self, player_id: str) -> str:
+        code = self.owner_code(player_id)
+        cached = self._hand_json[code]
+        if cached is None:
+            prefix = self._prefix[code]
+            cached = "[" + ",".join(prefix + c.body for c in self.get_hand(player_id)) + "]"
+            self._hand_json[code] = cached
+        return cached
+
+    def board_json(self) -> str:
+        cached = self._board_json
+        if cached is None:
+            parts = []
+            for i in range(9):
+                card = self.cells[i]
+                parts.append("null" if card is None else self._prefix[self.owners[i]] + card.body)
+            cached = "[" + ",".join(parts) + "]"
+            self._board_json = cached
+        return cached
+
+    def card_json(self, card: CardRecord, player_id: str) -> str:
+        return self._prefix[self.owner_code(player_id)] + card.body
+
+    def score(self) -> tuple:
+        owners = self.owners
+        return owners.count(P1), owners.count(P2)
+
+    def place(self, cell_index: int, card: CardRecord, owner_code: int) -> List[int]:
+        """Кладёт карту в клетку и возвращает захваченные клетки."""
+        self._put(cell_index, card, owner_code)
+        return self.resolve_placement(cell_index)
+
+    def _put(self, cell_index: int, card: CardRecord, owner_code: int):
+        cell_elem = self._cell_elems[cell_index]
+        if cell_elem:
+            row = _EFF[1] if card.element == cell_elem else _EFF[-1]
+        else:
+            row = _EFF[0]
+        top, right, bottom, left = card.sides
+        base = cell_index * 4
+        eff = self.eff
+        eff[base] = row[top]
+        eff[base + 1] = row[right]
+        eff[base + 2] = row[bottom]
+        eff[base + 3] = row[left]
+        self.owners[cell_index] = owner_code
+        self.cells[cell_index] = card
+        self.filled += 1
+        self._board_json = None
+
+    def resolve_placement(self, placed_idx: int) -> List[int]:
+        owners = self.owners
+        eff = self.eff
+        placed_owner = owners[placed_idx]
+        flipped = []
+        for ni, a_off, b_off in NEIGHBORS[placed_idx]:
+            target_owner = owners[ni]
+            if target_owner == EMPTY or target_owner == placed_owner:
+                continue
+            if eff[a_off] > eff[b_off]:
+                owners[ni] = placed_owner
+                flipped.append(ni)
+        return flipped
+
+    def check_game_over(self) -> Optional[str]:
+        if self.filled < 9:
+            return None
+        p1 = self.owners.count(P1)
+        p2 = self.owners.count(P2)
+        if p2 > p1:
+            return self.player2_id
+        return self.player1_id
+
+    # ── ход ────────────────────────────────────────────────────────
+
+    def validate_move(self, player_id: str, card_index: int, cell_index: int) -> Optional[str]:
+        """Текст ошибки для клиента или None, если ход допустим."""
+        if self.status != "active":
+            return "Game is already over"
+        if self.current_turn != player_id:
+            return "Not your turn"
+        if not (0 <= cell_index <= 8):
+            return "Invalid cell_index"
+        if self.owners[cell_index] != EMPTY:
+            return "Cell is occupied"
+        hand = self.get_hand(player_id)
+        if not (0 <= card_index < len(hand)):
+            return f"Invalid card_index {card_index}, hand size={len(hand)}"
+        return None
+
+    def apply_move(self, player_id: str, card_index: int, cell_index: int) -> List[int]:
+        """Применяет уже провалидированный ход: выкладка, захваты, рука, очередь
+        хода и проверка конца партии. Возвращает захваченные клетки; сама
+        карта после хода лежит в cells[cell_index]."""
+        code = P1 if player_id == self.player1_id else P2
+        card = (self.player1_hand if code == P1 else self.player2_hand).pop(card_index)
+        self._hand_json[code] = None
+        captured = self.place(cell_index, card, code)
+        self.moves.append((code, card_index, cell_index))
+        self.moves_count += 1
+        self.seq += 1
+        self.current_turn = (
+            self.player2_id if self.current_turn == self.player1_id else self.player1_id
+        )
+        winner = self.check_game_over()
+        if winner:
+            self.status = "finished"
+            self.winner = winner
+        return captured
+
+    def finish(self, winner: str):
+        """Завершение партии вне хода (форфейт) — тоже новая версия состояния."""
+        self.status = "finished"
+        self.winner = winner
+        self.seq += 1
+
+    def cancel(self):
+        """Матч отменён до первого хода (эскроу возвращается): ходы больше не принимаем."""
+        self.status = "cancelled"
+        self.seq += 1
+
+    # ── снапшот (журнал ходов, восстановление после рестарта) ──────
+
+    def snapshot(self) -> dict:
+        return {
+            "m": self.match_id,
+            "p1": self.player1_id,
+            "p2": self.player2_id,
+            "be": self.board_elements,
+            "h1": [c.to_row() for c in self.player1_hand],
+            "h2": [c.to_row() for c in self.player2_hand],
+            "cells": [None if c is None else c.to_row() for c in self.cells],
+            "own": list(self.owners),
+            "turn": self.current_turn,
+            "st": self.status,
+            "w": self.winner,
+            "mv": self.moves_count,
+            "seq": self.seq,
+            "open": [[c.to_row() for c in self.opening[0]],
+                     [c.to_row() for c in self.opening[1]],
+                     self.opening[2]],
+            "log": [list(m) for m in self.moves],
+        }
+
+    @classmethod
+    def from_snapshot(cls, snap: dict) -> "MatchState":
+        state = cls(
+            match_id=snap["m"],
+            player1_id=snap["p1"],
+            player2_id=snap["p2"],
+            player1_hand=[card_from_row(r) for r in snap["h1"]],
+            player2_hand=[card_from_row(r) for r in snap["h2"]],
+            board_elements=snap["be"],
+            first_turn=snap["turn"],
+        )
+        for i, row in enumerate(snap["cells"]):
+            if row is not None:
+                state._put(i, card_from_row(row), snap["own"][i])
+        state.status = snap["st"]
+        state.winner = snap["w"]
+        state.moves_count = snap["mv"]
+        state.seq = snap["seq"]
+        if snap.get("open"):
+            h1, h2, first = snap["open"]
+            state.opening = (tuple(card_from_row(r) for r in h1),
+                             tuple(card_from_row(r) for r in h2), first)
+        state.moves = [tuple(m) for m in snap.get("log", [])]
+        return state
+
+    def event_log(self, reason: Optional[str] = None) -> dict:
+        """Компактный журнал событий для PvPMatch.event_log: сид поля,
+        стартовые руки и ходы. game.replay переигрывает его детерминированно."""
+        h1, h2, first = self.opening
+        log = {
+            "v": 1,
+            "p1": self.player1_id,
+            "p2": self.player2_id,
+            "be": list(cell_elements(self.board_elements)),
+            "ft": first,
+            "h1": [c.to_row() for c in h1],
+            "h2": [c.to_row() for c in h2],
+            "mv": [list(m) for m in self.moves],
+        }
+        if self.status != "active":
+            log["end"] = {"st": self.status, "w": self.winner, "r": reason}
+        return log
+
+    def to_state_dict(self) -> dict:
+        return {"board": self.board, **self._state_fields()}
+
+    def state_json(self) -> str:
+        return compose(self._state_fields(), board=self.board_json())
+
+    def _state_fields(self) -> dict:
+        return {
+            "match_id": self.match_id,
+            "player1_id": self.player1_id,
+            "player2_id": self.player2_id,
+            "board_elements": self.board_elements,
+            "current_turn": self.current_turn,
+            "status": self.status,
+            "winner": self.winner,
+            "player1_hand_count": len(self.player1_hand),
+            "player2_hand_count": len(self.player2_hand),
+            "moves_count": self.moves_count,
+            "seq": self.seq,
+        }
+
+
+def cell_elements(board_elements: Sequence[Optional[str]]) -> tuple:
+    elems = list(board_elements or [])[:9]
+    return tuple(elems + [None] * (9 - len(elems)))
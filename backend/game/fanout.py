@@ -0,0 +1,157 @@
+"""Хаб рассылки для зрителей матча (read-only).
+
+Игроки и зрители развязаны: сторона игры делает publish() — это O(1)
+append готового кадра во входящий буфер канала, без обхода подписчиков.
+Отдельный насос канала раскладывает кадр по очередям зрителей, а у каждого
+зрителя своя задача-писатель. Очередь зрителя ограничена и при переполнении
+выкидывает САМЫЕ СТАРЫЕ кадры (drop-oldest): отставший зритель видит дыру
+в seq и перезапрашивает снапшот, а не тормозит остальных.
+
+Кадр кодируется один раз (его же строку уже получили игроки) и одной и той
+же строкой уходит сотням зрителей финала турнира."""
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+from collections import deque
+from typing import Deque, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+SPECTATOR_QUEUE_MAX = int(os.getenv("SPECTATOR_QUEUE_MAX", "32"))
+SPECTATOR_SEND_TIMEOUT_SECONDS = float(os.getenv("SPECTATOR_SEND_TIMEOUT_SECONDS", "10"))
+SPECTATORS_PER_MATCH_MAX = int(os.getenv("SPECTATORS_PER_MATCH_MAX", "1000"))
+
+
+class Subscriber:
+    __slots__ = ("ws", "since", "queue", "wake", "task", "dropped", "closed")
+
+    def __init__(self, ws, since: int, max_queue: int):
+        self.ws = ws
+        self.since = since  # первый номер кадра канала, который ему положен
+        self.queue: Deque[str] = deque(maxlen=max_queue)
+        self.wake = asyncio.Event()
+        self.task: Optional[asyncio.Task] = None
+        self.dropped = 0
+        self.closed = False
+
+    def push(self, text: str):
+        if len(self.queue) == self.queue.maxlen:
+            self.dropped += 1
+        self.queue.append(text)
+        self.wake.set()
+
+
+class Channel:
+    def __init__(self, key: str):
+        self.key = key
+        self.subscribers: List[Subscriber] = []
+        self.published = 0
+        self._inbox: Deque[Tuple[int, str]] = deque()
+        self._wake = asyncio.Event()
+        self._pump = asyncio.create_task(self._run())
+
+    def publish(self, text: str):
+        self._inbox.append((self.published, text))
+        self.published += 1
+        self._wake.set()
+
+    async def _run(self):
+        inbox = self._inbox
+        while True:
+            await self._wake.wait()
+            self._wake.clear()
+            while inbox:
+                n, text = inbox.popleft()
+                for sub in self.subscribers:
+                    if n >= sub.since:
+                        sub.push(text)
+            # Отдаём цикл, чтобы писатели успели разобрать очереди.
+            await asyncio.sleep(0)
+
+    def close(self):
+        self._pump.cancel()
+
+
+class FanoutHub:
+    def __init__(self, max_queue: int = SPECTATOR_QUEUE_MAX,
+                 send_timeout: float = SPECTATOR_SEND_TIMEOUT_SECONDS,
+                 max_per_channel: int = SPECTATORS_PER_MATCH_MAX):
+        self.max_queue = max_queue
+        self.send_timeout = send_timeout
+        self.max_per_channel = max_per_channel
+        self.channels: Dict[str, Channel] = {}
+        self.published_total = 0
+
+    def publish(self, key: str, text: str):
+        """Кадр всем зрителям канала. Нет зрителей — ничего не стоит."""
+        ch = self.channels.get(key)
+        if ch is not None:
+            ch.publish(text)
+            self.published_total += 1
+
+    def count(self, key: str) -> int:
+        ch = self.channels.get(key)
+        return len(ch.subscribers) if ch else 0
+
+    def subscribe(self, key: str, ws, first_frames: List[str]) -> Optional[Subscriber]:
+        """Подписка со снапшотом: first_frames уходят первыми, дальше — только
+        кадры, опубликованные ПОСЛЕ подписки. None — канал переполнен."""
+        ch = self.channels.get(key)
+        if ch is None:
+            ch = self.channels[key] = Channel(key)
+        if len(ch.subscribers) >= self.max_per_channel:
+            return None
+        sub = Subscriber(ws, ch.published, self.max_queue)
+        for text in first_frames:
+            sub.push(text)
+        ch.subscribers.append(sub)
+        sub.task = asyncio.create_task(self._writer(ch, sub))
+        return sub
+
+    def unsubscribe(self, key: str, sub: Subscriber):
+        sub.closed = True
+        if sub.task is not None and sub.task is not asyncio.current_task():
+            sub.task.cancel()
+        ch = self.channels.get(key)
+        if ch is None:
+            return
+        try:
+            ch.subscribers.remove(sub)
+        except ValueError:
+            pass
+        if not ch.subscribers:
+            ch.close()
+            del self.channels[key]
+
+    async def _writer(self, ch: Channel, sub: Subscriber):
+        try:
+            while not sub.closed:
+                await sub.wake.wait()
+                sub.wake.clear()
+                while sub.queue:
+                    text = sub.queue.popleft()
+                    await asyncio.wait_for(sub.ws.send_text(text), self.send_timeout)
+        except asyncio.CancelledError:
+            return
+        except Exception as e:
+            logger.info("[SPECTATE] drop subscriber match=%s: %s", ch.key, e)
+        self.unsubscribe(ch.key, sub)
+        try:
+            await sub.ws.close()
+        except Exception:
+            pass
+
+    def stats(self) -> dict:
+        subs = [s for ch in self.channels.values() for s in ch.subscribers]
+        return {
+            "channels": len(self.channels),
+            "subscribers": len(subs),
+            "published_total": self.published_total,
+            "dropped_frames": sum(s.dropped for s in subs),
+            "max_queue_depth": max((len(s.queue) for s in subs), default=0),
+        }
+
+
+spectator_hub = FanoutHub()
@@ -0,0 +1,252 @@
+"""Журнал ходов (write-ahead) для восстановления живых партий после рестарта.
+
+MatchState живёт только в памяти WSManager, а писать поле/руки в PvPMatch
+на каждом ходе дорого. Вместо этого каждое изменение партии — одна
+компактная JSON-строка в локальном append-only файле:
+
+  {"t":"s","st":{...}}                    старт партии (полный снапшот)
+  {"t":"m","m":id,"p":pid,"h":1,"c":4}    ход: игрок, индекс в руке, клетка
+  {"t":"f","m":id,"w":pid}                завершение вне хода (форфейт)
+  {"t":"x","m":id}                        отмена до первого хода
+
+Записи копятся в буфере, а один писатель раз в JOURNAL_FSYNC_MS сбрасывает
+весь пакет в файл и делает ОДИН fsync. Раз в JOURNAL_SNAPSHOT_SECONDS
+журнал поворачивается: снимок всех живых партий пишется в
+snapshot-<n>.json (атомарно, через rename), дальше пишется journal-<n>.log,
+старые сегменты удаляются. Восстановление = последний снапшот + его сегмент
+и более новые, ходы переигрываются движком (он детерминирован)."""
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+import re
+import time
+from typing import Callable, Dict, Iterable, List, Optional
+
+from game.engine import MatchState
+from game.wire import dumps, loads
+
+logger = logging.getLogger(__name__)
+
+# По умолчанию — backend/match_journal, независимо от рабочего каталога процесса.
+JOURNAL_DIR = os.getenv("MATCH_JOURNAL_DIR") or os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "match_journal"
+)
+JOURNAL_FSYNC_MS = float(os.getenv("JOURNAL_FSYNC_MS", "5"))
+JOURNAL_SNAPSHOT_SECONDS = float(os.getenv("JOURNAL_SNAPSHOT_SECONDS", "60"))
+
+_SEGMENT_RE = re.compile(r"^journal-(\d+)\.log$")
+_SNAPSHOT_RE = re.compile(r"^snapshot-(\d+)\.json$")
+
+
+class MoveJournal:
+    def __init__(self, directory: str = JOURNAL_DIR):
+        self.directory = directory
+        self.enabled = False
+        self._segment = 0
+        self._fh = None
+        self._buf: List[str] = []
+        self._wake: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._states: Optional[Callable[[], Iterable[MatchState]]] = None
+        self._last_snapshot = 0.0
+        self._snapshot_records = 0
+        # Метрики
+        self.records = 0
+        self.batches = 0
+        self.fsync_last_ms = 0.0
+        self.fsync_max_ms = 0.0
+
+    # ── запись ─────────────────────────────────────────────────────
+
+    def started(self, state: MatchState):
+        self._append({"t": "s", "st": state.snapshot()})
+
+    def move(self, match_id: str, player_id: str, card_index: int, cell_index: int):
+        self._append({"t": "m", "m": match_id, "p": player_id, "h": card_index, "c": cell_index})
+
+    def finished(self, match_id: str, winner: str):
+        self._append({"t": "f", "m": match_id, "w": winner})
+
+    def cancelled(self, match_id: str):
+        self._append({"t": "x", "m": match_id})
+
+    def _append(self, record: dict):
+        if not self.enabled:
+            return
+        self._buf.append(dumps(record) + "\n")
+        self.records += 1
+        self._wake.set()
+
+    # ── жизненный цикл ─────────────────────────────────────────────
+
+    def load(self) -> Dict[str, MatchState]:
+        """Синхронно читает снапшот + сегменты и переигрывает ходы.
+        Вызывать ДО start(): start() начинает новый сегмент."""
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return {}
+        snaps = sorted(int(m.group(1)) for m in map(_SNAPSHOT_RE.match, names) if m)
+        segs = sorted(int(m.group(1)) for m in map(_SEGMENT_RE.match, names) if m)
+
+        states: Dict[str, MatchState] = {}
+        base = 0
+        for n in reversed(snaps):
+            try:
+                with open(os.path.join(self.directory, f"snapshot-{n}.json"), "rb") as f:
+                    data = loads(f.read())
+                states = {s["m"]: MatchState.from_snapshot(s) for s in data.get("states", [])}
+                base = n
+                break
+            except Exception as e:
+                logger.warning("[JOURNAL] broken snapshot-%s: %s", n, e)
+
+        for n in segs:
+            if n < base:
+                continue
+            path = os.path.join(self.directory, f"journal-{n}.log")
+            with open(path, "rb") as f:
+                for line in f:
+                    try:
+                        self._replay(states, loads(line))
+                    except Exception:
+                        # Недописанный хвост после падения — дальше ничего нет.
+                        logger.warning("[JOURNAL] skip bad record in %s", path)
+                        break
+        self._segment = max([base] + segs)
+        return {mid: st for mid, st in states.items() if st.status == "active"}
+
+    @staticmethod
+    def _replay(states: Dict[str, MatchState], rec: dict):
+        kind = rec.get("t")
+        if kind == "s":
+            st = MatchState.from_snapshot(rec["st"])
+            states[st.match_id] = st
+            return
+        st = states.get(rec.get("m"))
+        if st is None:
+            return
+        if kind == "m":
+            if st.validate_move(rec["p"], rec["h"], rec["c"]) is None:
+                st.apply_move(rec["p"], rec["h"], rec["c"])
+        elif kind == "f":
+            st.finish(rec["w"])
+        elif kind == "x":
+            st.cancel()
+
+    def start(self, states: Callable[[], Iterable[MatchState]]):
+        """Открывает новый сегмент и запускает писателя. states() — живые
+        партии для периодического снапшота."""
+        self._states = states
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            self._wake = asyncio.Event()
+            self._rotate_sync(self._segment + 1, [s.snapshot() for s in states()])
+        except Exception as e:
+            logger.warning("[JOURNAL] disabled, %s is not writable: %s", self.directory, e)
+            return
+        self.enabled = True
+        self._task = asyncio.create_task(self._writer())
+        logger.info("[JOURNAL] writing to %s (segment %s)", self.directory, self._segment)
+
+    async def stop(self):
+        if self._task and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        if self._buf and self._fh:
+            batch, self._buf = self._buf, []
+            self._write_sync(batch)
+        if self._fh:
+            self._fh.close()
+            self._fh = None
+
+    # ── писатель ───────────────────────────────────────────────────
+
+    async def _writer(self):
+        while True:
+            # Снапшот — и по таймеру: журнал тихой партии тоже сжимается.
+            due = self._last_snapshot + JOURNAL_SNAPSHOT_SECONDS - time.monotonic()
+            try:
+                await asyncio.wait_for(self._wake.wait(), max(due, 0.0))
+            except asyncio.TimeoutError:
+                pass
+            else:
+                await asyncio.sleep(JOURNAL_FSYNC_MS / 1000.0)
+            self._wake.clear()
+            # Граница пакета и снимок берутся в одном синхронном шаге:
+            # всё, что в batch, уже отражено в снапшоте, остальное пойдёт
+            # в новый сегмент.
+            batch, self._buf = self._buf, []
+            snap = None
+            now = time.monotonic()
+            if now - self._last_snapshot >= JOURNAL_SNAPSHOT_SECONDS:
+                if self.records == self._snapshot_records:
+                    # С прошлого снапшота ничего не писали — сжимать нечего.
+                    self._last_snapshot = now
+                else:
+                    snap = [s.snapshot() for s in self._states() if s.status == "active"]
+                    self._snapshot_records = self.records
+            if not batch and snap is None:
+                continue
+            try:
+                await asyncio.to_thread(self._flush_sync, batch, snap)
+            except Exception as e:
+                logger.warning("[JOURNAL] write error: %s", e)
+
+    def _flush_sync(self, batch: List[str], snap: Optional[List[dict]]):
+        if batch:
+            self._write_sync(batch)
+        if snap is not None:
+            self._rotate_sync(self._segment + 1, snap)
+
+    def _write_sync(self, batch: List[str]):
+        t0 = time.perf_counter()
+        self._fh.write("".join(batch).encode("utf-8"))
+        self._fh.flush()
+        os.fsync(self._fh.fileno())
+        ms = (time.perf_counter() - t0) * 1000
+        self.batches += 1
+        self.fsync_last_ms = ms
+        if ms > self.fsync_max_ms:
+            self.fsync_max_ms = ms
+
+    def _rotate_sync(self, segment: int, snap: List[dict]):
+        path = os.path.join(self.directory, f"snapshot-{segment}.json")
+        tmp = path + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(dumps({"segment": segment, "states": snap}).encode("utf-8"))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+        fh = open(os.path.join(self.directory, f"journal-{segment}.log"), "ab")
+        old, self._fh, self._segment = self._fh, fh, segment
+        if old:
+            old.close()
+        self._last_snapshot = time.monotonic()
+        # Снапшот на диске — всё, что старше, больше не нужно.
+        for name in os.listdir(self.directory):
+            m = _SEGMENT_RE.match(name) or _SNAPSHOT_RE.match(name)
+            if m and int(m.group(1)) < segment:
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except OSError:
+                    pass
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "segment": self._segment,
+            "records": self.records,
+            "pending": len(self._buf),
+            "batches": self.batches,
+            "fsync_last_ms": round(self.fsync_last_ms, 3),
+            "fsync_max_ms": round(self.fsync_max_ms, 3),
+        }
+
+
+journal = MoveJournal()
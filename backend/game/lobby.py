@@ -0,0 +1,170 @@
+"""Лобби-канал: пуш статуса поиска игроку вместо опроса join_queue.
+
+Пока игрок в очереди или ждёт лока эскроу, его клиент держит один сокет
+(/api/matchmaking/lobby) или long-poll (/api/matchmaking/lobby/poll), а
+сервер сам шлёт события matched / escrow / ready / cancelled в момент, когда
+они случаются (хук в save_match). Опрос каждые 3 секунды с JWT и чтениями
+колоды/Elo из БД на каждый запрос больше не нужен.
+
+Для каждого игрока хранится последнее событие (seq, сигнатура, кадр):
+  * одинаковые сигнатуры не рассылаются повторно — save_match зовётся на
+    каждом ходу, а игроку важны только переходы;
+  * long-poll, пришедший между событиями, по since сразу забирает
+    пропущенное. Хранилище — LRU на LOBBY_RECENT_MAX игроков."""
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+from collections import OrderedDict, deque
+from typing import Deque, Dict, Hashable, List, Optional, Set, Tuple
+
+from game.wire import dumps
+
+logger = logging.getLogger(__name__)
+
+LOBBY_QUEUE_MAX = int(os.getenv("LOBBY_QUEUE_MAX", "16"))
+LOBBY_SEND_TIMEOUT_SECONDS = float(os.getenv("LOBBY_SEND_TIMEOUT_SECONDS", "10"))
+LOBBY_RECENT_MAX = int(os.getenv("LOBBY_RECENT_MAX", "10000"))
+
+
+class LobbySub:
+    __slots__ = ("ws", "queue", "wake", "task", "closed")
+
+    def __init__(self, ws, max_queue: int):
+        self.ws = ws  # None — временная подписка long-poll
+        self.queue: Deque[str] = deque(maxlen=max_queue)
+        self.wake = asyncio.Event()
+        self.task: Optional[asyncio.Task] = None
+        self.closed = False
+
+    def push(self, text: str):
+        self.queue.append(text)
+        self.wake.set()
+
+
+class LobbyHub:
+    def __init__(self, max_queue: int = LOBBY_QUEUE_MAX,
+                 send_timeout: float = LOBBY_SEND_TIMEOUT_SECONDS,
+                 recent_max: int = LOBBY_RECENT_MAX):
+        self.max_queue = max_queue
+        self.send_timeout = send_timeout
+        self.recent_max = recent_max
+        self.subs: Dict[str, Set[LobbySub]] = {}
+        # user_id -> (seq, сигнатура, событие)
+        self._last: "OrderedDict[str, Tuple[int, Hashable, dict]]" = OrderedDict()
+        self._seq = 0
+        self.published_total = 0
+        self.deduped_total = 0
+
+    # ── публикация ───────────────────────────────────────────────
+
+    def publish(self, user_id: str, sig: Hashable, event: dict) -> bool:
+        """Событие игроку. Повтор той же сигнатуры отбрасывается. Возвращает
+        True, если событие ушло живому WS-подписчику."""
+        last = self._last.get(user_id)
+        if last is not None and last[1] == sig:
+            self.deduped_total += 1
+            return False
+        self._seq += 1
+        event = dict(event, seq=self._seq)
+        self._last[user_id] = (self._seq, sig, event)
+        self._last.move_to_end(user_id)
+        while len(self._last) > self.recent_max:
+            self._last.popitem(last=False)
+        self.published_total += 1
+
+        subs = self.subs.get(user_id)
+        if not subs:
+            return False
+        text = dumps(event)
+        live = False
+        for sub in subs:
+            sub.push(text)
+            live = live or sub.ws is not None
+        return live
+
+    def last_sig(self, user_id: str) -> Optional[Hashable]:
+        last = self._last.get(user_id)
+        return last[1] if last else None
+
+    def last_seq(self, user_id: str) -> int:
+        last = self._last.get(user_id)
+        return last[0] if last else 0
+
+    def forget(self, user_id: str):
+        """Новый поиск — старые события (cancelled прошлого матча) не отдаём."""
+        self._last.pop(user_id, None)
+
+    def present(self, user_id: str) -> bool:
+        """Клиент сейчас держит сокет или висит в long-poll."""
+        return bool(self.subs.get(user_id))
+
+    # ── WebSocket ────────────────────────────────────────────────
+
+    def subscribe(self, user_id: str, ws, first_frames: List[str]) -> LobbySub:
+        sub = LobbySub(ws, self.max_queue)
+        for text in first_frames:
+            sub.push(text)
+        self.subs.setdefault(user_id, set()).add(sub)
+        sub.task = asyncio.create_task(self._writer(user_id, sub))
+        return sub
+
+    def unsubscribe(self, user_id: str, sub: LobbySub):
+        sub.closed = True
+        if sub.task is not None and sub.task is not asyncio.current_task():
+            sub.task.cancel()
+        subs = self.subs.get(user_id)
+        if subs is not None:
+            subs.discard(sub)
+            if not subs:
+                del self.subs[user_id]
+
+    async def _writer(self, user_id: str, sub: LobbySub):
+        try:
+            while not sub.closed:
+                await sub.wake.wait()
+                sub.wake.clear()
+                while sub.queue:
+                    await asyncio.wait_for(sub.ws.send_text(sub.queue.popleft()), self.send_timeout)
+        except asyncio.CancelledError:
+            return
+        except Exception as e:
+            logger.info("[LOBBY] drop subscriber user=%s: %s", user_id, e)
+        self.unsubscribe(user_id, sub)
+        try:
+            await sub.ws.close()
+        except Exception:
+            pass
+
+    # ── long-poll ────────────────────────────────────────────────
+
+    async def wait(self, user_id: str, since: int, timeout: float) -> Optional[dict]:
+        """Первое событие игрока с seq > since; None — таймаут."""
+        last = self._last.get(user_id)
+        if last is not None and last[0] > since:
+            return last[2]
+        sub = LobbySub(None, 1)
+        self.subs.setdefault(user_id, set()).add(sub)
+        try:
+            await asyncio.wait_for(sub.wake.wait(), timeout)
+        except asyncio.TimeoutError:
+            return None
+        finally:
+            self.unsubscribe(user_id, sub)
+        last = self._last.get(user_id)
+        return last[2] if last is not None and last[0] > since else None
+
+    def stats(self) -> dict:
+        subs = [s for group in self.subs.values() for s in group]
+        return {
+            "users": len(self.subs),
+            "sockets": sum(1 for s in subs if s.ws is not None),
+            "long_polls": sum(1 for s in subs if s.ws is None),
+            "published_total": self.published_total,
+            "deduped_total": self.deduped_total,
+            "recent": len(self._last),
+        }
+
+
+lobby_hub = LobbyHub()
@@ -0,0 +1,102 @@
+"""Исходящая очередь одного WebSocket-соединения.
+
+Каждый сокет получает ограниченную очередь готовых кадров и свою задачу-
+писателя. Рассылка — это неблокирующий put: медленный мобильный клиент
+больше не тормозит ни соперника, ни корутину, обрабатывающую ход.
+
+Клиент, у которого очередь переполнилась или один кадр не ушёл за
+send_timeout, считается отвалившимся: писатель останавливается, а владелец
+получает on_evict(outbox, reason) — дальше обычный реконнект/форфейт."""
+from __future__ import annotations
+
+import asyncio
+import logging
+from typing import Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+_CLOSE = object()
+
+
+class Outbox:
+    __slots__ = ("ws", "match_id", "player_id", "max_queue", "send_timeout",
+                 "closed", "_queue", "_task", "_on_evict")
+
+    def __init__(
+            self,
+            ws,
+            match_id: str,
+            player_id: str,
+            on_evict: Callable[["Outbox", str], None],
+            max_queue: int = 64,
+            send_timeout: float = 10.0,
+    ):
+        self.ws = ws
+        self.match_id = match_id
+        self.player_id = player_id
+        self.max_queue = max_queue
+        self.send_timeout = send_timeout
+        self.closed = False
+        # +1 под служебный _CLOSE, чтобы закрытие не упиралось в high-water mark
+        self._queue: asyncio.Queue = asyncio.Queue(max_queue + 1)
+        self._on_evict = on_evict
+        self._task: Optional[asyncio.Task] = asyncio.create_task(self._writer())
+
+    def __len__(self) -> int:
+        return self._queue.qsize()
+
+    def put(self, text: str) -> bool:
+        """Ставит кадр в очередь. False — сокет закрыт или выселен."""
+        if self.closed:
+            return False
+        if self._queue.qsize() >= self.max_queue:
+            self._evict(f"outbound queue over {self.max_queue}")
+            return False
+        self._queue.put_nowait(text)
+        return True
+
+    def close(self):
+        """Штатное закрытие: дописываем то, что уже в очереди, и выходим."""
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            self._queue.put_nowait(_CLOSE)
+        except asyncio.QueueFull:
+            self._cancel()
+
+    def abort(self):
+        """Закрытие без дописывания (сокет уже мёртв)."""
+        self.closed = True
+        self._cancel()
+
+    def _cancel(self):
+        task = self._task
+        if task is not None and not task.done() and task is not asyncio.current_task():
+            task.cancel()
+
+    def _evict(self, reason: str):
+        if self.closed:
+            return
+        self.abort()
+        logger.warning("[WS] evict slow consumer match=%s player=%s: %s",
+                       self.match_id, self.player_id, reason)
+        try:
+            self._on_evict(self, reason)
+        except Exception as e:
+            logger.warning("[WS] on_evict error: %s", e)
+
+    async def _writer(self):
+        queue = self._queue
+        try:
+            while True:
+                text = await queue.get()
+                if text is _CLOSE:
+                    return
+                await asyncio.wait_for(self.ws.send_text(text), self.send_timeout)
+        except asyncio.CancelledError:
+            pass
+        except asyncio.TimeoutError:
+            self._evict(f"send timeout {self.send_timeout}s")
+        except Exception as e:
+            self._evict(f"send error: {e}")
@@ -0,0 +1,107 @@
+"""Детерминированный реплей партии по её журналу событий (PvPMatch.event_log).
+
+Журнал — сид (стихии клеток, кто ходит первым), стартовые руки и ходы
+[код игрока, индекс в руке, клетка]. Переигрываем его тем же движком
+(game.engine.MatchState), что и живую партию, поэтому правила захвата
+одни и те же. Функции чистые: ни БД, ни сети, ни времени.
+
+verify() прогоняет журнал без построения кадров — тысячи партий в секунду
+для споров и аналитики (см. tools/bench_engine.py)."""
+from __future__ import annotations
+
+from typing import Iterator, List, Optional
+
+from game.engine import P1, MatchState, card_from_row
+
+
+class ReplayError(ValueError):
+    pass
+
+
+def initial_state(log: dict) -> MatchState:
+    try:
+        return MatchState(
+            match_id=str(log.get("m") or "replay"),
+            player1_id=str(log["p1"]),
+            player2_id=str(log["p2"]),
+            player1_hand=[card_from_row(r) for r in log["h1"]],
+            player2_hand=[card_from_row(r) for r in log["h2"]],
+            board_elements=list(log.get("be") or []),
+            first_turn=str(log["ft"]),
+        )
+    except (KeyError, TypeError, ValueError) as e:
+        raise ReplayError(f"bad event log: {e}")
+
+
+def _apply(state: MatchState, step: int, move) -> List[int]:
+    code, card_index, cell_index = move
+    player_id = state.player1_id if code == P1 else state.player2_id
+    error = state.validate_move(player_id, card_index, cell_index)
+    if error:
+        raise ReplayError(f"step {step}: {error}")
+    return state.apply_move(player_id, card_index, cell_index)
+
+
+def state_at(log: dict, step: int) -> MatchState:
+    """Состояние после первых step ходов (0 — стартовая раздача)."""
+    moves = log.get("mv") or []
+    if not (0 <= step <= len(moves)):
+        raise ReplayError(f"step must be in 0..{len(moves)}")
+    state = initial_state(log)
+    for i in range(step):
+        _apply(state, i + 1, moves[i])
+    return state
+
+
+def frames(log: dict) -> Iterator[dict]:
+    """Кадры реплея: по одному на ход, в том же виде, что card_played."""
+    state = initial_state(log)
+    for i, move in enumerate(log.get("mv") or [], start=1):
+        captured = _apply(state, i, move)
+        cell_index = move[2]
+        owner = state.owner_id(state.owners[cell_index])
+        p1_score, p2_score = state.score()
+        yield {
+            "type": "card_played",
+            "step": i,
+            "seq": state.seq,
+            "player_id": owner,
+            "cell_index": cell_index,
+            "card": state.cells[cell_index].to_dict(owner),
+            "captured": captured,
+            "hand_index": move[1],
+            "current_turn": state.current_turn,
+            "status": state.status,
+            "owners": [state.owner_id(o) for o in state.owners],
+            "player1_score": p1_score,
+            "player2_score": p2_score,
+        }
+
+
+def verify(log: dict) -> dict:
+    """Переигрывает журнал и сверяет итог с записанным. ok=False — журнал
+    не воспроизводится (недопустимый ход) или победитель не совпал."""
+    end = log.get("end") or {}
+    try:
+        state = initial_state(log)
+        for i, move in enumerate(log.get("mv") or [], start=1):
+            _apply(state, i, move)
+    except ReplayError as e:
+        return {"ok": False, "error": str(e), "winner": None, "recorded_winner": end.get("w")}
+
+    winner: Optional[str] = state.winner
+    if state.status == "active":
+        # Партия оборвалась не на поле (форфейт) — победителя решил сервер.
+        ok = end.get("st") == "finished" and end.get("r") not in (None, "normal")
+        winner = end.get("w")
+    else:
+        ok = not end or end.get("w") == winner
+    p1_score, p2_score = state.score()
+    return {
+        "ok": bool(ok),
+        "winner": winner,
+        "recorded_winner": end.get("w"),
+        "moves": state.moves_count,
+        "player1_score": p1_score,
+        "player2_score": p2_score,
+    }
@@ -0,0 +1,58 @@
+"""Сериализация WS-сообщений партии.
+
+Каждое сообщение кодируется ОДИН раз и одной и той же строкой уходит всем
+получателям. Кодер — orjson, если установлен (в разы быстрее stdlib json),
+иначе стандартный json в том же компактном формате.
+
+Большие и неизменные куски (карты, поле) сериализуются один раз и дальше
+вклеиваются в сообщение готовыми JSON-фрагментами, без повторного обхода
+словарей."""
+from __future__ import annotations
+
+import json
+from typing import Any
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - orjson опционален
+    orjson = None
+
+
+def _std_dumps(obj: Any) -> str:
+    # Тот же формат, что у Starlette send_json: компактно и без \\u-экранирования.
+    return json.dumps(obj, separators=(",", ":"), ensure_ascii=False)
+
+
+if orjson is not None:
+    def dumps(obj: Any) -> str:
+        try:
+            return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS).decode()
+        except TypeError:
+            # orjson не берёт, например, int > 64 бит — пусть решает stdlib.
+            return _std_dumps(obj)
+
+    def loads(raw):
+        return orjson.loads(raw)
+else:
+    dumps = _std_dumps
+    loads = json.loads
+
+
+# Кадр отмены матча (NFT возвращены) — один на все матчи и все пути отмены,
+# кодируется один раз при импорте.
+MATCH_CANCELLED_FRAME = dumps({
+    "type": "match_cancelled",
+    "message": "Match cancelled — NFTs refunded.",
+})
+
+
+def compose(payload: dict, **raw: str) -> str:
+    """JSON-объект из payload плюс поля, значения которых — уже готовый JSON.
+    compose({"type": "x"}, board="[...]") -> '{"board":[...],"type":"x"}'."""
+    body = dumps(payload)
+    if not raw:
+        return body
+    head = ",".join(dumps(k) + ":" + v for k, v in raw.items())
+    if body == "{}":
+        return "{" + head + "}"
+    return "{" + head + "," + body[1:]
@@ -7,32 +7,39 @@ from fastapi.middleware.cors import CORSMiddleware
 from database.session import engine
 from database.models import Base
 from database.migrations_bootstrap import ensure_users_columns, ensure_all_tables, ensure_tournament_columns
+from blockchain.near_rpc import near_rpc
 
 from api.auth import router as auth_router
 from api.users import router as users_router
 from routers.mock_nfts import router as mock_nfts_router
 from routers.near import router as near_router
 from routers.matches import router as matches_router
-from routers.matchmaking import router as matchmaking_router, cleanup_stale_matches
+from routers.matchmaking import router as matchmaking_router, cleanup_stale_matches, matchmaker_loop
 from routers.cases import router as cases_router
 from routers.proxy import router as proxy_router
 from routers.decks import router as decks_router
-from routers.ws_match import router as ws_game_router
+from routers.ws_match import router as ws_game_router, ws_manager
 from routers.user import router as user_router
 from routers.tournaments import router as tournaments_router
 from routers.presence import router as presence_router
+from utils.match_registry import match_registry
+from utils.nft_cache import nft_cache
+from utils.timing_wheel import wheel
+from game.journal import journal
+from game import ai as bot_ai
 from routers.coins import router as coins_router
 
 logger = logging.getLogger(__name__)
 
-# Background task reference
+# Background task references
 cleanup_task = None
+matchmaker_task = None
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Lifespan context manager for startup/shutdown"""
-    global cleanup_task
+    global cleanup_task, matchmaker_task
 
     # Startup
     if engine is not None:
@@ -48,10 +55,24 @@ async def lifespan(app: FastAPI):
     else:
         logger.warning("DB engine not configured")
 
+    # Метаданные коллекции из nft.json — в кэш NFT (LRU + nft_tokens)
+    await nft_cache.warm_up()
+
+    # Один драйвер на все дедлайны (форфейт, эскроу, зависшие матчи, очередь)
+    wheel.start()
+    # Выселение завершённых матчей из памяти — периодический таймер того же колеса
+    match_registry.start()
+
+    # Живые партии, прерванные рестартом, — из журнала ходов
+    await ws_manager.restore_from_journal()
+
     # Start background cleanup task
     cleanup_task = asyncio.create_task(cleanup_stale_matches())
     logger.info("Started background cleanup task for stale matches")
 
+    # Пакетный матчмейкер: пары по всей очереди раз в несколько сотен мс
+    matchmaker_task = asyncio.create_task(matchmaker_loop())
+
     yield
 
     # Shutdown
@@ -62,6 +83,16 @@ async def lifespan(app: FastAPI):
         except asyncio.CancelledError:
             pass
         logger.info("Stopped background cleanup task")
+    if matchmaker_task:
+        matchmaker_task.cancel()
+        try:
+            await matchmaker_task
+        except asyncio.CancelledError:
+            pass
+    await wheel.stop()
+    await journal.stop()
+    await near_rpc.aclose()
+    bot_ai.shutdown()
 
 
 app = FastAPI(title="Card Clash API", lifespan=lifespan)
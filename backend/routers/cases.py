@@ -7,10 +7,9 @@ from pydantic import BaseModel
 from typing import List, Dict, Optional
 import random
 import asyncio
-import httpx
 import os
-import json
-import base64
+
+from blockchain.near_rpc import NearRpcError, near_rpc
 
 router = APIRouter(prefix="/api/cases", tags=["cases"])
 
@@ -27,9 +26,9 @@ class ClaimNFTRequest(BaseModel):
 
 NFT_CONTRACT_ID = os.getenv("NFT_CONTRACT_ID", "")
 TREASURY_WALLET = os.getenv("TREASURY_WALLET", "retardo-s.near")
-# Устойчивый RPC: чтения через env (по умолч. fastnear-free), отправка tx — через
-# env если задан, иначе публичный (чтобы не сломать рабочие переводы).
-NEAR_RPC_URL = os.getenv("NEAR_RPC_URL", "https://free.rpc.fastnear.com")
+# Чтения идут через общий клиент blockchain.near_rpc (NEAR_RPC_URL, по умолч.
+# fastnear-free); отправка tx — через env если задан, иначе публичный (чтобы не
+# сломать рабочие переводы).
 _POOL_TX_RPC = os.getenv("NEAR_RPC_URL", "").strip() or "https://rpc.mainnet.near.org"
 
 # IPFS gateway для картинок коллекции
@@ -107,37 +106,17 @@ async def fetch_pool_tokens(wallet: str) -> List[str]:
     if not NFT_CONTRACT_ID:
         return []
     try:
-        args = json.dumps({"account_id": wallet, "limit": 100})
-        args_base64 = base64.b64encode(args.encode()).decode()
-        async with httpx.AsyncClient(timeout=15) as client:
-            resp = await client.post(
-                NEAR_RPC_URL,
-                json={
-                    "jsonrpc": "2.0", "id": "1", "method": "query",
-                    "params": {
-                        "request_type": "call_function",
-                        "finality": "final",
-                        "account_id": NFT_CONTRACT_ID,
-                        "method_name": "nft_tokens_for_owner",
-                        "args_base64": args_base64,
-                    }
-                }
-            )
-            data = resp.json()
-            print(f"[POOL] wallet={wallet} status={resp.status_code}")
-
-            if "error" in data:
-                print(f"[POOL] RPC error: {data['error']}")
-                return []
-
-            if "result" in data and "result" in data["result"]:
-                result_bytes = bytes(data["result"]["result"])
-                tokens = json.loads(result_bytes.decode())
-                print(f"[POOL] wallet={wallet} found {len(tokens)} tokens: {[t.get('token_id') for t in tokens[:5]]}")
-                return [t.get("token_id") for t in tokens if t.get("token_id")]
-            else:
-                print(f"[POOL] unexpected response: {data}")
-                return []
+        tokens = await near_rpc.view_call(
+            NFT_CONTRACT_ID, "nft_tokens_for_owner", {"account_id": wallet, "limit": 100}
+        )
+        if not isinstance(tokens, list):
+            print(f"[POOL] unexpected response: {tokens}")
+            return []
+        print(f"[POOL] wallet={wallet} found {len(tokens)} tokens: {[t.get('token_id') for t in tokens[:5]]}")
+        return [t.get("token_id") for t in tokens if t.get("token_id")]
+    except NearRpcError as e:
+        print(f"[POOL] RPC error: {e}")
+        return []
     except Exception as e:
         print(f"[POOL] Exception for {wallet}: {type(e).__name__}: {e}")
         return []
@@ -220,35 +199,26 @@ async def verify_case_payment(tx_hash: str, sender: str, treasury: str, min_yoct
     last = "unknown"
     for _ in range(3):
         try:
-            async with httpx.AsyncClient(timeout=15) as client:
-                resp = await client.post(NEAR_RPC_URL, json={
-                    "jsonrpc": "2.0", "id": "1", "method": "tx",
-                    "params": [tx_hash, sender],
-                })
-                data = resp.json()
-                if "error" in data:
-                    last = str(data["error"])
-                    await asyncio.sleep(1.5)
-                    continue
-                res = data.get("result", {}) or {}
-                status = res.get("status", {})
-                if isinstance(status, dict) and "Failure" in status:
-                    return False, "transaction failed on-chain"
-                tx = res.get("transaction", {}) or {}
-                if tx.get("receiver_id") != treasury:
-                    return False, f"wrong receiver: {tx.get('receiver_id')}"
-                if tx.get("signer_id") and tx.get("signer_id") != sender:
-                    return False, "signer mismatch"
-                total = 0
-                for a in tx.get("actions", []) or []:
-                    if isinstance(a, dict) and "Transfer" in a:
-                        try:
-                            total += int(a["Transfer"].get("deposit", "0"))
-                        except Exception:
-                            pass
-                if total < min_yocto:
-                    return False, f"insufficient payment ({total} < {min_yocto})"
-                return True, "ok"
+            # Ошибка RPC (tx ещё не видна) — NearRpcError, ретраим ниже.
+            res = await near_rpc.tx_status(tx_hash, sender)
+            status = res.get("status", {})
+            if isinstance(status, dict) and "Failure" in status:
+                return False, "transaction failed on-chain"
+            tx = res.get("transaction", {}) or {}
+            if tx.get("receiver_id") != treasury:
+                return False, f"wrong receiver: {tx.get('receiver_id')}"
+            if tx.get("signer_id") and tx.get("signer_id") != sender:
+                return False, "signer mismatch"
+            total = 0
+            for a in tx.get("actions", []) or []:
+                if isinstance(a, dict) and "Transfer" in a:
+                    try:
+                        total += int(a["Transfer"].get("deposit", "0"))
+                    except Exception:
+                        pass
+            if total < min_yocto:
+                return False, f"insufficient payment ({total} < {min_yocto})"
+            return True, "ok"
         except Exception as e:
             last = str(e)
             await asyncio.sleep(1.5)
@@ -356,30 +326,13 @@ async def check_balances():
     balances = {}
     for rarity, wallet in POOL_WALLETS.items():
         try:
-            async with httpx.AsyncClient(timeout=10) as client:
-                resp = await client.post(
-                    NEAR_RPC_URL,
-                    json={
-                        "jsonrpc": "2.0", "id": "1",
-                        "method": "query",
-                        "params": {
-                            "request_type": "view_account",
-                            "finality": "final",
-                            "account_id": wallet,
-                        }
-                    }
-                )
-                data = resp.json()
-                if "result" in data:
-                    amount = int(data["result"]["amount"])
-                    near = amount / 10 ** 24
-                    balances[rarity] = {
-                        "wallet": wallet,
-                        "balance_near": round(near, 4),
-                        "enough": near >= 0.01
-                    }
-                else:
-                    balances[rarity] = {"wallet": wallet, "error": str(data.get("error", "unknown"))}
+            account = await near_rpc.view_account(wallet, timeout=10)
+            near = int(account["amount"]) / 10 ** 24
+            balances[rarity] = {
+                "wallet": wallet,
+                "balance_near": round(near, 4),
+                "enough": near >= 0.01
+            }
         except Exception as e:
             balances[rarity] = {"wallet": wallet, "error": str(e)}
     return balances
@@ -4,10 +4,12 @@ from typing import List, Optional, Any, Dict
 from datetime import datetime
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select
+import asyncio
 import random
 
 from database.session import get_session
 from database.models.user_deck import UserDeck
+from game.balance import deck_signature, rate_deck
 
 router = APIRouter(prefix="/api/decks", tags=["decks"])
 
@@ -66,15 +68,27 @@ async def _save_deck_to_db(user_id: str, cards: List, full_cards: List, session:
             select(UserDeck).where(UserDeck.user_id == user_id)
         )
         existing = result.scalar_one_or_none()
+        # Рейтинг считаем сразу при сохранении — матчмейкинг потом берёт готовый.
+        rating, sig = None, None
+        if len(full_cards or []) == 5:
+            try:
+                rating = await asyncio.to_thread(rate_deck, full_cards)
+                sig = deck_signature(full_cards)
+            except Exception as e:
+                print(f"[Decks] deck rating error: {e}")
         if existing:
             existing.cards = cards
             existing.full_cards = full_cards
+            existing.deck_rating = rating
+            existing.deck_rating_sig = sig
             existing.updated_at = datetime.utcnow()
         else:
             session.add(UserDeck(
                 user_id=user_id,
                 cards=cards,
                 full_cards=full_cards,
+                deck_rating=rating,
+                deck_rating_sig=sig,
             ))
         await session.commit()
         return True
@@ -6,24 +6,26 @@ from sqlalchemy import select
 import uuid
 import os
 import asyncio
-import httpx
 import json
-import base64
+import time
 import traceback
 
+from blockchain.near_rpc import near_rpc
 from database.session import get_session
 from database.models.pvp_match import PvPMatch
 from database.models.match_deposit import MatchDeposit
 from utils.rating import calculate_rating_change, get_rank_by_rating
 from database.models.user import User
+from game.wire import MATCH_CANCELLED_FRAME, dumps
+from utils.escrow_signer import EscrowSigner
+from utils.match_registry import match_registry
+from utils.nft_cache import nft_cache
 
 router = APIRouter(prefix="/api/matches", tags=["matches"])
 
 ESCROW_WALLET = os.getenv("ESCROW_WALLET", "escrow.near")
 ESCROW_PRIVATE_KEY = os.getenv("ESCROW_PRIVATE_KEY", "")
 NFT_CONTRACT_ID = os.getenv("NFT_CONTRACT_ID", "")
-# Устойчивый NEAR RPC (публичный rpc.mainnet.near.org ложится при большом онлайне).
-NEAR_RPC_URL = os.getenv("NEAR_RPC_URL", "https://free.rpc.fastnear.com")
 
 # Сколько NFT каждый игрок лочит в эскроу для старта матча
 ESCROW_CARDS_REQUIRED = 5
@@ -32,6 +34,13 @@ ESCROW_CARDS_REQUIRED = 5
 # можно "залочить" подписав левым кошельком (перевод падает), а бэк засчитает.
 # Отключается env ESCROW_LOCK_VERIFY=0 (например, если нет индексера).
 ESCROW_LOCK_VERIFY = os.getenv("ESCROW_LOCK_VERIFY", "1") == "1"
+# Проверка лока: сколько nft_token-запросов параллельно, общий бюджет ожидания,
+# базовая пауза (~блок NEAR) и её потолок при отстающем RPC.
+ESCROW_VERIFY_CONCURRENCY = int(os.getenv("ESCROW_VERIFY_CONCURRENCY", "8"))
+ESCROW_VERIFY_BUDGET_SECONDS = float(os.getenv("ESCROW_VERIFY_BUDGET_SECONDS", "8"))
+ESCROW_VERIFY_BLOCK_SECONDS = 0.6
+ESCROW_VERIFY_MAX_BACKOFF_SECONDS = 3.0
+ESCROW_OWNED_TTL_SECONDS = float(os.getenv("ESCROW_OWNED_TTL_SECONDS", "120"))
 
 # Анти-сибил: сколько матчей между ОДНОЙ парой аккаунтов в сутки приносят
 # награду/рейтинг. Сверх лимита играть можно, но без монет/рейтинга — это
@@ -50,6 +59,16 @@ def _get_match_lock(match_id: str) -> asyncio.Lock:
     return lock
 
 
+def _release_match_lock(match_id: str) -> None:
+    # Матч выселен из реестра — его блокировка больше не понадобится.
+    lock = _match_locks.get(match_id)
+    if lock is not None and not lock.locked():
+        del _match_locks[match_id]
+
+
+match_registry.on_evict(_release_match_lock)
+
+
 async def _deposit_counts(match_id: str) -> Dict[str, int]:
     """Сколько депозитов в БД у каждого игрока этого матча."""
     counts: Dict[str, int] = {}
@@ -186,21 +205,8 @@ async def _cancel_and_refund(match_data: Dict, reason: str) -> int:
                     MatchDeposit.refunded == False,
                 )
             )
-            for dep in result.scalars().all():
-                near_wallet = dep.near_wallet
-                if not near_wallet:
-                    near_wallet = (match_data.get("player1_near_wallet")
-                                   if dep.player_id == match_data.get("player1_id")
-                                   else match_data.get("player2_near_wallet"))
-                if near_wallet and is_escrow_configured():
-                    r = await transfer_nft_from_escrow(
-                        to_wallet=near_wallet,
-                        token_id=dep.token_id,
-                        nft_contract_id=dep.nft_contract_id or NFT_CONTRACT_ID,
-                    )
-                    if r.get("success"):
-                        dep.refunded = True
-                        refunded += 1
+            results = await refund_deposits(result.scalars().all(), match_data)
+            refunded = sum(1 for r in results if r.get("success"))
             await session.commit()
             break
     except Exception as e:
@@ -208,10 +214,7 @@ async def _cancel_and_refund(match_data: Dict, reason: str) -> int:
     # Сообщаем подключённым клиентам, чтобы вышли в меню.
     try:
         from routers.ws_match import ws_manager
-        await ws_manager.broadcast_all(match_id, {
-            "type": "match_cancelled",
-            "message": "Матч отменён — NFT возвращены на кошелёк.",
-        })
+        await ws_manager.broadcast_raw(match_id, MATCH_CANCELLED_FRAME)
     except Exception as e:
         print(f"[MATCHES] _cancel_and_refund broadcast error: {e}")
     return refunded
@@ -226,7 +229,8 @@ async def _notify_escrow_locked(match_id: str):
             "type": "escrow_locked",
             "message": "Both players locked NFTs. Game starting!",
         })
-        await ws_manager.try_start_game(match_id)
+        # Через актор матча: не пересечётся с join/ходом из WS-сокета.
+        await ws_manager.call(match_id, ws_manager.try_start_game, match_id)
     except Exception as e:
         print(f"[MATCHES] _notify_escrow_locked error: {e}")
 
@@ -266,160 +270,268 @@ def is_escrow_configured() -> bool:
 
 
 async def fetch_nft_image(token_id: str, nft_contract: str) -> str:
+    """Картинка NFT через кэш utils.nft_cache (LRU -> nft_tokens -> RPC)."""
     if not nft_contract or not token_id:
         return ""
     try:
-        args = json.dumps({"token_id": token_id})
-        args_b64 = base64.b64encode(args.encode()).decode()
-        async with httpx.AsyncClient(timeout=8) as client:
-            resp = await client.post(
-                NEAR_RPC_URL,
-                json={
-                    "jsonrpc": "2.0", "id": "1", "method": "query",
-                    "params": {
-                        "request_type": "call_function",
-                        "finality": "final",
-                        "account_id": nft_contract,
-                        "method_name": "nft_token",
-                        "args_base64": args_b64,
-                    }
-                }
-            )
-            data = resp.json()
-            if "result" in data and "result" in data["result"]:
-                token = json.loads(bytes(data["result"]["result"]).decode())
-                media = (token.get("metadata") or {}).get("media", "")
-                if media:
-                    if media.startswith("ipfs://"):
-                        return "https://ipfs.near.social/ipfs/" + media[7:]
-                    if media.startswith("http"):
-                        return media
-                    return "https://ipfs.near.social/ipfs/" + media
+        return await nft_cache.image(nft_contract, token_id)
     except Exception as e:
         print(f"[MATCHES] fetch_nft_image error for {token_id}: {e}")
     return ""
 
 
-async def _nft_owner(token_id: str, nft_contract: str):
-    """Кто сейчас владелец токена (owner_id) по данным контракта, или None."""
-    if not nft_contract or not token_id:
-        return None
+async def fetch_nft_images(token_ids, nft_contract: str) -> Dict[str, str]:
+    """Картинки пачкой: промахи кэша уходят в RPC параллельно, а не по одной."""
+    if not nft_contract or not token_ids:
+        return {}
     try:
-        args = json.dumps({"token_id": str(token_id)})
-        args_b64 = base64.b64encode(args.encode()).decode()
-        async with httpx.AsyncClient(timeout=8) as client:
-            resp = await client.post(NEAR_RPC_URL, json={
-                "jsonrpc": "2.0", "id": "1", "method": "query",
-                "params": {
-                    "request_type": "call_function",
-                    "finality": "final",
-                    "account_id": nft_contract,
-                    "method_name": "nft_token",
-                    "args_base64": args_b64,
-                },
-            })
-            data = resp.json()
-            if "result" in data and "result" in data["result"]:
-                token = json.loads(bytes(data["result"]["result"]).decode())
-                return token.get("owner_id")
+        return await nft_cache.images(nft_contract, token_ids)
     except Exception as e:
-        print(f"[MATCHES] _nft_owner error for {token_id}: {e}")
-    return None
+        print(f"[MATCHES] fetch_nft_images error: {e}")
+    return {}
+
+
+# Подтверждённое владение эскроу хранится в utils.nft_cache (владелец, время
+# проверки, высота блока): ответ отстающей ноды с более старого блока запись не
+# перезаписывает. Карта уходит из эскроу только нашим же переводом — он и
+# сбрасывает запись (_forget_escrow_owned); TTL — страховка от ручных переводов.
+_verify_sem: Optional[asyncio.Semaphore] = None
+
+
+def _verify_semaphore() -> asyncio.Semaphore:
+    global _verify_sem
+    if _verify_sem is None:
+        _verify_sem = asyncio.Semaphore(ESCROW_VERIFY_CONCURRENCY)
+    return _verify_sem
+
+
+def _forget_escrow_owned(token_id, nft_contract: str) -> None:
+    nft_cache.forget_owner(nft_contract or NFT_CONTRACT_ID, str(token_id))
+
+
+async def _nft_owner_at(token_id: str, nft_contract: str):
+    """(owner_id, высота блока) — ограниченно параллельно с другими проверками."""
+    async with _verify_semaphore():
+        token, height = await near_rpc.view_call_with_height(
+            nft_contract, "nft_token", {"token_id": token_id}, timeout=8
+        )
+    return (token or {}).get("owner_id"), height
 
 
 async def _verify_tokens_in_escrow(token_ids, nft_contract: str):
     """Проверяем, что ВСЕ карты игрока реально лежат в эскроу-кошельке.
-    С ретраями — индексатор/RPC могут отставать сразу после перевода.
-    Возвращает (ok, missing)."""
+    Все карты проверяются разом (не больше ESCROW_VERIFY_CONCURRENCY
+    запросов параллельно); подтверждённые кэшируются с высотой блока, и
+    повторная проверка (register -> confirm) RPC не трогает.
+
+    Не найденные перепроверяем с адаптивной паузой: RPC отдал тот же блок —
+    он отстаёт, ждём вдвое дольше; блок сдвинулся — ждём примерно блок.
+    Общий бюджет — ESCROW_VERIFY_BUDGET_SECONDS. Возвращает (ok, missing)."""
     ids = [str(t) for t in (token_ids or []) if t]
     if not ids:
         return False, ids
     contract = nft_contract or NFT_CONTRACT_ID
     escrow = (ESCROW_WALLET or "").strip().lower()
-    missing = list(ids)
-    for attempt in range(3):
+    started = time.monotonic()
+    missing = [tid for tid in ids
+               if (nft_cache.cached_owner(contract, tid, ESCROW_OWNED_TTL_SECONDS) or "").strip().lower() != escrow]
+    delay = ESCROW_VERIFY_BLOCK_SECONDS
+    last_height = 0
+    while missing:
+        results = await asyncio.gather(
+            *(_nft_owner_at(tid, contract) for tid in missing), return_exceptions=True
+        )
+        now = time.monotonic()
+        height = last_height
         still = []
-        for tid in missing:
-            owner = (await _nft_owner(tid, contract) or "").strip().lower()
-            if owner != escrow:
+        for tid, res in zip(missing, results):
+            if isinstance(res, Exception):
+                print(f"[MATCHES] escrow ownership check error for {tid}: {res}")
+                still.append(tid)
+                continue
+            owner, h = res
+            height = max(height, h)
+            nft_cache.note_owner(contract, tid, owner, h)
+            if (owner or "").strip().lower() != escrow:
                 still.append(tid)
         missing = still
         if not missing:
-            return True, []
-        if attempt < 2:
-            await asyncio.sleep(2.5)
-    return False, missing
-
-
-# Один кэшированный аккаунт эскроу + сериализация переводов. Раньше на КАЖДУЮ
-# карту создавался новый Account с startup() (перечитывал nonce с чейна, не видя
-# ещё не финализированные tx) -> при возврате 5 карт подряд часть падала на
-# конфликте nonce. Теперь: единый аккаунт, глобальный лок (строго по очереди),
-# ретраи со сбросом аккаунта (пере-чтение nonce) при ошибке.
-_escrow_account = None
-_escrow_tx_lock: Optional[asyncio.Lock] = None
-
-
-def _escrow_lock() -> asyncio.Lock:
-    global _escrow_tx_lock
-    if _escrow_tx_lock is None:
-        _escrow_tx_lock = asyncio.Lock()
-    return _escrow_tx_lock
-
-
-async def _get_escrow_account():
-    """Ленивая инициализация и кэш аккаунта эскроу (py_near сам инкрементит nonce
-    при переиспользовании объекта)."""
-    global _escrow_account
-    if _escrow_account is not None:
-        return _escrow_account
-    from py_near.account import Account
-    pk = ESCROW_PRIVATE_KEY
-    if not pk.startswith("ed25519:"):
-        pk = "ed25519:" + pk
-    _tx_rpc = os.getenv("NEAR_RPC_URL", "").strip()
-    acc = Account(ESCROW_WALLET, pk, _tx_rpc) if _tx_rpc else Account(ESCROW_WALLET, pk)
-    await acc.startup()
-    _escrow_account = acc
-    return _escrow_account
+            break
+        delay = min(delay * 2, ESCROW_VERIFY_MAX_BACKOFF_SECONDS) if height <= last_height \
+            else ESCROW_VERIFY_BLOCK_SECONDS
+        last_height = height
+        if now + delay - started > ESCROW_VERIFY_BUDGET_SECONDS:
+            return False, missing
+        await asyncio.sleep(delay)
+    return True, []
+
+
+# Подписант эскроу (utils.escrow_signer): пул ключей аккаунта эскроу, у
+# каждого свой локально ведущийся nonce. Независимые переводы идут параллельно
+# по разным ключам, а не гуськом за одним локом; InvalidNonce лечится
+# пересинхронизацией одного ключа, а не сбросом всего аккаунта.
+escrow_signer = EscrowSigner(
+    ESCROW_WALLET,
+    [ESCROW_PRIVATE_KEY] + os.getenv("ESCROW_PRIVATE_KEYS", "").split(","),
+    os.getenv("NEAR_RPC_URL", "").strip(),
+)
+# Пакетные переводы: nft_transfer-действий в одной транзакции. 9 × 30 TGas
+# укладываются в лимит 300 TGas на транзакцию.
+ESCROW_TRANSFER_GAS = 30_000_000_000_000
+ESCROW_BATCH_MAX_ACTIONS = int(os.getenv("ESCROW_BATCH_MAX_ACTIONS", "9"))
 
 
 async def transfer_nft_from_escrow(to_wallet: str, token_id: str, nft_contract_id: str) -> Dict:
     if not ESCROW_PRIVATE_KEY:
         return {"success": False, "error": "Escrow private key not configured", "mock": True}
-    global _escrow_account
     last_err = ""
-    async with _escrow_lock():
-        for attempt in range(3):
-            try:
-                account = await _get_escrow_account()
-                result = await account.function_call(
-                    nft_contract_id or NFT_CONTRACT_ID,
-                    "nft_transfer",
-                    {"receiver_id": to_wallet, "token_id": str(token_id)},
-                    gas=30_000_000_000_000,
-                    amount=1,
-                )
-                tx_hash = ""
-                if result:
-                    if hasattr(result, "transaction") and hasattr(result.transaction, "hash"):
-                        tx_hash = result.transaction.hash
-                    elif hasattr(result, "transaction_outcome"):
-                        tx_hash = result.transaction_outcome.id
-                    else:
-                        tx_hash = str(result)[:32]
-                print(f"[ESCROW] Transferred {token_id} to {to_wallet}, tx: {tx_hash}")
-                return {"success": True, "tx_hash": tx_hash, "token_id": token_id, "to": to_wallet}
-            except Exception as e:
-                last_err = str(e)
-                print(f"[ESCROW] Transfer {token_id} attempt {attempt + 1} failed: {last_err}")
-                # Сбрасываем аккаунт — на следующей попытке перечитаем nonce.
-                _escrow_account = None
-                if attempt < 2:
-                    await asyncio.sleep(1.5)
+    for attempt in range(3):
+        try:
+            result = await escrow_signer.function_call(
+                nft_contract_id or NFT_CONTRACT_ID,
+                "nft_transfer",
+                {"receiver_id": to_wallet, "token_id": str(token_id)},
+                gas=ESCROW_TRANSFER_GAS,
+                amount=1,
+            )
+            tx_hash = _tx_hash(result)
+            _forget_escrow_owned(token_id, nft_contract_id)
+            print(f"[ESCROW] Transferred {token_id} to {to_wallet}, tx: {tx_hash}")
+            return {"success": True, "tx_hash": tx_hash, "token_id": token_id, "to": to_wallet}
+        except Exception as e:
+            last_err = str(e)
+            print(f"[ESCROW] Transfer {token_id} attempt {attempt + 1} failed: {last_err}")
+            if attempt < 2:
+                await asyncio.sleep(1.5)
     return {"success": False, "error": last_err, "token_id": token_id}
 
 
+def _tx_hash(result) -> str:
+    if not result:
+        return ""
+    if hasattr(result, "transaction") and hasattr(result.transaction, "hash"):
+        return result.transaction.hash
+    if hasattr(result, "transaction_outcome"):
+        return result.transaction_outcome.id
+    return str(result)[:32]
+
+
+def _tx_failure(result) -> Optional[str]:
+    """Ошибка исполнения tx, если py_near не бросил исключение сам: статус
+    транзакции или любой из её receipt'ов — Failure."""
+    status = getattr(result, "status", None)
+    if isinstance(status, dict) and "Failure" in status:
+        return str(status["Failure"])
+    for receipt in getattr(result, "receipt_outcome", None) or []:
+        r_status = getattr(receipt, "status", None)
+        if isinstance(r_status, dict) and "Failure" in r_status:
+            return str(r_status["Failure"])
+    return None
+
+
+async def _submit_transfer_batch(contract_id: str, chunk: List[tuple]) -> Dict:
+    """Одна транзакция с несколькими nft_transfer на контракт. Транзакция в
+    NEAR атомарна: либо ушли все карты пачки, либо ни одна."""
+    from py_near import transactions
+    actions = [
+        transactions.create_function_call_action(
+            "nft_transfer",
+            json.dumps({"receiver_id": to_wallet, "token_id": str(token_id)}).encode("utf8"),
+            ESCROW_TRANSFER_GAS,
+            1,
+        )
+        for to_wallet, token_id, _ in chunk
+    ]
+    last_err = ""
+    for attempt in range(2):
+        try:
+            result = await escrow_signer.sign_and_submit_tx(contract_id, actions)
+            failure = _tx_failure(result)
+            if failure:
+                # Исполнение упало (карты нет в эскроу и т.п.) — повтор
+                # пачки не поможет, разберёмся по одной карте.
+                return {"success": False, "error": failure}
+            return {"success": True, "tx_hash": _tx_hash(result)}
+        except Exception as e:
+            last_err = str(e)
+            print(f"[ESCROW] Batch of {len(chunk)} attempt {attempt + 1} failed: {last_err}")
+            if attempt < 1:
+                await asyncio.sleep(1.5)
+    return {"success": False, "error": last_err}
+
+
+async def transfer_nfts_from_escrow(transfers: List[tuple]) -> List[Dict]:
+    """Пакетный вывод карт из эскроу: [(to_wallet, token_id, nft_contract_id)]
+    -> результаты в том же порядке (формат как у transfer_nft_from_escrow).
+
+    Переводы группируются по контракту, и каждая группа уходит транзакциями
+    по ESCROW_BATCH_MAX_ACTIONS действий nft_transfer (получатель у каждого
+    действия свой). Возврат матча 5v5 — 1–2 транзакции вместо 10. Если пачка
+    не прошла, её карты переводятся по одной — одна «битая» карта не держит
+    остальные, а результат получается для каждой карты отдельно."""
+    if not transfers:
+        return []
+    if not ESCROW_PRIVATE_KEY:
+        return [{"success": False, "error": "Escrow private key not configured", "mock": True,
+                 "token_id": t[1]} for t in transfers]
+
+    results: List[Optional[Dict]] = [None] * len(transfers)
+    by_contract: Dict[str, List[int]] = {}
+    for i, (_, _, contract) in enumerate(transfers):
+        by_contract.setdefault(contract or NFT_CONTRACT_ID, []).append(i)
+
+    async def run(contract_id: str, part: List[int]):
+        chunk = [transfers[i] for i in part]
+        batch = (await _submit_transfer_batch(contract_id, chunk)
+                 if len(chunk) > 1 else {"success": False})
+        if batch.get("success"):
+            for i in part:
+                to_wallet, token_id, _ = transfers[i]
+                _forget_escrow_owned(token_id, contract_id)
+                print(f"[ESCROW] Transferred {token_id} to {to_wallet}, tx: {batch['tx_hash']}")
+                results[i] = {"success": True, "tx_hash": batch["tx_hash"],
+                              "token_id": token_id, "to": to_wallet}
+            return
+        for i in part:
+            to_wallet, token_id, _ = transfers[i]
+            results[i] = await transfer_nft_from_escrow(to_wallet, token_id, contract_id)
+
+    # Пачки независимы — подписант разводит их по разным ключам параллельно.
+    await asyncio.gather(*(
+        run(contract_id, idxs[start:start + ESCROW_BATCH_MAX_ACTIONS])
+        for contract_id, idxs in by_contract.items()
+        for start in range(0, len(idxs), ESCROW_BATCH_MAX_ACTIONS)
+    ))
+    return results
+
+
+def _deposit_wallet(dep, match_data: Dict) -> Optional[str]:
+    """Куда возвращать депозит: кошелёк из самого депозита, иначе кошелёк игрока в матче."""
+    if dep.near_wallet:
+        return dep.near_wallet
+    if dep.player_id == match_data.get("player1_id"):
+        return match_data.get("player1_near_wallet")
+    return match_data.get("player2_near_wallet")
+
+
+async def refund_deposits(deposits: list, match_data: Dict) -> List[Dict]:
+    """Вернуть депозиты владельцам одной пачкой; удачно ушедшие помечаются
+    refunded=True (коммит — на вызывающем). Результаты — по депозитам с
+    известным кошельком, в их порядке."""
+    targets = [(dep, _deposit_wallet(dep, match_data)) for dep in deposits]
+    targets = [(dep, wallet) for dep, wallet in targets if wallet]
+    if not targets or not is_escrow_configured():
+        return []
+    results = await transfer_nfts_from_escrow([
+        (wallet, dep.token_id, dep.nft_contract_id or NFT_CONTRACT_ID) for dep, wallet in targets
+    ])
+    for (dep, _), r in zip(targets, results):
+        if r.get("success"):
+            dep.refunded = True
+        r["player_id"] = dep.player_id
+    return results
+
+
 async def _get_match(match_id: str) -> Optional[Dict]:
     """Получаю матч из памяти или БД"""
     from routers.matchmaking import get_match
@@ -448,17 +560,15 @@ async def get_active_match(authorization: Optional[str] = Header(None)):
 
     ACTIVE_STATUSES = {"waiting_escrow", "active", "waiting"}
 
-    #  Шаг 1 — ищем в in-memory active_matches
-    from routers.matchmaking import active_matches
+    #  Шаг 1 — индекс player_id -> match_id поверх in-memory active_matches
+    from routers.matchmaking import active_matches, arm_match_deadlines, find_active_match_for, index_match
 
-    for mid, match in list(active_matches.items()):
+    mid = find_active_match_for(player_id)
+    if mid:
+        match = active_matches[mid]
         p1 = str(match.get("player1_id") or "")
         p2 = str(match.get("player2_id") or "")
-        if player_id not in (p1, p2):
-            continue
         match_status = match.get("status", "")
-        if match_status not in ACTIVE_STATUSES:
-            continue
 
         # Нашли в памяти
         my_escrow_confirmed = (
@@ -515,8 +625,10 @@ async def get_active_match(authorization: Optional[str] = Header(None)):
                     "created_at": str(db_match.created_at) if db_match.created_at else None,
                     "escrow_timeout_at": getattr(db_match, "escrow_timeout_at", None),
                 }
-                # Кладём в in-memory
+                # Кладём в in-memory и в индекс игроков
                 active_matches[mid] = match_dict
+                index_match(match_dict)
+                arm_match_deadlines(match_dict)
 
                 my_escrow_confirmed = (
                     match_dict.get("player1_escrow_confirmed", False) if player_id == p1
@@ -649,6 +761,9 @@ async def get_escrow_status():
         "escrow_wallet": ESCROW_WALLET,
         "escrow_configured": is_escrow_configured(),
         "nft_contract": NFT_CONTRACT_ID or "NOT SET",
+        "signer": escrow_signer.stats(),
+        "rpc": near_rpc.stats(),
+        "nft_cache": nft_cache.stats(),
     }
 
 
@@ -744,10 +859,17 @@ async def register_deposits(
             print(f"[MATCHES] register_deposits: match={match_id} player={player_id} "
                   f"existing={len(existing_deposits)} new={len(request.token_ids)}")
 
-            for i, token_id in enumerate(request.token_ids):
-                image = request.images[i] if request.images and i < len(request.images) else None
-                if not image and nft_contract:
-                    image = await fetch_nft_image(token_id, nft_contract)
+            given = {
+                token_id: request.images[i]
+                for i, token_id in enumerate(request.token_ids)
+                if request.images and i < len(request.images) and request.images[i]
+            }
+            fetched = await fetch_nft_images(
+                [t for t in request.token_ids if t not in given], nft_contract
+            )
+
+            for token_id in request.token_ids:
+                image = given.get(token_id) or fetched.get(str(token_id)) or None
 
                 if token_id in existing_token_ids:
                     # Обновляем существующий депозит (image мог не загрузиться с первого раза)
@@ -865,10 +987,10 @@ async def confirm_escrow(match_id: str, body: dict):
                     )
                 )
                 existing_token_ids = {d.token_id for d in existing_result.scalars().all()}
-                for tid in token_ids:
-                    if tid in existing_token_ids:
-                        continue
-                    image = await fetch_nft_image(tid, contract)
+                new_ids = [tid for tid in token_ids if tid not in existing_token_ids]
+                images = await fetch_nft_images(new_ids, contract)
+                for tid in new_ids:
+                    image = images.get(str(tid), "")
                     session.add(MatchDeposit(
                         match_id=match_id,
                         player_id=player_id,
@@ -1085,29 +1207,9 @@ async def refund_remaining_nfts(match_id: str):
                     MatchDeposit.refunded == False,
                 )
             )
-            deposits = result.scalars().all()
-            refunds = []
-
-            for dep in deposits:
-                if dep.token_id == claimed_token_id:
-                    continue
-
-                near_wallet = dep.near_wallet
-                if not near_wallet:
-                    if dep.player_id == match_data.get("player1_id"):
-                        near_wallet = match_data.get("player1_near_wallet")
-                    else:
-                        near_wallet = match_data.get("player2_near_wallet")
-
-                if near_wallet and is_escrow_configured():
-                    result_transfer = await transfer_nft_from_escrow(
-                        to_wallet=near_wallet,
-                        token_id=dep.token_id,
-                        nft_contract_id=dep.nft_contract_id or NFT_CONTRACT_ID,
-                    )
-                    if result_transfer.get("success"):
-                        dep.refunded = True
-                        refunds.append(dep.token_id)
+            deposits = [dep for dep in result.scalars().all() if dep.token_id != claimed_token_id]
+            refunds = [r["token_id"] for r in await refund_deposits(deposits, match_data)
+                       if r.get("success")]
 
             await session.commit()
             print(f"[MATCHES] Refunded {len(refunds)} NFTs for match {match_id}")
@@ -1226,7 +1328,7 @@ async def cancel_match(match_id: str, authorization: Optional[str] = Header(None
     try:
         from routers.matchmaking import matchmaking_queue
         for _uid, _e in list(matchmaking_queue.items()):
-            if _e.get("open_match_id") == match_id:
+            if _e.open_match_id == match_id:
                 del matchmaking_queue[_uid]
     except Exception:
         pass
@@ -1238,20 +1340,10 @@ async def cancel_match(match_id: str, authorization: Optional[str] = Header(None
                 select(MatchDeposit).where(MatchDeposit.match_id == match_id)
             )
             deposits = result.scalars().all()
-            for dep in deposits:
-                near_wallet = dep.near_wallet
-                if not near_wallet:
-                    if dep.player_id == match_data.get("player1_id"):
-                        near_wallet = match_data.get("player1_near_wallet")
-                    else:
-                        near_wallet = match_data.get("player2_near_wallet")
-                if near_wallet and is_escrow_configured():
-                    r = await transfer_nft_from_escrow(
-                        to_wallet=near_wallet,
-                        token_id=dep.token_id,
-                        nft_contract_id=dep.nft_contract_id or NFT_CONTRACT_ID,
-                    )
-                    refunds.append({"player_id": dep.player_id, "token_id": dep.token_id, "result": r})
+            for r in await refund_deposits(deposits, match_data):
+                refunds.append({"player_id": r.pop("player_id"), "token_id": r.get("token_id"), "result": r})
+            await session.commit()
+            break
     except Exception as e:
         print(f"[MATCHES] cancel refund error: {e}")
 
@@ -1266,6 +1358,87 @@ async def get_match_endpoint(match_id: str):
     return match_data
 
 
+def _replay_log(match_data: Dict) -> Dict:
+    log = match_data.get("event_log")
+    if not log:
+        raise HTTPException(status_code=404, detail="Replay is not available for this match")
+    # Руки и ходы живой партии не отдаём — только после её завершения.
+    if not log.get("end"):
+        raise HTTPException(status_code=409, detail="Match is still in progress")
+    return log
+
+
+@router.get("/{match_id}/replay")
+async def stream_replay(match_id: str):
+    """Реплей партии потоком NDJSON: стартовая раздача, кадр на каждый ход
+    (как card_played) и итог перепроверки журнала."""
+    from fastapi.responses import StreamingResponse
+    from game import replay
+
+    match_data = await _get_match(match_id)
+    if not match_data:
+        raise HTTPException(status_code=404, detail="Match not found")
+    log = _replay_log(match_data)
+
+    def _lines():
+        try:
+            start = replay.initial_state(log)
+            yield dumps({
+                "type": "replay_start",
+                "match_id": match_id,
+                "total_steps": len(log.get("mv") or []),
+                "first_turn": log.get("ft"),
+                "state": start.to_state_dict(),
+                "player1_hand": [c.to_dict(start.player1_id) for c in start.player1_hand],
+                "player2_hand": [c.to_dict(start.player2_id) for c in start.player2_hand],
+            }) + "\n"
+            for frame in replay.frames(log):
+                yield dumps(frame) + "\n"
+        except replay.ReplayError as e:
+            yield dumps({"type": "replay_error", "message": str(e)}) + "\n"
+            return
+        yield dumps({"type": "replay_end", **replay.verify(log)}) + "\n"
+
+    return StreamingResponse(_lines(), media_type="application/x-ndjson")
+
+
+@router.get("/{match_id}/replay/{step}")
+async def get_replay_step(match_id: str, step: int):
+    """Состояние партии после step ходов (0 — стартовая раздача)."""
+    from game import replay
+
+    match_data = await _get_match(match_id)
+    if not match_data:
+        raise HTTPException(status_code=404, detail="Match not found")
+    log = _replay_log(match_data)
+    try:
+        state = replay.state_at(log, step)
+    except replay.ReplayError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    p1_score, p2_score = state.score()
+    return {
+        "match_id": match_id,
+        "step": step,
+        "total_steps": len(log.get("mv") or []),
+        "state": state.to_state_dict(),
+        "player1_hand": [c.to_dict(state.player1_id) for c in state.player1_hand],
+        "player2_hand": [c.to_dict(state.player2_id) for c in state.player2_hand],
+        "player1_score": p1_score,
+        "player2_score": p2_score,
+    }
+
+
+@router.get("/{match_id}/replay_verify")
+async def verify_replay(match_id: str):
+    """Перепроверка записанного результата по журналу (споры, аналитика)."""
+    from game import replay
+
+    match_data = await _get_match(match_id)
+    if not match_data:
+        raise HTTPException(status_code=404, detail="Match not found")
+    return {"match_id": match_id, **replay.verify(_replay_log(match_data))}
+
+
 @router.post("/{match_id}/finish")
 async def finish_match(
         match_id: str,
@@ -1442,7 +1615,9 @@ async def _finalize_match_result(
         match_data["finish_reason"] = reason
 
     rating_update = match_data.get("rating_update")
-    if winner_id and p1 and p2 and not match_data.get("rating_applied"):
+    # Партия с серверным ботом (mode="bot") — тренировка: рейтинг не двигаем.
+    if (winner_id and p1 and p2 and not match_data.get("rating_applied")
+            and match_data.get("mode") != "bot"):
         # Ставим флаг СИНХРОННО, до await: match_data — общий объект в
         # active_matches, поэтому второй параллельный вызов (WS game_over +
         # клиентский /finish почти одновременно) сразу увидит True и не
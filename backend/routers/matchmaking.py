@@ -1,23 +1,40 @@
-from fastapi import APIRouter, HTTPException, status, Header
+from fastapi import APIRouter, HTTPException, status, Header, WebSocket, WebSocketDisconnect
 from pydantic import BaseModel
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, Tuple
 from datetime import datetime, timedelta
 import uuid
 import asyncio
+import heapq
+import os
+import time
+from collections import deque
 
 from sqlalchemy import select
 
+from database.match_writer import match_writer
 from database.session import get_session
 from database.models.pvp_match import PvPMatch
 from database.models.match_deposit import MatchDeposit
 from database.models.user import User
 from database.models.user_deck import UserDeck
+from game import ai as bot_ai
+from game import balance
+from game.lobby import lobby_hub
+from game.wire import MATCH_CANCELLED_FRAME, dumps, loads
+from utils.match_queue import MatchQueue, QueueEntry
+from utils.match_registry import match_registry
+from utils.timing_wheel import wheel
 
 router = APIRouter(prefix="/api/matchmaking", tags=["matchmaking"])
 
 # In-memory для быстрого доступа (кэш поверх БД)
-matchmaking_queue: Dict[str, Dict[str, Any]] = {}
-active_matches: Dict[str, Dict[str, Any]] = {}
+# Очередь с индексом ищущих и позицией за O(log n) (utils.match_queue).
+matchmaking_queue = MatchQueue()
+# Матчи в памяти (кэш поверх PvPMatch) с выселением завершённых.
+active_matches = match_registry
+# Вторичный индекс player_id -> match_id незавершённого матча (см. index_match).
+player_matches: Dict[str, str] = {}
+ACTIVE_MATCH_STATUSES = ("waiting_escrow", "active", "waiting")
 
 ESCROW_LOCK_TIMEOUT_SECONDS = 150
 GAME_RECONNECT_TIMEOUT_SECONDS = 180
@@ -27,12 +44,43 @@ STUCK_ACTIVE_TIMEOUT_SECONDS = 180
 # Один игрок залочил, а нового соперника всё нет: сколько всего держим его
 # карты в эскроу с автопоиском, прежде чем на всякий случай вернуть их.
 REOPEN_MAX_WAIT_SECONDS = 900
+# Запись очереди без найденного матча живёт столько, потом выкидываем.
+QUEUE_ENTRY_TTL_SECONDS = 600
+# Реконсайлер возвратов читает невозвращённые депозиты пачками такого размера.
+RECONCILE_BATCH = int(os.getenv("RECONCILE_BATCH", "200"))
+# Бэкфилл ботом: при малом онлайне через столько секунд ожидания игрок
+# получает матч с серверным ботом (mode="bot", без эскроу) — это и есть
+# потолок времени до матча. Выключено по умолчанию.
+BOT_BACKFILL_ENABLED = os.getenv("BOT_BACKFILL_ENABLED", "0") == "1"
+BOT_BACKFILL_WAIT_SECONDS = float(os.getenv("BOT_BACKFILL_WAIT_SECONDS", "45"))
+BOT_BACKFILL_TIER = os.getenv("BOT_BACKFILL_TIER", "normal")
+# Пакетный матчмейкер: раз в MATCHMAKER_TICK_SECONDS собирает пары по всей
+# очереди сразу, а не жадно внутри того join_queue, что пришёл первым.
+MATCHMAKER_TICK_SECONDS = float(os.getenv("MATCHMAKER_TICK_SECONDS", "0.3"))
+# Веса стоимости пары: разрывы Elo и рейтинга колоды нормированы на текущий
+# коридор (0..1), ожидание — бонус за минуту суммарного ожидания пары.
+MATCHMAKER_ELO_WEIGHT = float(os.getenv("MATCHMAKER_ELO_WEIGHT", "1.0"))
+MATCHMAKER_RATING_WEIGHT = float(os.getenv("MATCHMAKER_RATING_WEIGHT", "1.0"))
+MATCHMAKER_WAIT_WEIGHT = float(os.getenv("MATCHMAKER_WAIT_WEIGHT", "0.5"))
+# Окно развёртки: сколько соседей по Elo смотрим вперёд от каждого игрока,
+# и сколько лучших из них попадает в граф пар.
+MATCHMAKER_SCAN = int(os.getenv("MATCHMAKER_SCAN", "24"))
+MATCHMAKER_CANDIDATES = int(os.getenv("MATCHMAKER_CANDIDATES", "6"))
+# Потолок ожидания одного long-poll запроса лобби-канала.
+LOBBY_LONG_POLL_MAX_SECONDS = float(os.getenv("LOBBY_LONG_POLL_MAX_SECONDS", "25"))
+
+# Границы корзин гистограммы ожидания до матча, секунды.
+_WAIT_BUCKETS = (5, 10, 20, 30, 45, 60, 90, 120, 180, 300, 600)
 
 
 class JoinQueueRequest(BaseModel):
     max_elo_diff: Optional[int] = 300
 
 
+class BotMatchRequest(BaseModel):
+    tier: Optional[str] = None  # easy | normal | hard (см. game.ai.TIERS)
+
+
 def get_user_id_from_token(authorization: str = None) -> Optional[str]:
     if not authorization:
         return None
@@ -108,13 +156,38 @@ async def load_user_deck(user_id: str) -> List[Dict]:
     return []
 
 
+def index_match(match_data: Dict) -> None:
+    """Обновляет player_matches по текущему статусу матча. Зовётся везде, где
+    матч попадает в active_matches или сохраняется (save_match, get_match,
+    /matches/active, турнирные игры)."""
+    mid = match_data.get("match_id")
+    if not mid:
+        return
+    live = match_data.get("status") in ACTIVE_MATCH_STATUSES
+    for pid in (match_data.get("player1_id"), match_data.get("player2_id")):
+        if not pid:
+            continue
+        pid = str(pid)
+        if live:
+            player_matches[pid] = mid
+        elif player_matches.get(pid) == mid:
+            del player_matches[pid]
+
+
 def find_active_match_for(user_id: str) -> Optional[str]:
-    """Возвращает id незавершённого матча игрока, если он есть (защита от дублей)."""
+    """Возвращает id незавершённого матча игрока, если он есть (защита от дублей).
+    O(1) по player_matches; статус сверяется с самим матчем — если он
+    закончился мимо save_match (статус поменяли на месте), запись индекса
+    просто выбрасывается."""
     uid = str(user_id)
-    for mid, m in list(active_matches.items()):
-        if uid in (str(m.get("player1_id")), str(m.get("player2_id"))):
-            if m.get("status") in ("waiting_escrow", "active", "waiting"):
-                return mid
+    mid = player_matches.get(uid)
+    if mid is None:
+        return None
+    m = active_matches.get(mid)
+    if m is not None and m.get("status") in ACTIVE_MATCH_STATUSES \
+            and uid in (str(m.get("player1_id")), str(m.get("player2_id"))):
+        return mid
+    del player_matches[uid]
     return None
 
 
@@ -128,87 +201,116 @@ def calculate_elo_range(wait_time_seconds: float, max_diff: int = 300) -> int:
     return 500
 
 
-def deck_power(deck) -> int:
-    """Сила колоды = сумма всех сторон всех карт (ACE=10). Чем больше — тем
-    сильнее NFT. Нужна для честного подбора (сильные колоды встречают сильные)."""
-    total = 0
-    for c in (deck or []):
-        vals = (c.get("values") or c.get("stats") or {}) if isinstance(c, dict) else {}
-        for k in ("top", "right", "bottom", "left"):
-            try:
-                total += int(vals.get(k) or 0)
-            except Exception:
-                pass
-    return total
+async def get_deck_rating(user_id: str, deck: List[Dict]) -> int:
+    """Рейтинг колоды (game.balance, 0..1000 — промилле побед против
+    эталонного пула). Нужен для честного подбора: сильные колоды встречают
+    сильные. Порядок: память процесса -> UserDeck.deck_rating (если карты те
+    же) -> симуляция в потоке с записью обратно в UserDeck."""
+    cached = balance.cached_rating(deck)
+    if cached is not None:
+        return cached
+    sig = balance.deck_signature(deck)
+    row = None
+    try:
+        async for session in get_session():
+            result = await session.execute(select(UserDeck).where(UserDeck.user_id == str(user_id)))
+            row = result.scalar_one_or_none()
+            if row is not None and row.deck_rating is not None and row.deck_rating_sig == sig:
+                balance.remember(deck, row.deck_rating)
+                return int(row.deck_rating)
+            break
+    except Exception as e:
+        print(f"[Matchmaking] deck rating DB read error: {e}")
 
+    rating = await asyncio.to_thread(balance.rate_deck, deck)
+    if row is not None:
+        try:
+            async for session in get_session():
+                row = await session.get(UserDeck, row.id)
+                if row is not None:
+                    row.deck_rating = rating
+                    row.deck_rating_sig = sig
+                    await session.commit()
+                break
+        except Exception as e:
+            print(f"[Matchmaking] deck rating DB save error: {e}")
+    return rating
 
-def calculate_power_range(wait_time_seconds: float) -> int:
-    """Коридор по силе колоды, расширяется со временем ожидания — чтобы при
-    малом онлайне очередь не зависала (после ~70с ограничение снимается)."""
+
+# После стольких секунд ожидания коридор по колоде снимается совсем.
+RATING_RANGE_OPEN_SECONDS = 70
+
+
+def calculate_rating_range(wait_time_seconds: float) -> int:
+    """Коридор по рейтингу колоды, расширяется со временем ожидания — чтобы при
+    малом онлайне очередь не зависала (после RATING_RANGE_OPEN_SECONDS
+    ограничение снимается)."""
     if wait_time_seconds < 8:
-        return 30
+        return 40
     elif wait_time_seconds < 20:
-        return 55
+        return 80
     elif wait_time_seconds < 40:
-        return 95
-    elif wait_time_seconds < 70:
-        return 170
+        return 150
+    elif wait_time_seconds < RATING_RANGE_OPEN_SECONDS:
+        return 250
     return 100000
 
 
-def find_opponent(user_id: str, user_elo: int, max_elo_diff: int, user_power: int = 0) -> Optional[str]:
-    now = datetime.utcnow()
-    for queue_user_id, queue_data in list(matchmaking_queue.items()):
-        if queue_user_id == user_id:
-            continue
-        if queue_data.get("match_id"):
+def plan_pairs(now: Optional[datetime] = None) -> List[Tuple[QueueEntry, QueueEntry, float]]:
+    """Пары на один тик (sort-and-sweep). Ищущие сортируются по Elo; каждый
+    смотрит MATCHMAKER_SCAN соседей вперёд (пока разрыв не вышел за самый
+    широкий возможный коридор) и оставляет MATCHMAKER_CANDIDATES лучших по
+    качеству — разрывы Elo и колоды, нормированные на коридор. Коридор пары —
+    того, кто ждёт дольше. Затем жадное паросочетание по возрастанию
+    стоимости, где ожидание пары — бонус: долго ждущих сводим первыми.
+    O(n·log n + n·k) вместо перебора всех пар, результат близок к оптимуму."""
+    now = now or datetime.utcnow()
+    pool = sorted(matchmaking_queue.searching(), key=lambda e: e.elo)
+    n = len(pool)
+    elo = [e.elo for e in pool]
+    rating = [e.deck_rating for e in pool]
+    lobby = [bool(e.open_match_id) for e in pool]
+    wait = [(now - e.joined_at).total_seconds() for e in pool]
+    elo_range = [max(1, calculate_elo_range(w, e.max_elo_diff)) for w, e in zip(wait, pool)]
+    rating_range = [max(1, calculate_rating_range(w)) for w in wait]
+    elo_cap = max(elo_range, default=0)
+    w_elo, w_rating, w_wait = MATCHMAKER_ELO_WEIGHT, MATCHMAKER_RATING_WEIGHT, MATCHMAKER_WAIT_WEIGHT / 60.0
+
+    edges: List[Tuple[float, int, int]] = []
+    for i in range(n):
+        found = []
+        for j in range(i + 1, min(n, i + 1 + MATCHMAKER_SCAN)):
+            elo_gap = elo[j] - elo[i]
+            if elo_gap > elo_cap:
+                break
+            if lobby[i] and lobby[j]:
+                continue  # два лобби с картами в эскроу в один матч не склеить
+            k = i if wait[i] >= wait[j] else j
+            rating_gap = abs(rating[i] - rating[j])
+            if elo_gap > elo_range[k] or rating_gap > rating_range[k]:
+                continue
+            found.append((w_elo * elo_gap / elo_range[k] + w_rating * rating_gap / rating_range[k], j))
+        if len(found) > MATCHMAKER_CANDIDATES:
+            found = heapq.nsmallest(MATCHMAKER_CANDIDATES, found)
+        for cost, j in found:
+            edges.append((cost - w_wait * (wait[i] + wait[j]), i, j))
+
+    edges.sort()
+    used = [False] * n
+    pairs = []
+    for cost, i, j in edges:
+        if used[i] or used[j]:
             continue
-        wait_time = (now - queue_data.get("joined_at", now)).total_seconds()
-        opponent_elo = queue_data.get("elo", 1000)
-        opponent_power = queue_data.get("power", 0)
-        elo_range = calculate_elo_range(wait_time, max_elo_diff)
-        # коридор по силе берём по БОЛЬШЕМУ времени ожидания из двоих
-        power_range = calculate_power_range(wait_time)
-        if abs(user_elo - opponent_elo) <= elo_range and \
-           abs(user_power - opponent_power) <= power_range:
-            return queue_user_id
-    return None
+        used[i] = used[j] = True
+        pairs.append((pool[i], pool[j], cost))
+    return pairs
 
 
 async def _save_match_to_db(match_data: Dict) -> bool:
-    """Сохраняем матч в PostgreSQL"""
+    """Сохраняем матч в PostgreSQL: только изменившиеся колонки, всплески
+    сохранений одного матча склеиваются (database.match_writer)."""
     try:
-        async for session in get_session():
-            existing = await session.get(PvPMatch, match_data["match_id"])
-            if existing:
-                for key, value in match_data.items():
-                    if key == "match_id":
-                        continue
-                    if hasattr(existing, key):
-                        setattr(existing, key, value)
-            else:
-                match = PvPMatch(
-                    id=match_data["match_id"],
-                    player1_id=match_data.get("player1_id", ""),
-                    player2_id=match_data.get("player2_id"),
-                    status=match_data.get("status", "waiting"),
-                    player1_deck=match_data.get("player1_deck", []),
-                    player2_deck=match_data.get("player2_deck", []),
-                    board=match_data.get("board", [None] * 9),
-                    board_elements=match_data.get("board_elements", []),
-                    current_turn=match_data.get("current_turn"),
-                    player1_hand=match_data.get("player1_hand", []),
-                    player2_hand=match_data.get("player2_hand", []),
-                    player1_escrow_confirmed=match_data.get("player1_escrow_confirmed", False),
-                    player2_escrow_confirmed=match_data.get("player2_escrow_confirmed", False),
-                    player1_near_wallet=match_data.get("player1_near_wallet"),
-                    player2_near_wallet=match_data.get("player2_near_wallet"),
-                    escrow_locked=match_data.get("escrow_locked", False),
-                    mode=match_data.get("mode", "pvp"),
-                )
-                session.add(match)
-            await session.commit()
-            return True
+        return await match_writer.save(match_data)
     except Exception as e:
         print(f"[Matchmaking] DB save error: {e}")
         return False
@@ -250,6 +352,7 @@ async def _load_match_from_db(match_id: str) -> Optional[Dict]:
                 "moves_count": match.moves_count or 0,
                 "created_at": match.created_at.isoformat() if match.created_at else datetime.utcnow().isoformat(),
                 "escrow_timeout_at": match.escrow_timeout_at.isoformat() if match.escrow_timeout_at else None,
+                "event_log": match.event_log,
             }
     except Exception as e:
         print(f"[Matchmaking] DB load error: {e}")
@@ -265,7 +368,10 @@ async def get_match(match_id: str) -> Optional[Dict]:
         return active_matches[match_id]
     match = await _load_match_from_db(match_id)
     if match:
+        match_writer.seed(match)
         active_matches[match_id] = match
+        index_match(match)
+        arm_match_deadlines(match)
     return match
 
 
@@ -273,23 +379,257 @@ async def save_match(match_data: Dict):
     """Сохраняем матч в память и БД"""
     match_id = match_data["match_id"]
     active_matches[match_id] = match_data
-    await _save_match_to_db(match_data)
+    index_match(match_data)
+    arm_match_deadlines(match_data)
+    active_matches.mark_saved(match_id, await _save_match_to_db(match_data) is True)
+    _notify_lobby(match_data)
+
+
+# Перед выселением завершённого матча реестр дописывает его в PvPMatch.
+active_matches.persist = _save_match_to_db
+active_matches.on_evict(match_writer.forget)
+
+
+def _lobby_event(match_data: Dict, user_id: str) -> Optional[Tuple[tuple, Dict]]:
+    """Что показать игроку на экране поиска/лока по его матчу:
+    (сигнатура, событие) или None, если матч лобби уже не касается."""
+    mid = match_data.get("match_id")
+    st = match_data.get("status")
+    if st == "cancelled":
+        return ("cancelled", mid), {
+            "type": "cancelled",
+            "match_id": mid,
+            "reason": match_data.get("cancelled_reason", "timeout"),
+        }
+    if st not in ("waiting", "waiting_escrow", "active"):
+        return None
+    mode = match_data.get("mode", "pvp")
+    me = "player1" if str(match_data.get("player1_id")) == user_id else "player2"
+    them = "player2" if me == "player1" else "player1"
+    opp = match_data.get(f"{them}_id")
+    opp = str(opp) if opp else None
+    if match_data.get("escrow_locked"):
+        return ("ready", mid), {"type": "ready", "match_id": mid, "opponent_id": opp, "mode": mode}
+    you_locked = bool(match_data.get(f"{me}_escrow_confirmed"))
+    opp_locked = bool(match_data.get(f"{them}_escrow_confirmed"))
+    timeout_at = match_data.get("escrow_timeout_at")
+    remaining = None
+    deadline = _parse_dt(timeout_at)
+    if deadline is not None:
+        remaining = max(0.0, round((deadline - datetime.utcnow()).total_seconds(), 1))
+    return ("escrow", mid, opp, you_locked, opp_locked, timeout_at), {
+        "type": "escrow",
+        "match_id": mid,
+        "opponent_id": opp,
+        "mode": mode,
+        "escrow_remaining_seconds": remaining,
+        "you_locked": you_locked,
+        "opponent_locked": opp_locked,
+    }
 
 
-def _requeue_locker(match_id: str, locker_id: str, elo: int, power: int = 0) -> None:
+def _notify_lobby(match_data: Dict) -> None:
+    """Пуш в лобби-канал обоим игрокам (game.lobby). Хук на каждом
+    save_match; повторы того же состояния хаб отбрасывает сам."""
+    for uid in (match_data.get("player1_id"), match_data.get("player2_id")):
+        uid = str(uid or "")
+        if not uid or bot_ai.is_bot(uid):
+            continue
+        got = _lobby_event(match_data, uid)
+        if got is None:
+            continue
+        sig, event = got
+        if event["type"] == "escrow" and event["opponent_id"]:
+            prev = lobby_hub.last_sig(uid)
+            # Соперник появился впервые (новый матч или подсадка в reopen-лобби).
+            if not (isinstance(prev, tuple) and prev[0] == "escrow" and prev[1:3] == sig[1:3]):
+                event["type"] = "matched"
+        if lobby_hub.publish(uid, sig, event) and event["type"] != "escrow":
+            _drop_matched_entry(uid, event["match_id"])
+
+
+def _drop_matched_entry(user_id: str, match_id: Optional[str]) -> None:
+    """Запись очереди держалась, чтобы опрос join_queue узнал о матче. Клиенту
+    лобби-канала исход уже доставлен — запись больше не нужна."""
+    entry = matchmaking_queue.get(user_id)
+    if entry is not None and match_id and entry.match_id == match_id:
+        del matchmaking_queue[user_id]
+        wheel.cancel(("queue", user_id))
+        wheel.cancel(("backfill", user_id))
+
+
+def lobby_snapshot(user_id: str) -> Dict:
+    """Текущее состояние игрока для лобби-канала (при подключении и по
+    таймауту long-poll) — только из памяти, без БД."""
+    mid = find_active_match_for(user_id)
+    match_data = active_matches.get(mid) if mid else None
+    got = _lobby_event(match_data, user_id) if match_data else None
+    if got is not None:
+        event = got[1]
+        if event["type"] == "escrow" and event["opponent_id"]:
+            event["type"] = "matched"
+        if event["type"] != "escrow":
+            _drop_matched_entry(user_id, mid)
+    elif user_id in matchmaking_queue:
+        event = {
+            "type": "searching",
+            "position": matchmaking_queue.position(user_id),
+            "queue_size": len(matchmaking_queue),
+        }
+    else:
+        event = {"type": "idle"}
+    event["seq"] = lobby_hub.last_seq(user_id)
+    return event
+
+
+def arm_match_deadlines(match_data: Dict) -> None:
+    """Ставит/снимает таймеры матча в колесе (utils.timing_wheel) по его
+    текущему статусу. Вызывается на каждом сохранении и при подгрузке из БД,
+    поэтому фоновой чистке больше не нужно обходить active_matches."""
+    mid = match_data.get("match_id")
+    if not mid:
+        return
+    st = match_data.get("status")
+
+    if st in ("waiting", "waiting_escrow", "pending_lock"):
+        created = _parse_dt(match_data.get("created_at"))
+        if created is not None:
+            wheel.schedule_at(("escrow", mid), created + timedelta(seconds=ESCROW_LOCK_TIMEOUT_SECONDS),
+                              _escrow_deadline_fired, mid)
+        first_locked = _parse_dt(match_data.get("first_locked_at"))
+        if match_data.get("reopened") and first_locked is not None:
+            wheel.schedule_at(("reopen", mid), first_locked + timedelta(seconds=REOPEN_MAX_WAIT_SECONDS),
+                              _escrow_deadline_fired, mid)
+        else:
+            wheel.cancel(("reopen", mid))
+    else:
+        wheel.cancel(("escrow", mid))
+        wheel.cancel(("reopen", mid))
+
+    if st == "active" and not match_data.get("winner") and match_data.get("mode") != "tournament":
+        started = _parse_dt(match_data.get("game_started_at")) or _parse_dt(match_data.get("created_at"))
+        if started is not None:
+            wheel.schedule_at(("stuck", mid), started + timedelta(seconds=STUCK_ACTIVE_TIMEOUT_SECONDS),
+                              _stuck_deadline_fired, mid)
+    else:
+        wheel.cancel(("stuck", mid))
+
+
+async def _escrow_deadline_fired(match_id: str):
+    try:
+        await check_and_refund_stale_match(match_id)
+    except Exception as e:
+        print(f"[Matchmaking] Error refunding stale match {match_id}: {e}")
+
+
+async def _stuck_deadline_fired(match_id: str):
+    # Зависшие залоченные матчи (status=active, но игра не пошла) —
+    # отменяем и возвращаем NFT обоим.
+    try:
+        await resolve_stuck_active_match(match_id)
+    except Exception as e:
+        print(f"[Matchmaking] Error resolving stuck match {match_id}: {e}")
+
+
+def _arm_queue_expiry(user_id: str, joined_at: datetime) -> None:
+    wheel.schedule_at(("queue", user_id), joined_at + timedelta(seconds=QUEUE_ENTRY_TTL_SECONDS),
+                      _expire_queue_entry, user_id, joined_at)
+
+
+def _expire_queue_entry(user_id: str, joined_at: datetime) -> None:
+    entry = matchmaking_queue.get(user_id)
+    # Игрок мог выйти и встать в очередь заново — это уже другая запись.
+    if entry is None or entry.joined_at != joined_at or entry.match_id:
+        return
+    del matchmaking_queue[user_id]
+    print(f"[Matchmaking] Removed stale user {user_id} from queue")
+
+
+def _arm_backfill(user_id: str, joined_at: datetime) -> None:
+    if BOT_BACKFILL_ENABLED:
+        wheel.schedule_at(("backfill", user_id), joined_at + timedelta(seconds=BOT_BACKFILL_WAIT_SECONDS),
+                          _backfill_fired, user_id, joined_at)
+
+
+async def _backfill_fired(user_id: str, joined_at: datetime) -> None:
+    """Живого соперника за BOT_BACKFILL_WAIT_SECONDS не нашлось — сажаем
+    игрока за матч с ботом. Результат он заберёт обычным опросом join_queue
+    (match_id в его записи очереди)."""
+    entry = matchmaking_queue.get(user_id)
+    # Лобби с картами в эскроу (open_match_id) бот не заменяет — ставка уже внесена.
+    if entry is None or entry.joined_at != joined_at or entry.match_id \
+            or entry.open_match_id or not entry.deck:
+        return
+    # Игрок перестал опрашивать и не держит лобби-канал (закрыл приложение,
+    # не выйдя из очереди) — матч с ботом ему некому играть.
+    if not lobby_hub.present(user_id) and (datetime.utcnow() - entry.last_poll).total_seconds() > 20:
+        return
+    if find_active_match_for(user_id):
+        return
+    # match_id ставим ДО первого await: матчмейкер такую запись уже не выберет.
+    match_id = str(uuid.uuid4())
+    matchmaking_queue.set_match(user_id, match_id)
+    _record_match_wait(joined_at, bot=True)
+    await create_bot_match(user_id, entry.deck, BOT_BACKFILL_TIER, match_id=match_id)
+
+
+# Метрики матчмейкинга: сколько матчей собрано живых/с ботом и сколько
+# игроки прождали до матча (гистограмма + скользящее окно для перцентилей).
+_mm_stats = {
+    "matched_pvp": 0,
+    "matched_bot": 0,
+    "wait_buckets": [0] * (len(_WAIT_BUCKETS) + 1),
+    "ticks": 0,
+    "tick_ms_last": 0.0,
+    "tick_ms_max": 0.0,
+    "pairs_last": 0,
+}
+_recent_waits: deque = deque(maxlen=1000)
+
+
+def _record_match_wait(joined_at: Optional[datetime], bot: bool = False) -> None:
+    wait = max(0.0, (datetime.utcnow() - joined_at).total_seconds()) if joined_at else 0.0
+    _mm_stats["matched_bot" if bot else "matched_pvp"] += 1
+    i = 0
+    while i < len(_WAIT_BUCKETS) and wait > _WAIT_BUCKETS[i]:
+        i += 1
+    _mm_stats["wait_buckets"][i] += 1
+    _recent_waits.append(wait)
+
+
+def matchmaking_stats() -> dict:
+    pvp, bot = _mm_stats["matched_pvp"], _mm_stats["matched_bot"]
+    waits = sorted(_recent_waits)
+
+    def pct(q: float) -> float:
+        return round(waits[min(len(waits) - 1, int(q * len(waits)))], 3) if waits else 0.0
+
+    labels = [f"le_{b}" for b in _WAIT_BUCKETS] + ["gt_" + str(_WAIT_BUCKETS[-1])]
+    return {
+        "backfill_enabled": BOT_BACKFILL_ENABLED,
+        "backfill_wait_seconds": BOT_BACKFILL_WAIT_SECONDS,
+        "matched_pvp": pvp,
+        "matched_bot": bot,
+        "backfill_rate": round(bot / (pvp + bot), 4) if pvp + bot else 0.0,
+        "wait_seconds": {"p50": pct(0.5), "p95": pct(0.95), "max": round(waits[-1], 3) if waits else 0.0},
+        "wait_histogram": dict(zip(labels, _mm_stats["wait_buckets"])),
+        "matchmaker": {
+            "tick_seconds": MATCHMAKER_TICK_SECONDS,
+            "ticks": _mm_stats["ticks"],
+            "tick_ms_last": _mm_stats["tick_ms_last"],
+            "tick_ms_max": _mm_stats["tick_ms_max"],
+            "pairs_last": _mm_stats["pairs_last"],
+        },
+    }
+
+
+def _requeue_locker(match_id: str, locker_id: str, elo: int, deck_rating: int = 0) -> None:
     """Возвращаем залочившего в очередь как «лобби с готовыми картами».
     open_match_id говорит матчмейкингу: не создавай новый матч, а подсади
     следующего соперника в этот существующий (карты уже в эскроу)."""
-    matchmaking_queue[str(locker_id)] = {
-        "user_id": str(locker_id),
-        "elo": elo,
-        "power": power,
-        "deck": [],
-        "joined_at": datetime.utcnow(),
-        "last_poll": datetime.utcnow(),
-        "match_id": None,
-        "open_match_id": match_id,
-    }
+    now = datetime.utcnow()
+    matchmaking_queue.add(QueueEntry(str(locker_id), elo, deck_rating, [], now, open_match_id=match_id))
+    _arm_queue_expiry(str(locker_id), now)
 
 
 async def _reopen_match_keep_locker(match_data: Dict, locker_key: str) -> None:
@@ -329,12 +669,13 @@ async def _reopen_match_keep_locker(match_data: Dict, locker_key: str) -> None:
     match_data["reopened_at"] = now.isoformat()
     await save_match(match_data)
     elo = await get_user_elo(locker_id)
-    _requeue_locker(mid, locker_id, elo, deck_power(match_data.get("player1_deck")))
+    deck_rating = await get_deck_rating(locker_id, match_data.get("player1_deck") or [])
+    _requeue_locker(mid, locker_id, elo, deck_rating)
     print(f"[Matchmaking] Match {mid} reopened: keep {locker_id} locked, searching new opponent")
 
 
 async def check_and_refund_stale_match(match_id: str) -> bool:
-    from routers.matches import transfer_nft_from_escrow, is_escrow_configured
+    from routers.matches import refund_deposits
 
     match_data = await get_match(match_id)
     if not match_data:
@@ -356,7 +697,12 @@ async def check_and_refund_stale_match(match_id: str) -> bool:
         return False
 
     elapsed = (datetime.utcnow() - created_at).total_seconds()
-    if elapsed < ESCROW_LOCK_TIMEOUT_SECONDS:
+    first_locked = _parse_dt(match_data.get("first_locked_at"))
+    over_cap = first_locked is not None and \
+        (datetime.utcnow() - first_locked).total_seconds() > REOPEN_MAX_WAIT_SECONDS
+    # Таймер reopen-лобби срабатывает по своему дедлайну, не дожидаясь
+    # очередного окна эскроу.
+    if elapsed < ESCROW_LOCK_TIMEOUT_SECONDS and not over_cap:
         return False
 
     print(f"[Matchmaking] Match {match_id} timed out after {elapsed:.0f}s, refunding...")
@@ -376,9 +722,6 @@ async def check_and_refund_stale_match(match_id: str) -> bool:
     # только как предохранитель, если новый соперник так и не нашёлся за
     # REOPEN_MAX_WAIT_SECONDS (или игрок сам нажмёт «Забрать NFT»).
     if p1_confirmed != p2_confirmed:
-        first_locked = _parse_dt(match_data.get("first_locked_at"))
-        over_cap = first_locked is not None and \
-            (datetime.utcnow() - first_locked).total_seconds() > REOPEN_MAX_WAIT_SECONDS
         if not over_cap:
             locker_key = "player1" if p1_confirmed else "player2"
             await _reopen_match_keep_locker(match_data, locker_key)
@@ -394,24 +737,8 @@ async def check_and_refund_stale_match(match_id: str) -> bool:
                 select(MatchDeposit).where(MatchDeposit.match_id == match_id)
             )
             deposits = result.scalars().all()
-
-            for dep in deposits:
-                near_wallet = dep.near_wallet
-                if not near_wallet:
-                    if dep.player_id == match_data.get("player1_id"):
-                        near_wallet = match_data.get("player1_near_wallet")
-                    else:
-                        near_wallet = match_data.get("player2_near_wallet")
-
-                if near_wallet and is_escrow_configured():
-                    result_transfer = await transfer_nft_from_escrow(
-                        to_wallet=near_wallet,
-                        token_id=dep.token_id,
-                        nft_contract_id=dep.nft_contract_id or "",
-                    )
-                    if result_transfer.get("success"):
-                        dep.refunded = True
-                        refunded_count += 1
+            results = await refund_deposits(deposits, match_data)
+            refunded_count = sum(1 for r in results if r.get("success"))
 
             await session.commit()
     except Exception as e:
@@ -441,7 +768,7 @@ def _parse_dt(value) -> Optional[datetime]:
 
 async def _refund_match_deposits(match_id: str, match_data: Dict) -> int:
     """Возвращает все незачищенные депозиты матча владельцам. Возвращает кол-во."""
-    from routers.matches import transfer_nft_from_escrow, is_escrow_configured
+    from routers.matches import refund_deposits, is_escrow_configured
     if not is_escrow_configured():
         return 0
     refunded = 0
@@ -453,23 +780,8 @@ async def _refund_match_deposits(match_id: str, match_data: Dict) -> int:
                     MatchDeposit.refunded == False,
                 )
             )
-            deposits = result.scalars().all()
-            for dep in deposits:
-                near_wallet = dep.near_wallet
-                if not near_wallet:
-                    if dep.player_id == match_data.get("player1_id"):
-                        near_wallet = match_data.get("player1_near_wallet")
-                    else:
-                        near_wallet = match_data.get("player2_near_wallet")
-                if near_wallet:
-                    r = await transfer_nft_from_escrow(
-                        to_wallet=near_wallet,
-                        token_id=dep.token_id,
-                        nft_contract_id=dep.nft_contract_id or "",
-                    )
-                    if r.get("success"):
-                        dep.refunded = True
-                        refunded += 1
+            results = await refund_deposits(result.scalars().all(), match_data)
+            refunded = sum(1 for r in results if r.get("success"))
             await session.commit()
             break
     except Exception as e:
@@ -493,19 +805,25 @@ async def resolve_stuck_active_match(match_id: str) -> bool:
     if match_data.get("mode") == "tournament":
         return False
 
-    # Если в WS реально идёт партия (хотя бы один ход) — это не «зависание»
+    started = _parse_dt(match_data.get("game_started_at")) or _parse_dt(match_data.get("created_at"))
+    if started is None:
+        return False
+    if (datetime.utcnow() - started).total_seconds() < STUCK_ACTIVE_TIMEOUT_SECONDS:
+        return False
+
+    # Если в WS реально идёт партия (хотя бы один ход) — это не «зависание».
+    # Решаем в акторе матча: параллельный ход либо успеет раньше (матч не
+    # трогаем), либо после отмены будет отклонён — возврат NFT не гонится с игрой.
     try:
         from routers.ws_match import ws_manager
-        st = ws_manager.match_states.get(match_id)
-        if st is not None and st.status == "active" and st.moves_count > 0:
+        if not await ws_manager.call(match_id, ws_manager.abort_unstarted, match_id):
             return False
     except Exception:
         pass
-
-    started = _parse_dt(match_data.get("game_started_at")) or _parse_dt(match_data.get("created_at"))
-    if started is None:
-        return False
-    if (datetime.utcnow() - started).total_seconds() < STUCK_ACTIVE_TIMEOUT_SECONDS:
+    # Пока ждали актор, матч могли доиграть или отменить другим путём.
+    match_data = await get_match(match_id)
+    if not match_data or match_data.get("status") != "active" \
+            or match_data.get("winner") or match_data.get("refunded"):
         return False
 
     print(f"[Matchmaking] Stuck active match {match_id}: game never started, refunding both")
@@ -522,10 +840,7 @@ async def resolve_stuck_active_match(match_id: str) -> bool:
     # Сообщаем подключённым игрокам, чтобы вышли в меню
     try:
         from routers.ws_match import ws_manager
-        await ws_manager.broadcast_all(match_id, {
-            "type": "match_cancelled",
-            "message": "Match cancelled — NFTs refunded.",
-        })
+        await ws_manager.broadcast_raw(match_id, MATCH_CANCELLED_FRAME)
     except Exception as e:
         print(f"[Matchmaking] stuck-active broadcast error: {e}")
     return True
@@ -534,107 +849,187 @@ async def resolve_stuck_active_match(match_id: str) -> bool:
 async def reconcile_pending_refunds():
     """Дожимаем возвраты: находим депозиты с refunded=False по ОТМЕНЁННЫМ матчам
     и повторяем перевод из эскроу владельцу. Спасает, если разовый возврат не
-    прошёл (RPC/nonce) — карты не застревают навсегда."""
-    from routers.matches import transfer_nft_from_escrow, is_escrow_configured
+    прошёл (RPC/nonce) — карты не застревают навсегда.
+
+    Один запрос с JOIN на pvp_matches по частичному индексу
+    idx_match_deposits_unrefunded: читаем только то, что реально надо
+    вернуть, без выборки всех невозвращённых депозитов и session.get на матч."""
+    from routers.matches import transfer_nfts_from_escrow, is_escrow_configured
     if not is_escrow_configured():
         return
     try:
         async for session in get_session():
-            pending = (await session.execute(
-                select(MatchDeposit).where(MatchDeposit.refunded == False)  # noqa: E712
-            )).scalars().all()
-            if not pending:
-                break
-            by_match: Dict[str, list] = {}
-            for d in pending:
-                by_match.setdefault(d.match_id, []).append(d)
-            for mid, deps in by_match.items():
-                m = await session.get(PvPMatch, mid)
-                # Возвращаем только для отменённых матчей (там всё уходит владельцам).
-                if not m or m.status != "cancelled":
-                    continue
-                for d in deps:
+            # Keyset-пагинация по id: депозиты, которые вернуть не вышло,
+            # не заслоняют собой остальные в следующих пачках.
+            last_id = 0
+            while True:
+                rows = (await session.execute(
+                    select(
+                        MatchDeposit,
+                        PvPMatch.player1_id,
+                        PvPMatch.player1_near_wallet,
+                        PvPMatch.player2_near_wallet,
+                    )
+                    .join(PvPMatch, PvPMatch.id == MatchDeposit.match_id)
+                    .where(
+                        MatchDeposit.refunded == False,  # noqa: E712
+                        MatchDeposit.id > last_id,
+                        PvPMatch.status == "cancelled",
+                    )
+                    .order_by(MatchDeposit.id)
+                    .limit(RECONCILE_BATCH)
+                )).all()
+                targets = []
+                for d, p1_id, p1_wallet, p2_wallet in rows:
+                    last_id = d.id
                     wallet = d.near_wallet
                     if not wallet:
-                        wallet = (m.player1_near_wallet if str(d.player_id) == str(m.player1_id)
-                                  else m.player2_near_wallet)
-                    if not wallet:
-                        continue
-                    r = await transfer_nft_from_escrow(
-                        to_wallet=wallet,
-                        token_id=d.token_id,
-                        nft_contract_id=d.nft_contract_id or "",
-                    )
+                        wallet = p1_wallet if str(d.player_id) == str(p1_id) else p2_wallet
+                    if wallet:
+                        targets.append((d, wallet))
+                results = await transfer_nfts_from_escrow([
+                    (wallet, d.token_id, d.nft_contract_id or "") for d, wallet in targets
+                ])
+                for (d, wallet), r in zip(targets, results):
                     if r.get("success"):
                         d.refunded = True
                         print(f"[Matchmaking] reconcile: refunded {d.token_id} -> {wallet}")
-            await session.commit()
+                if rows:
+                    await session.commit()
+                if len(rows) < RECONCILE_BATCH:
+                    break
             break
     except Exception as e:
         print(f"[Matchmaking] reconcile_pending_refunds error: {e}")
 
 
 async def cleanup_stale_matches():
-    """Background task: cleanup stale matches"""
+    """Background task: дожимаем зависшие возвраты NFT.
+    Таймауты эскроу, зависшие active-матчи, предел reopen и протухание
+    очереди больше не сканируются здесь — их стреляет колесо таймеров
+    (см. arm_match_deadlines / _arm_queue_expiry)."""
     while True:
         try:
-            now = datetime.utcnow()
-            stale_matches = []
-
-            for match_id, match_data in list(active_matches.items()):
-                if match_data.get("status") in ["waiting", "waiting_escrow", "pending_lock"]:
-                    created_at_str = match_data.get("created_at")
-                    if created_at_str:
-                        try:
-                            if isinstance(created_at_str, str):
-                                created_at = datetime.fromisoformat(created_at_str.replace("Z", ""))
-                            else:
-                                created_at = created_at_str
-                            elapsed = (now - created_at).total_seconds()
-                            if elapsed > ESCROW_LOCK_TIMEOUT_SECONDS:
-                                stale_matches.append(match_id)
-                        except Exception:
-                            pass
-
-            for match_id in stale_matches:
-                try:
-                    await check_and_refund_stale_match(match_id)
-                except Exception as e:
-                    print(f"[Matchmaking] Error refunding stale match {match_id}: {e}")
-
-            # Зависшие залоченные матчи (status=active, но игра не пошла) —
-            # отменяем и возвращаем NFT обоим.
-            for match_id, match_data in list(active_matches.items()):
-                if match_data.get("status") == "active" and not match_data.get("winner"):
-                    try:
-                        await resolve_stuck_active_match(match_id)
-                    except Exception as e:
-                        print(f"[Matchmaking] Error resolving stuck match {match_id}: {e}")
-
-            # Чистим очередь
-            stale_queue = []
-            for user_id, queue_data in list(matchmaking_queue.items()):
-                joined_at = queue_data.get("joined_at")
-                if joined_at:
-                    elapsed = (now - joined_at).total_seconds()
-                    if elapsed > 600 and not queue_data.get("match_id"):
-                        stale_queue.append(user_id)
-
-            for user_id in stale_queue:
-                if user_id in matchmaking_queue:
-                    del matchmaking_queue[user_id]
-                    print(f"[Matchmaking] Removed stale user {user_id} from queue")
+            await reconcile_pending_refunds()
+        except Exception as e:
+            print(f"[Matchmaking] reconcile error: {e}")
 
-            # Дожимаем зависшие возвраты NFT по отменённым матчам.
-            try:
-                await reconcile_pending_refunds()
-            except Exception as e:
-                print(f"[Matchmaking] reconcile error: {e}")
+        await asyncio.sleep(30)
 
+
+async def matchmaker_loop():
+    """Background task: пакетный матчмейкер (см. plan_pairs). Стоимость
+    подбора не зависит от частоты опросов — join_queue только ставит в
+    очередь и отдаёт готовый результат."""
+    while True:
+        try:
+            await matchmaker_tick()
         except Exception as e:
-            print(f"[Matchmaking] Cleanup error: {e}")
+            print(f"[Matchmaking] matchmaker tick error: {e}")
+        await asyncio.sleep(MATCHMAKER_TICK_SECONDS)
 
-        await asyncio.sleep(30)
+
+async def matchmaker_tick() -> int:
+    if len(matchmaking_queue) < 2:
+        return 0
+    t0 = time.perf_counter()
+    pairs = plan_pairs()
+    # Всем парам match_id ставим ДО первого await — бэкфилл и следующий тик
+    # эти записи уже не тронут как ищущие. Лобби (open_match_id) из очереди
+    # уходит сразу: удачно ли подсадили или лобби устарело — оно больше не нужно.
+    jobs = []
+    for a, b, _ in pairs:
+        locker = a if a.open_match_id else b if b.open_match_id else None
+        if locker is None:
+            match_id = str(uuid.uuid4())
+            matchmaking_queue.set_match(a.user_id, match_id)
+            matchmaking_queue.set_match(b.user_id, match_id)
+            jobs.append((_create_pvp_match, a, b, match_id))
+        else:
+            seeker = b if locker is a else a
+            matchmaking_queue.pop(locker.user_id)
+            matchmaking_queue.set_match(seeker.user_id, locker.open_match_id)
+            jobs.append((_join_open_lobby, seeker, locker, locker.open_match_id))
+        wheel.cancel(("backfill", a.user_id))
+        wheel.cancel(("backfill", b.user_id))
+    ms = (time.perf_counter() - t0) * 1000
+    _mm_stats["ticks"] += 1
+    _mm_stats["tick_ms_last"] = round(ms, 3)
+    _mm_stats["tick_ms_max"] = round(max(_mm_stats["tick_ms_max"], ms), 3)
+    _mm_stats["pairs_last"] = len(pairs)
+
+    for publish, a, b, match_id in jobs:
+        try:
+            await publish(a, b, match_id)
+        except Exception as e:
+            print(f"[Matchmaking] failed to publish match {match_id} ({a.user_id} vs {b.user_id}): {e}")
+            _release(a)
+            _release(b)
+    return len(pairs)
+
+
+def _release(entry: QueueEntry) -> None:
+    """Матч для записи не состоялся — игрок снова ищет (если ещё в очереди)."""
+    if matchmaking_queue.get(entry.user_id) is entry:
+        matchmaking_queue.set_match(entry.user_id, None)
+        _arm_backfill(entry.user_id, entry.joined_at)
+
+
+async def _join_open_lobby(seeker: QueueEntry, locker: QueueEntry, open_mid: str) -> None:
+    """Соперник — залочивший игрок, ждущий нового оппонента (open_match_id):
+    подсаживаем искателя в ЕГО существующий матч (карты уже в эскроу),
+    новый матч не создаём."""
+    md = await get_match(open_mid)
+    if not (md and md.get("status") == "waiting" and not md.get("player2_id")
+            and str(md.get("player1_id")) != str(seeker.user_id)):
+        # Лобби устарело/занято — искатель ищет дальше.
+        _release(seeker)
+        return
+    now = datetime.utcnow()
+    md["player2_id"] = seeker.user_id
+    md["player2_deck"] = seeker.deck
+    md["player2_escrow_confirmed"] = False
+    md["status"] = "waiting_escrow"
+    md["created_at"] = now.isoformat()
+    md["escrow_timeout_at"] = (now + timedelta(seconds=ESCROW_LOCK_TIMEOUT_SECONDS)).isoformat()
+    _record_match_wait(locker.joined_at)
+    _record_match_wait(seeker.joined_at)
+    await save_match(md)
+    print(f"[Matchmaking] {seeker.user_id} joined reopened match {open_mid} (locker {locker.user_id})")
+
+
+async def _create_pvp_match(a: QueueEntry, b: QueueEntry, match_id: str) -> None:
+    # player1 — тот, кто встал в очередь позже (как раньше: «пришедший» игрок).
+    p1, p2 = (a, b) if a.order > b.order else (b, a)
+    now = datetime.utcnow()
+    match_data = {
+        "match_id": match_id,
+        "player1_id": p1.user_id,
+        "player2_id": p2.user_id,
+        "player1_deck": p1.deck,
+        "player2_deck": p2.deck,
+        "status": "waiting_escrow",
+        "created_at": now.isoformat(),
+        "current_round": 0,
+        "player1_score": 0,
+        "player2_score": 0,
+        "player1_escrow_confirmed": False,
+        "player2_escrow_confirmed": False,
+        "escrow_timeout_at": (now + timedelta(seconds=ESCROW_LOCK_TIMEOUT_SECONDS)).isoformat(),
+        "board": [None] * 9,
+        "board_elements": [],
+        "player1_hand": [],
+        "player2_hand": [],
+        "moves_count": 0,
+        "mode": "pvp",
+    }
+    # Опрос, пришедший до конца сохранения, просто ещё раз увидит «searching»
+    # (get_match пока пуст), следующий — уже матч.
+    _record_match_wait(p1.joined_at)
+    _record_match_wait(p2.joined_at)
+    # Сохраняем в память И в БД
+    await save_match(match_data)
+    print(f"[Matchmaking] Match created: {match_id} | {p1.user_id} vs {p2.user_id}")
 
 
 @router.post("/join_queue")
@@ -651,7 +1046,7 @@ async def join_queue(
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="No deck saved. Select 5 cards first.")
 
     user_elo = await get_user_elo(user_id)
-    user_power = deck_power(user_deck)
+    user_rating = await get_deck_rating(user_id, user_deck)
     max_elo_diff = request.max_elo_diff or 300
 
     # Защита от дублей комнат: если у игрока уже есть незавершённый матч —
@@ -672,8 +1067,8 @@ async def join_queue(
     # Проверяем существующую запись в очереди
     if user_id in matchmaking_queue:
         queue_entry = matchmaking_queue[user_id]
-        if queue_entry.get("match_id"):
-            match_id = queue_entry["match_id"]
+        if queue_entry.match_id:
+            match_id = queue_entry.match_id
             match_data = await get_match(match_id)
             if match_data:
                 if match_data.get("status") == "cancelled":
@@ -681,107 +1076,33 @@ async def join_queue(
                     return {"status": "cancelled", "message": "Previous match was cancelled. Search again."}
 
                 del matchmaking_queue[user_id]
+                wheel.cancel(("backfill", user_id))
                 opponent_id = match_data["player2_id"] if match_data["player1_id"] == user_id else match_data["player1_id"]
                 return {
                     "status": "matched",
                     "match_id": match_id,
                     "opponent_id": opponent_id,
+                    "mode": match_data.get("mode", "pvp"),
                     "message": "Match found!"
                 }
-        matchmaking_queue[user_id]["last_poll"] = datetime.utcnow()
-
-    opponent_id = find_opponent(user_id, user_elo, max_elo_diff, user_power)
-
-    # Соперник — залочивший игрок, ждущий нового оппонента (open_match_id):
-    # подсаживаем искателя в ЕГО существующий матч (карты уже в эскроу),
-    # новый матч не создаём.
-    if opponent_id and opponent_id in matchmaking_queue:
-        open_mid = matchmaking_queue[opponent_id].get("open_match_id")
-        if open_mid:
-            md = await get_match(open_mid)
-            if md and md.get("status") == "waiting" and not md.get("player2_id") \
-                    and str(md.get("player1_id")) != str(user_id):
-                now = datetime.utcnow()
-                md["player2_id"] = user_id
-                md["player2_deck"] = user_deck
-                md["player2_escrow_confirmed"] = False
-                md["status"] = "waiting_escrow"
-                md["created_at"] = now.isoformat()
-                md["escrow_timeout_at"] = (now + timedelta(seconds=ESCROW_LOCK_TIMEOUT_SECONDS)).isoformat()
-                await save_match(md)
-                del matchmaking_queue[opponent_id]
-                if user_id in matchmaking_queue:
-                    del matchmaking_queue[user_id]
-                print(f"[Matchmaking] {user_id} joined reopened match {open_mid} (locker {opponent_id})")
-                return {
-                    "status": "matched",
-                    "match_id": open_mid,
-                    "opponent_id": opponent_id,
-                    "escrow_timeout_seconds": ESCROW_LOCK_TIMEOUT_SECONDS,
-                    "message": "Match found!",
-                }
-            # Лобби устарело/занято — убираем и ищем как обычно.
-            del matchmaking_queue[opponent_id]
-            opponent_id = None
-
-    if opponent_id and opponent_id in matchmaking_queue:
-        match_id = str(uuid.uuid4())
+        queue_entry.last_poll = datetime.utcnow()
+        queue_entry.max_elo_diff = max_elo_diff
+        if not queue_entry.open_match_id:
+            # Колода/Elo могли поменяться между опросами — переложить в индексе.
+            queue_entry.deck = user_deck
+            if (queue_entry.elo, queue_entry.deck_rating) != (user_elo, user_rating):
+                matchmaking_queue.update(queue_entry, user_elo, user_rating)
+    else:
+        # Пары собирает matchmaker_loop; здесь только встаём в очередь.
         now = datetime.utcnow()
-        opponent_deck = await load_user_deck(opponent_id)
-
-        match_data = {
-            "match_id": match_id,
-            "player1_id": user_id,
-            "player2_id": opponent_id,
-            "player1_deck": user_deck,
-            "player2_deck": opponent_deck,
-            "status": "waiting_escrow",
-            "created_at": now.isoformat(),
-            "current_round": 0,
-            "player1_score": 0,
-            "player2_score": 0,
-            "player1_escrow_confirmed": False,
-            "player2_escrow_confirmed": False,
-            "escrow_timeout_at": (now + timedelta(seconds=ESCROW_LOCK_TIMEOUT_SECONDS)).isoformat(),
-            "board": [None] * 9,
-            "board_elements": [],
-            "player1_hand": [],
-            "player2_hand": [],
-            "moves_count": 0,
-            "mode": "pvp",
-        }
-
-        # Сохраняем в память И в БД
-        await save_match(match_data)
-        matchmaking_queue[opponent_id]["match_id"] = match_id
-
-        if user_id in matchmaking_queue:
-            del matchmaking_queue[user_id]
-
-        print(f"[Matchmaking] Match created: {match_id} | {user_id} vs {opponent_id}")
-
-        return {
-            "status": "matched",
-            "match_id": match_id,
-            "opponent_id": opponent_id,
-            "escrow_timeout_seconds": ESCROW_LOCK_TIMEOUT_SECONDS,
-            "message": "Match found!"
-        }
-
-    # Добавляем в очередь
-    if user_id not in matchmaking_queue:
-        matchmaking_queue[user_id] = {
-            "user_id": user_id,
-            "elo": user_elo,
-            "power": user_power,
-            "deck": user_deck,
-            "joined_at": datetime.utcnow(),
-            "last_poll": datetime.utcnow(),
-            "match_id": None
-        }
+        matchmaking_queue.add(QueueEntry(user_id, user_elo, user_rating, user_deck, now,
+                                         max_elo_diff=max_elo_diff))
+        lobby_hub.forget(user_id)
+        _arm_queue_expiry(user_id, now)
+        _arm_backfill(user_id, now)
         print(f"[Matchmaking] User {user_id} joined queue. Size: {len(matchmaking_queue)}")
 
-    position = list(matchmaking_queue.keys()).index(user_id) + 1
+    position = matchmaking_queue.position(user_id)
     return {
         "status": "searching",
         "position": position,
@@ -790,11 +1111,77 @@ async def join_queue(
     }
 
 
+async def create_bot_match(user_id: str, user_deck: List[Dict], tier: Optional[str] = None,
+                           match_id: Optional[str] = None) -> Dict:
+    """Матч против серверного бота (game.ai): mode="bot", escrow_locked=True и
+    без депозитов NFT — как турнирный. Партию ведёт тот же WS-движок, бот
+    ходит сам, как только до него доходит очередь."""
+    from routers.ws_match import _make_random_hand
+    bot_pid = bot_ai.bot_id(tier or bot_ai.BOT_DEFAULT_TIER)
+    now = datetime.utcnow()
+    match_data = {
+        "match_id": match_id or str(uuid.uuid4()),
+        "player1_id": str(user_id),
+        "player2_id": bot_pid,
+        "player1_deck": user_deck,
+        "player2_deck": _make_random_hand(bot_pid),
+        "status": "active",
+        "created_at": now.isoformat(),
+        "game_started_at": now.isoformat(),
+        "current_round": 0,
+        "player1_score": 0,
+        "player2_score": 0,
+        "player1_escrow_confirmed": True,
+        "player2_escrow_confirmed": True,
+        "escrow_locked": True,  # ставки нет — NFT не стейкаем
+        "board": [None] * 9,
+        "board_elements": [],
+        "player1_hand": [],
+        "player2_hand": [],
+        "moves_count": 0,
+        "mode": "bot",
+    }
+    await save_match(match_data)
+    print(f"[Matchmaking] Bot match created: {match_data['match_id']} | {user_id} vs {bot_pid}")
+    return match_data
+
+
+@router.post("/play_bot")
+async def play_bot(request: BotMatchRequest, authorization: str = Header(None)):
+    user_id = get_user_id_from_token(authorization)
+    if not user_id:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Authorization required")
+
+    existing_match_id = find_active_match_for(user_id)
+    if existing_match_id:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Finish your current match first")
+
+    user_deck = await load_user_deck(user_id)
+    if not user_deck or len(user_deck) < 5:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="No deck saved. Select 5 cards first.")
+
+    if user_id in matchmaking_queue:
+        del matchmaking_queue[user_id]
+        wheel.cancel(("queue", user_id))
+        wheel.cancel(("backfill", user_id))
+
+    match_data = await create_bot_match(user_id, user_deck, request.tier)
+    return {
+        "status": "matched",
+        "match_id": match_data["match_id"],
+        "opponent_id": match_data["player2_id"],
+        "mode": "bot",
+        "message": "Bot match created",
+    }
+
+
 @router.post("/leave_queue")
 async def leave_queue(authorization: str = Header(None)):
     user_id = get_user_id_from_token(authorization)
     if user_id and user_id in matchmaking_queue:
         del matchmaking_queue[user_id]
+        wheel.cancel(("queue", user_id))
+        wheel.cancel(("backfill", user_id))
         print(f"[Matchmaking] User {user_id} left queue")
     return {"success": True, "message": "Left queue"}
 
@@ -806,8 +1193,8 @@ async def get_queue_status(authorization: str = Header(None)):
         return {"status": "not_in_queue"}
 
     queue_entry = matchmaking_queue[user_id]
-    if queue_entry.get("match_id"):
-        match_id = queue_entry["match_id"]
+    if queue_entry.match_id:
+        match_id = queue_entry.match_id
         match_data = await get_match(match_id)
         if match_data:
             if match_data.get("status") == "cancelled":
@@ -828,6 +1215,7 @@ async def get_queue_status(authorization: str = Header(None)):
                 "status": "matched",
                 "match_id": match_id,
                 "opponent_id": opponent_id,
+                "mode": match_data.get("mode", "pvp"),
                 "escrow_remaining_seconds": remaining_seconds,
                 "player1_locked": match_data.get("player1_escrow_confirmed", False),
                 "player2_locked": match_data.get("player2_escrow_confirmed", False),
@@ -836,14 +1224,87 @@ async def get_queue_status(authorization: str = Header(None)):
     return {"status": "searching", "queue_size": len(matchmaking_queue)}
 
 
+@router.websocket("/lobby")
+async def lobby_ws(websocket: WebSocket):
+    """Лобби-канал (game.lobby): первым сообщением {"type": "auth", "token"},
+    дальше сервер сам шлёт снапшот и события matched / escrow / ready /
+    cancelled. Встать в очередь — по-прежнему один POST /join_queue."""
+    await websocket.accept()
+    user_id = None
+    sub = None
+    try:
+        try:
+            auth = loads(await websocket.receive_text())
+        except Exception:
+            auth = None
+        if isinstance(auth, dict) and auth.get("type") == "auth":
+            user_id = get_user_id_from_token((auth.get("token") or "").strip())
+        if not user_id:
+            await websocket.send_text(dumps({"type": "error", "message": "Unauthorized"}))
+            await websocket.close(1008)
+            return
+
+        sub = lobby_hub.subscribe(user_id, websocket, [dumps(lobby_snapshot(user_id))])
+        while True:
+            try:
+                raw = await websocket.receive_text()
+            except Exception:
+                # Дисконнект или сокет уже закрыт писателем LobbyHub (ошибка
+                # или таймаут отправки) — receive_text больше не ждёт.
+                break
+            try:
+                data = loads(raw)
+            except ValueError:
+                continue
+            msg_type = data.get("type") if isinstance(data, dict) else None
+            if msg_type == "ping":
+                sub.push(dumps({"type": "pong"}))
+            elif msg_type == "get_state":
+                sub.push(dumps(lobby_snapshot(user_id)))
+    except WebSocketDisconnect:
+        pass
+    except Exception as e:
+        print(f"[Matchmaking] lobby ws error user={user_id}: {e}")
+    finally:
+        if sub is not None:
+            lobby_hub.unsubscribe(user_id, sub)
+
+
+@router.get("/lobby/poll")
+async def lobby_poll(since: int = 0, timeout: float = LOBBY_LONG_POLL_MAX_SECONDS,
+                     authorization: str = Header(None)):
+    """Long-poll вариант лобби-канала для клиентов без WebSocket: держит запрос
+    до первого события с seq > since или до таймаута (тогда — снапшот).
+    Только разбор JWT, без чтений из БД."""
+    user_id = get_user_id_from_token(authorization)
+    if not user_id:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Authorization required")
+    entry = matchmaking_queue.get(user_id)
+    if entry is not None:
+        entry.last_poll = datetime.utcnow()
+    event = await lobby_hub.wait(user_id, since, max(0.0, min(timeout, LOBBY_LONG_POLL_MAX_SECONDS)))
+    if event is None:
+        return lobby_snapshot(user_id)
+    if event["type"] != "escrow":
+        _drop_matched_entry(user_id, event.get("match_id"))
+    return event
+
+
 @router.get("/queue-info")
 async def get_queue_info():
     return {
         "queue_size": len(matchmaking_queue),
         "active_matches": len(active_matches),
-        "users_in_queue": list(matchmaking_queue.keys()),
+        "match_registry": active_matches.stats(),
+        "match_writer": match_writer.stats(),
+        "users_in_queue": matchmaking_queue.keys(),
+        "queue_index": matchmaking_queue.stats(),
         "escrow_timeout_seconds": ESCROW_LOCK_TIMEOUT_SECONDS,
         "reconnect_timeout_seconds": GAME_RECONNECT_TIMEOUT_SECONDS,
+        "timers": wheel.stats(),
+        "matchmaking": matchmaking_stats(),
+        "deck_rating": balance.stats(),
+        "lobby": lobby_hub.stats(),
     }
 
 
@@ -1,21 +1,16 @@
 from __future__ import annotations
 
-import os
-import json
-import asyncio
-import urllib.request
 from typing import Any, Dict
 
 from fastapi import APIRouter, Body, Depends, HTTPException
 
 from api.users import get_current_user
+from blockchain.near_rpc import near_rpc as rpc_client
 from database.session import get_session
 from database.models.user import User
 
 router = APIRouter(prefix="/api/near", tags=["near"])
 
-NEAR_RPC_URL = os.getenv("NEAR_RPC_URL", "https://free.rpc.fastnear.com")
-
 
 def _is_valid_account_id(account_id: str) -> bool:
     a = (account_id or "").strip().lower()
@@ -25,22 +20,10 @@ def _is_valid_account_id(account_id: str) -> bool:
     return all(ch in allowed for ch in a)
 
 
-def _post_json(url: str, payload: Dict[str, Any], timeout: float = 20.0) -> Any:
-    raw = json.dumps(payload).encode("utf-8")
-    req = urllib.request.Request(
-        url,
-        data=raw,
-        headers={"content-type": "application/json"},
-        method="POST",
-    )
-    with urllib.request.urlopen(req, timeout=timeout) as resp:
-        return json.loads(resp.read().decode("utf-8", errors="replace"))
-
-
 @router.post("/rpc")
 async def near_rpc(payload: Dict[str, Any] = Body(...)):
     try:
-        return await asyncio.to_thread(_post_json, NEAR_RPC_URL, payload, 20.0)
+        return await rpc_client.call(payload, timeout=20.0)
     except Exception as e:
         raise HTTPException(status_code=502, detail=f"NEAR RPC proxy error: {e}")
 
@@ -163,7 +163,7 @@ async def _create_game_for_match(tm: TournamentMatch, t: Tournament) -> Optional
     if not p1 or not p2:
         return None
     try:
-        from routers.matchmaking import active_matches, _save_match_to_db
+        from routers.matchmaking import active_matches, index_match, _save_match_to_db
         mid = f"t{t.id[:6]}_{tm.id}_{uuid.uuid4().hex[:6]}"
         d1 = await _load_user_deck(p1)
         d2 = await _load_user_deck(p2)
@@ -185,6 +185,7 @@ async def _create_game_for_match(tm: TournamentMatch, t: Tournament) -> Optional
             "mode": "tournament",
         }
         active_matches[mid] = match_data
+        index_match(match_data)
         await _save_match_to_db(match_data)
         return mid
     except Exception as e:
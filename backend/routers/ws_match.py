@@ -1,15 +1,25 @@
 from __future__ import annotations
 
 from fastapi import APIRouter, WebSocket, WebSocketDisconnect
-from typing import Dict, List, Optional
+from typing import Dict, List, Optional, Set
 import logging
-import json
 import re
 import random
 import asyncio
+import os
 from datetime import datetime, timedelta
 import sys
 
+from game import ai as bot_ai
+from game.actor import MatchActor
+from game.engine import ACE_VALUE, ELEMENTS, MatchState, normalize_card
+from game.fanout import spectator_hub
+from game.journal import journal
+from game.outbox import Outbox
+from game.wire import compose, dumps, loads
+from utils.match_registry import match_registry
+from utils.timing_wheel import wheel
+
 logger = logging.getLogger(__name__)
 router = APIRouter(tags=["websocket"])
 
@@ -18,6 +28,12 @@ router = APIRouter(tags=["websocket"])
 # импорты между роутерами.
 RECONNECT_TIMEOUT_SECONDS = 180
 
+# Исходящая очередь на сокет: сколько кадров может накопиться у медленного
+# клиента и сколько ждём отправку одного кадра, прежде чем счесть его
+# отвалившимся (дальше обычный handle_player_drop -> реконнект/форфейт).
+WS_OUTBOX_MAX = int(os.getenv("WS_OUTBOX_MAX", "64"))
+WS_SEND_TIMEOUT_SECONDS = float(os.getenv("WS_SEND_TIMEOUT_SECONDS", "10"))
+
 
 def _ipfs_to_hotdao(url):
     """Переписывает любой IPFS-URL на рабочий шлюз HOT (ipfs.hotdao.ai).
@@ -38,282 +54,182 @@ def _ipfs_to_hotdao(url):
     return url
 
 
-class MatchState:
-    def __init__(
-            self,
-            match_id: str,
-            player1_id: str,
-            player2_id: str,
-            player1_hand: list,
-            player2_hand: list,
-            board_elements: list,
-            first_turn: str,
-    ):
-        self.match_id = match_id
-        self.player1_id = str(player1_id)
-        self.player2_id = str(player2_id)
-        self.board: List[Optional[dict]] = [None] * 9
-        self.board_elements: List[Optional[str]] = board_elements
-        self.player1_hand: List[dict] = player1_hand
-        self.player2_hand: List[dict] = player2_hand
-        self.current_turn: str = str(first_turn)
-        self.status: str = "active"
-        self.winner: Optional[str] = None
-        self.moves_count: int = 0
-
-    def get_hand(self, player_id: str) -> list:
-        if str(player_id) == self.player1_id:
-            return self.player1_hand
-        return self.player2_hand
-
-    def remove_from_hand(self, player_id: str, card_index: int):
-        hand = self.get_hand(player_id)
-        if 0 <= card_index < len(hand):
-            hand.pop(card_index)
-
-    def to_state_dict(self) -> dict:
-        return {
-            "match_id": self.match_id,
-            "player1_id": self.player1_id,
-            "player2_id": self.player2_id,
-            "board": self.board,
-            "board_elements": self.board_elements,
-            "current_turn": self.current_turn,
-            "status": self.status,
-            "winner": self.winner,
-            "player1_hand_count": len(self.player1_hand),
-            "player2_hand_count": len(self.player2_hand),
-            "moves_count": self.moves_count,
-        }
-
-
 class WSManager:
-    ACE_VALUE = 10
-    ELEMENTS = ["Earth", "Fire", "Water", "Poison", "Holy", "Thunder", "Wind", "Ice"]
+    ACE_VALUE = ACE_VALUE
+    ELEMENTS = list(ELEMENTS)
 
     def __init__(self):
-        self.connections: Dict[str, Dict[str, WebSocket]] = {}
+        # match_id -> {player_id -> Outbox}; Outbox.ws — сам сокет
+        self.connections: Dict[str, Dict[str, Outbox]] = {}
         self.match_states: Dict[str, MatchState] = {}
-        # match_id -> {player_id -> asyncio.Task} активные форфейт-таймеры
-        self.reconnect_tasks: Dict[str, Dict[str, "asyncio.Task"]] = {}
+        # match_id -> {player_id -> deadline} форфейт-таймеры (сами таймеры
+        # живут в utils.timing_wheel под ключом ("forfeit", match_id, player_id))
+        self.reconnect_deadlines: Dict[str, Dict[str, datetime]] = {}
+        self.evicted_total = 0
+        # match_id -> актор живого матча (см. game.actor): всё, что меняет
+        # MatchState, проходит через его ящик по очереди.
+        self.actors: Dict[str, MatchActor] = {}
+        # match_id -> задача, в которой бот (game.ai) ищет свой ход
+        self.bot_tasks: Dict[str, asyncio.Task] = {}
+        # Партии, поднятые из журнала после рестарта: форфейт-таймеры стоят
+        # у обоих игроков сразу, и победа «за неявку» требует, чтобы
+        # победитель сам был на связи (см. resolve_forfeit).
+        self.restored: Set[str] = set()
+
+    # ── АКТОР МАТЧА ────────────────────────────────────────────────
+
+    def actor(self, match_id: str) -> MatchActor:
+        act = self.actors.get(match_id)
+        if act is None:
+            act = MatchActor(match_id, on_exit=self._actor_exit)
+            self.actors[match_id] = act
+        return act
+
+    def _actor_exit(self, act: MatchActor):
+        if self.actors.get(act.match_id) is act:
+            del self.actors[act.match_id]
+
+    def post(self, match_id: str, fn, *args):
+        """Сообщение в ящик матча без ожидания результата."""
+        self.actor(match_id).post(fn, *args)
+
+    async def call(self, match_id: str, fn, *args):
+        """Выполнить fn в акторе матча и дождаться результата."""
+        return await self.actor(match_id).call(fn, *args)
+
+    def forget_match(self, match_id: str):
+        """Матч выселен из реестра (utils.match_registry) — отпускаем его
+        WS-состояние. Живую партию не трогаем."""
+        state = self.match_states.get(match_id)
+        if state is not None and state.status == "active":
+            return
+        self.match_states.pop(match_id, None)
+        self.restored.discard(match_id)
+        for box in (self.connections.pop(match_id, None) or {}).values():
+            box.abort()
+        self.reconnect_deadlines.pop(match_id, None)
+        task = self.bot_tasks.pop(match_id, None)
+        if task is not None:
+            task.cancel()
+
+    def actor_stats(self) -> dict:
+        acts = list(self.actors.values())
+        return {
+            "actors": len(acts),
+            "inbox_total": sum(a.depth for a in acts),
+            "queue_delay_max_ms": round(max((a.delay_max for a in acts), default=0.0) * 1000, 3),
+            "matches": {a.match_id: a.stats() for a in acts},
+        }
 
     async def connect(self, ws: WebSocket, match_id: str, player_id: str):
-        if match_id not in self.connections:
-            self.connections[match_id] = {}
-        self.connections[match_id][str(player_id)] = ws
+        player_id = str(player_id)
+        conns = self.connections.setdefault(match_id, {})
+        old = conns.get(player_id)
+        if old is not None:
+            # Реконнект поверх живого сокета: старый писатель больше не нужен.
+            old.abort()
+        conns[player_id] = Outbox(
+            ws, match_id, player_id, self._evict,
+            max_queue=WS_OUTBOX_MAX, send_timeout=WS_SEND_TIMEOUT_SECONDS,
+        )
 
-    def disconnect(self, match_id: str, player_id: str):
+    def disconnect(self, match_id: str, player_id: str, ws: Optional[WebSocket] = None) -> bool:
+        """Снимает соединение игрока. Если передан ws — только если это всё ещё
+        ТОТ ЖЕ сокет (не затираем свежий реконнект и не дропаем дважды).
+        True — соединение действительно было снято этим вызовом."""
         player_id = str(player_id)
-        if match_id in self.connections:
-            self.connections[match_id].pop(player_id, None)
-            if not self.connections[match_id]:
-                del self.connections[match_id]
+        conns = self.connections.get(match_id)
+        if not conns:
+            return False
+        box = conns.get(player_id)
+        if box is None or (ws is not None and box.ws is not ws):
+            return False
+        del conns[player_id]
+        if not conns:
+            del self.connections[match_id]
+        box.abort()
+        return True
 
-    async def send(self, match_id: str, player_id: str, data: dict):
-        ws = self.connections.get(match_id, {}).get(str(player_id))
-        if not ws:
+    def _evict(self, box: Outbox, reason: str):
+        """Медленный потребитель: снимаем с рассылки, закрываем сокет и
+        отдаём в штатный поток дропа (уведомление оппонента + форфейт)."""
+        if not self.disconnect(box.match_id, box.player_id, box.ws):
             return
+        self.evicted_total += 1
+        asyncio.create_task(self._drop_evicted(box))
+
+    async def _drop_evicted(self, box: Outbox):
         try:
-            await ws.send_json(data)
-        except Exception as e:
-            logger.warning("[WS] send error player=%s: %s", player_id, e)
-            self.disconnect(match_id, str(player_id))
+            await asyncio.wait_for(box.ws.close(code=1013), timeout=2)
+        except Exception:
+            pass
+        self.post(box.match_id, self.handle_player_drop, box.match_id, box.player_id)
+
+    async def send(self, match_id: str, player_id: str, data: dict):
+        await self.send_raw(match_id, player_id, dumps(data))
 
     async def broadcast_all(self, match_id: str, data: dict):
-        conns = dict(self.connections.get(match_id, {}))
-        for pid, ws in conns.items():
-            try:
-                await ws.send_json(data)
-            except Exception:
-                self.disconnect(match_id, pid)
+        # Кодируем один раз на сообщение, а не на каждого получателя.
+        await self.broadcast_raw(match_id, dumps(data))
+
+    async def send_raw(self, match_id: str, player_id: str, text: str):
+        """Как send, но payload уже сериализован (см. game.wire).
+        Не ждёт сокет: кадр уходит в очередь соединения."""
+        box = self.connections.get(match_id, {}).get(str(player_id))
+        if box is not None:
+            box.put(text)
+
+    async def broadcast_raw(self, match_id: str, text: str):
+        for box in list(self.connections.get(match_id, {}).values()):
+            box.put(text)
+        # Публичные события — и зрителям; тот же кадр, O(1) для игроков.
+        spectator_hub.publish(match_id, text)
 
     async def broadcast_except(self, match_id: str, data: dict, exclude_id: str):
-        conns = dict(self.connections.get(match_id, {}))
-        for pid, ws in conns.items():
-            if pid == str(exclude_id):
-                continue
-            try:
-                await ws.send_json(data)
-            except Exception:
-                self.disconnect(match_id, pid)
-
-    def _get_neighbors(self, idx: int) -> list:
-        x = idx % 3
-        y = idx // 3
-        dirs = [
-            (0, -1, "top", "bottom"),
-            (1, 0, "right", "left"),
-            (0, 1, "bottom", "top"),
-            (-1, 0, "left", "right"),
-        ]
-        result = []
-        for dx, dy, a, b in dirs:
-            nx, ny = x + dx, y + dy
-            if 0 <= nx <= 2 and 0 <= ny <= 2:
-                result.append({"ni": ny * 3 + nx, "a": a, "b": b})
-        return result
-
-    def _safe_val(self, raw) -> int:
-        try:
-            v = int(raw)
-            return max(1, min(self.ACE_VALUE, v))
-        except (TypeError, ValueError):
-            return 5
-
-    def _effective_val(self, base: int, card_elem: Optional[str],
-                       cell_elem: Optional[str]) -> int:
-        if base == self.ACE_VALUE:
-            return self.ACE_VALUE
-        if cell_elem:
-            bonus = +1 if card_elem == cell_elem else -1
-        else:
-            bonus = 0
-        return max(1, min(9, base + bonus))
-
-    def _normalize_card(self, card: dict, owner: str) -> dict:
-        raw = card.get("values") or card.get("stats") or {}
-        values = {
-            "top": self._safe_val(raw.get("top", 5)),
-            "right": self._safe_val(raw.get("right", 5)),
-            "bottom": self._safe_val(raw.get("bottom", 5)),
-            "left": self._safe_val(raw.get("left", 5)),
-        }
-        elem = card.get("element")
-        if not elem or elem not in self.ELEMENTS:
-            card_id = str(card.get("id") or card.get("token_id") or "x")
-            h = sum(ord(c) for c in card_id)
-            elem = self.ELEMENTS[h % len(self.ELEMENTS)]
-
-        # Картинку ищем во ВСЕХ возможных местах NFT, иначе карта пустая.
-        meta = card.get("metadata") if isinstance(card.get("metadata"), dict) else {}
-        nftd = card.get("nftData") if isinstance(card.get("nftData"), dict) else {}
-        nftd_meta = nftd.get("metadata") if isinstance(nftd.get("metadata"), dict) else {}
-        img = (card.get("imageUrl") or card.get("image")
-               or meta.get("media") or meta.get("image") or meta.get("originalMedia")
-               or nftd.get("imageUrl") or nftd.get("image")
-               or nftd_meta.get("media") or nftd_meta.get("image") or "")
-
+        exclude_id = str(exclude_id)
+        boxes = [b for pid, b in self.connections.get(match_id, {}).items() if pid != exclude_id]
+        watched = spectator_hub.count(match_id) > 0
+        if not boxes and not watched:
+            return
+        text = dumps(data)
+        for box in boxes:
+            box.put(text)
+        if watched:
+            spectator_hub.publish(match_id, text)
+
+    def outbox_stats(self) -> dict:
+        depths = [len(b) for conns in self.connections.values() for b in conns.values()]
         return {
-            "id": card.get("id") or card.get("token_id") or f"card_{random.randint(1000, 9999)}",
-            "token_id": card.get("token_id") or card.get("id") or "",
-            "owner": str(owner),
-            "values": values,
-            "element": elem,
-            "rank": str(card.get("rank") or card.get("rarity") or "common"),
-            "rankLabel": card.get("rankLabel") or (str(card.get("rank") or card.get("rarity") or "c")[:1].upper()),
-            "imageUrl": img,
-            "image": img,
+            "connections": len(depths),
+            "queued_frames": sum(depths),
+            "max_queue_depth": max(depths, default=0),
+            "evicted_total": self.evicted_total,
         }
 
-    def _resolve_placement(
-            self,
-            placed_idx: int,
-            board: List[Optional[dict]],
-            board_elems: List[Optional[str]],
-            placed_card: dict,
-    ) -> List[int]:
-        flipped = []
-        placed_owner = placed_card["owner"]
-        placed_elem = placed_card.get("element")
-        placed_cell_elem = board_elems[placed_idx] if placed_idx < len(board_elems) else None
-
-        for nb in self._get_neighbors(placed_idx):
-            ni = nb["ni"]
-            a = nb["a"]
-            b = nb["b"]
-
-            target = board[ni]
-            if not target:
-                continue
-            if target.get("owner") == placed_owner:
-                continue
-
-            attack_base = self._safe_val(placed_card["values"].get(a, 5))
-            defend_base = self._safe_val(target["values"].get(b, 5))
-
-            target_cell_elem = board_elems[ni] if ni < len(board_elems) else None
-            target_elem = target.get("element")
-
-            attack_val = self._effective_val(attack_base, placed_elem, placed_cell_elem)
-            defend_val = self._effective_val(defend_base, target_elem, target_cell_elem)
-
-            if attack_val > defend_val:
-                board[ni] = {**target, "owner": placed_owner}
-                flipped.append(ni)
-
-        return flipped
-
-    def _check_game_over(self, state: MatchState) -> Optional[str]:
-        if any(cell is None for cell in state.board):
-            return None
-
-        p1 = sum(1 for c in state.board if c and c.get("owner") == state.player1_id)
-        p2 = sum(1 for c in state.board if c and c.get("owner") == state.player2_id)
-
-        if p1 > p2:
-            return state.player1_id
-        if p2 > p1:
-            return state.player2_id
-        return state.player1_id
-
     async def handle_play_card(
             self,
             match_id: str,
             player_id: str,
             card_index: int,
             cell_index: int,
-            ws: WebSocket,
+            ws: Optional[WebSocket] = None,
     ):
         player_id = str(player_id)
         state = self.match_states.get(match_id)
         if not state:
-            await ws.send_json({"type": "error", "message": "Match state not found"})
+            await self.send(match_id, player_id, {"type": "error", "message": "Match state not found"})
             return
 
-        if state.status != "active":
-            await ws.send_json({"type": "error", "message": "Game is already over"})
+        error = state.validate_move(player_id, card_index, cell_index)
+        if error:
+            await self.send(match_id, player_id, {"type": "error", "message": error})
             return
 
-        if state.current_turn != player_id:
-            await ws.send_json({"type": "error", "message": "Not your turn"})
-            return
+        captured = state.apply_move(player_id, card_index, cell_index)
+        journal.move(match_id, player_id, card_index, cell_index)
 
-        if not (0 <= cell_index <= 8):
-            await ws.send_json({"type": "error", "message": "Invalid cell_index"})
-            return
-
-        if state.board[cell_index] is not None:
-            await ws.send_json({"type": "error", "message": "Cell is occupied"})
-            return
-
-        hand = state.get_hand(player_id)
-        if not (0 <= card_index < len(hand)):
-            await ws.send_json({
-                "type": "error",
-                "message": f"Invalid card_index {card_index}, hand size={len(hand)}"
-            })
-            return
-
-        raw_card = hand[card_index]
-        placed_card = self._normalize_card(raw_card, player_id)
-        state.board[cell_index] = placed_card
-        captured = self._resolve_placement(
-            cell_index, state.board, state.board_elements, placed_card
-        )
-        state.remove_from_hand(player_id, card_index)
-        state.moves_count += 1
-
-        next_turn = (
-            state.player2_id
-            if state.current_turn == state.player1_id
-            else state.player1_id
-        )
-        state.current_turn = next_turn
-
-        winner = self._check_game_over(state)
-        if winner:
-            state.status = "finished"
-            state.winner = winner
+        winner = state.winner
+        if state.status == "finished":
             # Авторитетно фиксируем результат и НАЧИСЛЯЕМ РЕЙТИНГ на сервере
             # (идемпотентно). Клиентский /finish больше не нужен для очков.
             winner_coins = 0
@@ -322,46 +238,44 @@ class WSManager:
                 from routers.matches import _finalize_match_result
                 match_data = await get_match(match_id)
                 if match_data:
+                    match_data["event_log"] = state.event_log("normal")
+                    match_data["moves_count"] = state.moves_count
                     ru = await _finalize_match_result(match_data, winner, reason="normal")
                     if ru and ru.get("winner"):
                         winner_coins = ru["winner"].get("coins_awarded", 0) or 0
             except Exception as e:
                 logger.warning("[WS] Could not persist match result: %s", e)
 
-        await self.broadcast_all(match_id, {
+        # Дельта вместо полного снапшота: клетка, захваты, какая карта ушла
+        # из руки и чей ход. seq монотонный — по дыре клиент просит get_state.
+        # Карта уже сериализована при старте партии — вклеиваем готовый JSON.
+        card_json = state.card_json(state.cells[cell_index], player_id)
+        await self.broadcast_raw(match_id, compose({
             "type": "card_played",
+            "seq": state.seq,
             "player_id": player_id,
             "cell_index": cell_index,
-            "card": placed_card,
             "captured": captured,
-        })
-
-        if state.status == "active":
-            await self.broadcast_all(match_id, {
-                "type": "turn_change",
-                "current_turn": next_turn,
-            })
-            # Авторитетная синхронизация рук/поля после хода: иначе у игрока
-            # рука не убавляется и индексы карт рассинхронизируются с сервером
-            # (отсюда «не ставится на клетку» и «зависшая карта»).
-            await self.send_full_state(match_id, state.player1_id)
-            await self.send_full_state(match_id, state.player2_id)
+            "hand_index": card_index,
+            "current_turn": state.current_turn,
+            "status": state.status,
+        }, card=card_json))
 
         if state.status == "finished":
-            p1_score = sum(1 for c in state.board if c and c.get("owner") == state.player1_id)
-            p2_score = sum(1 for c in state.board if c and c.get("owner") == state.player2_id)
+            p1_score, p2_score = state.score()
 
-            await self.broadcast_all(match_id, {
+            await self.broadcast_raw(match_id, compose({
                 "type": "game_over",
+                "seq": state.seq,
                 "winner": state.winner,
-                "board": state.board,
                 "player1_score": p1_score,
                 "player2_score": p2_score,
                 "winner_coins": winner_coins,
-            })
+            }, board=state.board_json()))
             logger.info("[WS] game_over match=%s winner=%s %d:%d",
                         match_id, state.winner, p1_score, p2_score)
-
+        else:
+            self.schedule_bot_turn(match_id)
 
     # ── СТАРТ / СОСТОЯНИЕ ──────────────────────────────────────────
 
@@ -374,17 +288,14 @@ class WSManager:
         pid = str(player_id)
         role = "player1" if pid == state.player1_id else "player2"
         opp_id = state.player2_id if pid == state.player1_id else state.player1_id
-        conns = self.connections.get(match_id, {})
-        opp_connected = str(opp_id) in conns
-        hand = state.get_hand(pid)
-        normalized = [self._normalize_card(c, pid) for c in hand]
-        await self.send(match_id, pid, {
+        opp_connected = self.is_present(match_id, opp_id)
+        # Рука и поле — готовые JSON-фрагменты из кэша MatchState:
+        # карты нормализованы один раз в try_start_game.
+        await self.send_raw(match_id, pid, compose({
             "type": "game_state",
             "you_are": role,
-            "your_hand": normalized,
             "opponent_connected": opp_connected,
-            "state": state.to_state_dict(),
-        })
+        }, your_hand=state.hand_json(pid), state=state.state_json()))
 
     async def try_start_game(self, match_id: str) -> bool:
         """Стартуем партию, если ОБА игрока подключены и эскроу залочен.
@@ -396,8 +307,7 @@ class WSManager:
 
         p1_id = str(match_data.get("player1_id") or "")
         p2_id = str(match_data.get("player2_id") or "")
-        conns = self.connections.get(match_id, {})
-        if p1_id not in conns or p2_id not in conns:
+        if not (self.is_present(match_id, p1_id) and self.is_present(match_id, p2_id)):
             return False
 
         if match_id not in self.match_states:
@@ -414,12 +324,13 @@ class WSManager:
                 match_id=match_id,
                 player1_id=p1_id,
                 player2_id=p2_id,
-                player1_hand=p1_hand[:5],
-                player2_hand=p2_hand[:5],
+                player1_hand=[normalize_card(c) for c in p1_hand[:5]],
+                player2_hand=[normalize_card(c) for c in p2_hand[:5]],
                 board_elements=board_elements,
                 first_turn=first_turn,
             )
             self.match_states[match_id] = state
+            journal.started(state)
             logger.info("[WS] MatchState created: match=%s first=%s", match_id, first_turn)
         else:
             state = self.match_states[match_id]
@@ -430,8 +341,156 @@ class WSManager:
         })
         for pid in [p1_id, p2_id]:
             await self.send_full_state(match_id, pid)
+        self.schedule_bot_turn(match_id)
         return True
 
+    async def handle_join(self, ws: WebSocket, match_id: str, player_id: str, match_data: dict):
+        """Игрок (пере)подключился: регистрируем сокет, уведомляем оппонента,
+        снимаем форфейт-таймер, отдаём состояние и пробуем стартовать."""
+        p1_id = str(match_data.get("player1_id") or "")
+        p2_id = str(match_data.get("player2_id") or "")
+        you_are = "player1" if player_id == p1_id else "player2"
+
+        # REGISTER CONNECTION
+        await self.connect(ws, match_id, player_id)
+
+        # SEND connected
+        await self.send(match_id, player_id, {
+            "type": "connected",
+            "you_are": you_are,
+            "player_id": player_id,
+            "match_id": match_id,
+        })
+
+        # NOTIFY OTHER PLAYER
+        await self.broadcast_except(match_id, {
+            "type": "player_connected",
+            "player_id": player_id,
+        }, exclude_id=player_id)
+
+        # При (ре)коннекте снимаем форфейт-таймер этого игрока
+        self.cancel_forfeit(match_id, player_id)
+
+        # Если партия УЖЕ идёт — сразу отдаём текущее состояние.
+        # Это и есть починка возврата в игру после вылета.
+        # (Оппонента о возврате уже уведомил broadcast player_connected выше,
+        #  а серверный форфейт-таймер мы сняли через cancel_forfeit.)
+        if match_id in self.match_states:
+            await self.send_full_state(match_id, player_id)
+
+        # Сообщаем, ждём ли ещё лок NFT
+        both_connected = self.is_present(match_id, p1_id) and self.is_present(match_id, p2_id)
+        if both_connected and not match_data.get("escrow_locked", False):
+            await self.send(match_id, player_id, {
+                "type": "waiting_for_escrow",
+                "message": "Waiting for both players to lock NFTs",
+            })
+
+        # Пытаемся стартовать партию (оба на связи + эскроу залочен).
+        # Идемпотентно: если матч уже идёт — ничего не сломает.
+        await self.try_start_game(match_id)
+
+    async def abort_unstarted(self, match_id: str) -> bool:
+        """Сообщение от фоновой чистки «зависших» матчей. True — партия так и
+        не пошла и ходы теперь закрыты; False — ход уже сделан, не трогаем."""
+        state = self.match_states.get(match_id)
+        if state is None:
+            return True
+        if state.status != "active":
+            # Решающий ход мог прийти раньше этого сообщения — сыгранную
+            # партию (победитель есть) не отменяем.
+            return state.status != "finished" and state.moves_count == 0
+        if state.moves_count > 0:
+            return False
+        state.cancel()
+        journal.cancelled(match_id)
+        return True
+
+    # ── БОТ ────────────────────────────────────────────────────────
+
+    def is_present(self, match_id: str, player_id: str) -> bool:
+        """Игрок на связи: есть сокет или это серверный бот (он всегда тут)."""
+        player_id = str(player_id)
+        return bot_ai.is_bot(player_id) or player_id in self.connections.get(match_id, {})
+
+    def schedule_bot_turn(self, match_id: str):
+        """Если ход за ботом — запускаем поиск. Сам поиск идёт в пуле
+        процессов ВНЕ актора (ходы/реконнекты человека не ждут его), а
+        готовый ход приходит в актор обычным сообщением."""
+        state = self.match_states.get(match_id)
+        if state is None or state.status != "active" or not bot_ai.is_bot(state.current_turn):
+            return
+        task = self.bot_tasks.get(match_id)
+        if task is not None and not task.done():
+            return
+        self.bot_tasks[match_id] = asyncio.create_task(
+            self._bot_think(match_id, state, state.current_turn, state.seq)
+        )
+
+    async def _bot_think(self, match_id: str, state: MatchState, bot_id: str, seq: int):
+        try:
+            card_index, cell_index = await bot_ai.choose_move(state, bot_id)
+            if card_index is not None:
+                self.post(match_id, self._bot_play, match_id, bot_id, seq, card_index, cell_index)
+        except Exception as e:
+            logger.warning("[BOT] match=%s search error: %s", match_id, e)
+        finally:
+            if self.bot_tasks.get(match_id) is asyncio.current_task():
+                del self.bot_tasks[match_id]
+
+    async def _bot_play(self, match_id: str, bot_id: str, seq: int, card_index: int, cell_index: int):
+        state = self.match_states.get(match_id)
+        # Пока бот думал, партию могли закончить форфейтом или отменить.
+        if state is None or state.seq != seq:
+            return
+        await self.handle_play_card(match_id, bot_id, card_index, cell_index)
+
+    # ── ЗРИТЕЛИ ────────────────────────────────────────────────────
+
+    def spectator_snapshot(self, match_id: str, match_data: Optional[dict] = None) -> str:
+        """Публичное состояние партии (без рук) для зрителя."""
+        state = self.match_states.get(match_id)
+        if state is None:
+            return dumps({
+                "type": "spectate_waiting",
+                "match_id": match_id,
+                "status": (match_data or {}).get("status"),
+            })
+        return compose({
+            "type": "game_state",
+            "you_are": "spectator",
+            "spectators": spectator_hub.count(match_id),
+        }, state=state.state_json())
+
+    async def add_spectator(self, ws: WebSocket, match_id: str, match_data: dict):
+        # В акторе: снапшот и подписка — одним шагом между двумя ходами.
+        return spectator_hub.subscribe(match_id, ws, [self.spectator_snapshot(match_id, match_data)])
+
+    async def restore_from_journal(self):
+        """Старт процесса: поднимаем живые партии из журнала ходов (см.
+        game.journal), если в БД матч всё ещё status == "active". Игроки после
+        рестарта не подключены — ставим им обычный форфейт-таймер, реконнект
+        его снимет. Не вернулся никто — партия отменяется с возвратом NFT."""
+        try:
+            states = await asyncio.to_thread(journal.load)
+        except Exception as e:
+            logger.warning("[WS] journal load error: %s", e)
+            states = {}
+        if states:
+            active = await _db_active_match_ids(list(states))
+            deadline = datetime.utcnow() + timedelta(seconds=RECONNECT_TIMEOUT_SECONDS)
+            for match_id, state in states.items():
+                if active is not None and match_id not in active:
+                    continue
+                self.match_states[match_id] = state
+                self.restored.add(match_id)
+                for pid in (state.player1_id, state.player2_id):
+                    if not bot_ai.is_bot(pid):
+                        self.schedule_forfeit(match_id, pid, deadline)
+                self.schedule_bot_turn(match_id)
+            logger.info("[WS] restored %d live matches from journal", len(self.match_states))
+        journal.start(lambda: list(self.match_states.values()))
+
     # ── ДИСКОННЕКТ / ФОРФЕЙТ ───────────────────────────────────────
 
     async def handle_player_drop(self, match_id: str, player_id: str):
@@ -449,31 +508,32 @@ class WSManager:
         self.schedule_forfeit(match_id, player_id, deadline)
 
     def schedule_forfeit(self, match_id: str, player_id: str, deadline: datetime):
-        self.cancel_forfeit(match_id, player_id)
-
-        async def _runner():
-            try:
-                delay = (deadline - datetime.utcnow()).total_seconds()
-                if delay > 0:
-                    await asyncio.sleep(delay)
-                await self.resolve_forfeit(match_id, player_id)
-            except asyncio.CancelledError:
-                pass
-            except Exception as e:
-                logger.warning("[WS] forfeit runner error: %s", e)
-
-        task = asyncio.create_task(_runner())
-        self.reconnect_tasks.setdefault(match_id, {})[str(player_id)] = task
+        player_id = str(player_id)
+        self.reconnect_deadlines.setdefault(match_id, {})[player_id] = deadline
+        wheel.schedule_at(("forfeit", match_id, player_id), deadline,
+                          self._forfeit_fired, match_id, player_id, deadline)
 
     def cancel_forfeit(self, match_id: str, player_id: str):
-        tasks = self.reconnect_tasks.get(match_id)
-        if not tasks:
+        player_id = str(player_id)
+        wheel.cancel(("forfeit", match_id, player_id))
+        deadlines = self.reconnect_deadlines.get(match_id)
+        if not deadlines:
             return
-        task = tasks.pop(str(player_id), None)
-        if task and not task.done():
-            task.cancel()
-        if not tasks:
-            self.reconnect_tasks.pop(match_id, None)
+        deadlines.pop(player_id, None)
+        if not deadlines:
+            self.reconnect_deadlines.pop(match_id, None)
+
+    def _forfeit_fired(self, match_id: str, player_id: str, deadline: datetime):
+        # Срабатывание таймера — такое же сообщение актору, как ход:
+        # не пересечётся с ходом/реконнектом, обработанным параллельно.
+        self.post(match_id, self._forfeit_due, match_id, player_id, deadline)
+
+    async def _forfeit_due(self, match_id: str, player_id: str, deadline: datetime):
+        # Пока сообщение стояло в ящике, игрок мог вернуться и отвалиться
+        # снова — тогда действует уже НОВЫЙ таймер, а этот устарел.
+        if self.reconnect_deadlines.get(match_id, {}).get(str(player_id)) != deadline:
+            return
+        await self.resolve_forfeit(match_id, player_id)
 
     async def resolve_forfeit(self, match_id: str, disconnected_id: str):
         """Засчитываем поражение вышедшему: оставшийся игрок побеждает,
@@ -490,11 +550,15 @@ class WSManager:
             state.player2_id if str(disconnected_id) == state.player1_id
             else state.player1_id
         )
-        state.status = "finished"
-        state.winner = winner
+        if match_id in self.restored and not self.is_present(match_id, winner):
+            # После рестарта не вернулся никто — победителя нет, отменяем
+            # партию и возвращаем все NFT, как до журнала.
+            await self._cancel_abandoned(match_id, state)
+            return
+        state.finish(winner)
+        journal.finished(match_id, winner)
 
-        p1_score = sum(1 for c in state.board if c and c.get("owner") == state.player1_id)
-        p2_score = sum(1 for c in state.board if c and c.get("owner") == state.player2_id)
+        p1_score, p2_score = state.score()
 
         winner_coins = 0
         try:
@@ -502,6 +566,8 @@ class WSManager:
             from routers.matches import _finalize_match_result, auto_settle_forfeit
             match_data = await get_match(match_id)
             if match_data:
+                match_data["event_log"] = state.event_log("forfeit_disconnect")
+                match_data["moves_count"] = state.moves_count
                 ru = await _finalize_match_result(match_data, winner, reason="forfeit_disconnect")
                 if ru and ru.get("winner"):
                     winner_coins = ru["winner"].get("coins_awarded", 0) or 0
@@ -511,19 +577,59 @@ class WSManager:
         except Exception as e:
             logger.warning("[WS] forfeit finalize/settle error: %s", e)
 
-        await self.broadcast_all(match_id, {
+        await self.broadcast_raw(match_id, compose({
             "type": "game_over",
+            "seq": state.seq,
             "winner": winner,
-            "board": state.board,
             "player1_score": p1_score,
             "player2_score": p2_score,
             "reason": "opponent_disconnected",
             "winner_coins": winner_coins,
-        })
+        }, board=state.board_json()))
         logger.info("[WS] forfeit: match=%s winner=%s (dropped=%s)",
                     match_id, winner, disconnected_id)
         self.cancel_forfeit(match_id, disconnected_id)
 
+    async def _cancel_abandoned(self, match_id: str, state: MatchState):
+        state.cancel()
+        journal.cancelled(match_id)
+        for pid in (state.player1_id, state.player2_id):
+            self.cancel_forfeit(match_id, pid)
+        self.restored.discard(match_id)
+        try:
+            from routers.matchmaking import get_match
+            from routers.matches import _cancel_and_refund
+            match_data = await get_match(match_id)
+            if match_data:
+                refunded = await _cancel_and_refund(match_data, "abandoned_after_restart")
+                logger.info("[WS] restored match=%s abandoned by both players, refunded %d NFT",
+                            match_id, refunded)
+        except Exception as e:
+            logger.warning("[WS] abandoned match cancel/refund error: %s", e)
+
+
+async def _db_active_match_ids(match_ids: List[str]):
+    """Какие из матчей журнала в БД всё ещё active. None — БД недоступна
+    (тогда доверяем журналу)."""
+    try:
+        from sqlalchemy import select
+        from database.session import get_session
+        from database.models.pvp_match import PvPMatch
+        active = None
+        async for session in get_session():
+            result = await session.execute(
+                select(PvPMatch.id).where(
+                    PvPMatch.id.in_(match_ids),
+                    PvPMatch.status == "active",
+                )
+            )
+            active = {str(r[0]) for r in result.all()}
+            break
+        return active
+    except Exception as e:
+        logger.warning("[WS] journal restore DB check error: %s", e)
+    return None
+
 
 async def _load_player_hand(player_id: str, match_data: dict, deck_key: str) -> List[dict]:
     """Берём реальную колоду игрока (его NFT): сначала из матча, затем из БД,
@@ -534,6 +640,8 @@ async def _load_player_hand(player_id: str, match_data: dict, deck_key: str) ->
     deck = match_data.get(deck_key) or []
     if isinstance(deck, list) and len(deck) >= 5:
         return deck[:5]
+    if bot_ai.is_bot(pid):
+        return _make_random_hand(pid)
 
     # 2) из БД (UserDeck.full_cards)
     try:
@@ -562,6 +670,32 @@ async def _load_player_hand(player_id: str, match_data: dict, deck_key: str) ->
 
 
 ws_manager = WSManager()
+match_registry.on_evict(ws_manager.forget_match)
+
+
+@router.get("/api/ws/stats")
+async def ws_stats():
+    """Глубина исходящих очередей, выселенные медленные клиенты, задержка
+    сообщений в ящиках акторов матчей, состояние колеса таймеров и пул бота."""
+    return {
+        "outbox": ws_manager.outbox_stats(),
+        "actors": ws_manager.actor_stats(),
+        "timers": wheel.stats(),
+        "journal": journal.stats(),
+        "spectators": spectator_hub.stats(),
+        "bot": bot_ai.stats(),
+        "matches": {
+            "states": len(ws_manager.match_states),
+            "connections": len(ws_manager.connections),
+            "reconnect_deadlines": len(ws_manager.reconnect_deadlines),
+            "registry": match_registry.stats(),
+        },
+    }
+
+
+async def _send_json(ws: WebSocket, data: dict):
+    """Замена ws.send_json: тот же текстовый фрейм, но через быстрый кодер."""
+    await ws.send_text(dumps(data))
 
 
 @router.websocket("/ws/match/{match_id}")
@@ -578,20 +712,20 @@ async def ws_match_endpoint(websocket: WebSocket, match_id: str):
         # AUTH
         try:
             raw = await websocket.receive_text()
-            auth_msg = json.loads(raw)
+            auth_msg = loads(raw)
         except Exception:
-            await websocket.send_json({"type": "error", "message": "Expected JSON auth message"})
+            await _send_json(websocket, {"type": "error", "message": "Expected JSON auth message"})
             await websocket.close(1008)
             return
 
         if auth_msg.get("type") != "auth":
-            await websocket.send_json({"type": "error", "message": "First message must be auth"})
+            await _send_json(websocket, {"type": "error", "message": "First message must be auth"})
             await websocket.close(1008)
             return
 
         token = (auth_msg.get("token") or "").strip()
         if not token:
-            await websocket.send_json({"type": "error", "message": "Token missing"})
+            await _send_json(websocket, {"type": "error", "message": "Token missing"})
             await websocket.close(1008)
             return
 
@@ -606,7 +740,7 @@ async def ws_match_endpoint(websocket: WebSocket, match_id: str):
             if not player_id or player_id == "None":
                 raise ValueError("Empty player_id from token")
         except Exception as e:
-            await websocket.send_json({"type": "error", "message": f"Unauthorized: {e}"})
+            await _send_json(websocket, {"type": "error", "message": f"Unauthorized: {e}"})
             await websocket.close(1008)
             return
 
@@ -620,7 +754,7 @@ async def ws_match_endpoint(websocket: WebSocket, match_id: str):
             match_data = None
 
         if not match_data:
-            await websocket.send_json({"type": "error", "message": "Match not found"})
+            await _send_json(websocket, {"type": "error", "message": "Match not found"})
             await websocket.close(1008)
             return
 
@@ -628,51 +762,15 @@ async def ws_match_endpoint(websocket: WebSocket, match_id: str):
         p2_id = str(match_data.get("player2_id") or "")
 
         if player_id not in (p1_id, p2_id):
-            await websocket.send_json({"type": "error", "message": "You are not in this match"})
+            await _send_json(websocket, {"type": "error", "message": "You are not in this match"})
             await websocket.close(1008)
             return
 
-        you_are = "player1" if player_id == p1_id else "player2"
-
-        # REGISTER CONNECTION
-        await ws_manager.connect(websocket, match_id, player_id)
-
-        # SEND connected
-        await websocket.send_json({
-            "type": "connected",
-            "you_are": you_are,
-            "player_id": player_id,
-            "match_id": match_id,
-        })
-
-        # NOTIFY OTHER PLAYER
-        await ws_manager.broadcast_except(match_id, {
-            "type": "player_connected",
-            "player_id": player_id,
-        }, exclude_id=player_id)
-
-        # При (ре)коннекте снимаем форфейт-таймер этого игрока
-        ws_manager.cancel_forfeit(match_id, player_id)
-
-        # Если партия УЖЕ идёт — сразу отдаём текущее состояние.
-        # Это и есть починка возврата в игру после вылета.
-        # (Оппонента о возврате уже уведомил broadcast player_connected выше,
-        #  а серверный форфейт-таймер мы сняли через cancel_forfeit.)
-        if match_id in ws_manager.match_states:
-            await ws_manager.send_full_state(match_id, player_id)
-
-        # Сообщаем, ждём ли ещё лок NFT
-        conns = ws_manager.connections.get(match_id, {})
-        both_connected = p1_id in conns and p2_id in conns
-        if both_connected and not match_data.get("escrow_locked", False):
-            await websocket.send_json({
-                "type": "waiting_for_escrow",
-                "message": "Waiting for both players to lock NFTs",
-            })
-
-        # Пытаемся стартовать партию (оба на связи + эскроу залочен).
-        # Идемпотентно: если матч уже идёт — ничего не сломает.
-        await ws_manager.try_start_game(match_id)
+        # Регистрация и старт — сообщением в актор матча: не пересекается
+        # с ходами, таймерами и стартом из HTTP-пути эскроу.
+        await ws_manager.call(
+            match_id, ws_manager.handle_join, websocket, match_id, player_id, match_data,
+        )
 
         # MAIN LOOP
         while True:
@@ -682,36 +780,38 @@ async def ws_match_endpoint(websocket: WebSocket, match_id: str):
                 break
 
             try:
-                data = json.loads(raw)
+                data = loads(raw)
             except Exception:
-                await websocket.send_json({"type": "error", "message": "Invalid JSON"})
+                await ws_manager.send(match_id, player_id, {"type": "error", "message": "Invalid JSON"})
                 continue
 
             msg_type = data.get("type")
 
             if msg_type == "ping":
-                await websocket.send_json({"type": "pong"})
+                await ws_manager.send(match_id, player_id, {"type": "pong"})
 
             elif msg_type == "pong":
                 pass
 
             elif msg_type == "get_state":
                 # Клиент просит актуальное состояние (после реконнекта)
-                await ws_manager.send_full_state(match_id, player_id)
+                ws_manager.post(match_id, ws_manager.send_full_state, match_id, player_id)
 
             elif msg_type == "play_card":
                 try:
                     card_index = int(data["card_index"])
                     cell_index = int(data["cell_index"])
                 except (KeyError, TypeError, ValueError):
-                    await websocket.send_json({
+                    await ws_manager.send(match_id, player_id, {
                         "type": "error",
                         "message": "play_card requires integer card_index and cell_index",
                     })
                     continue
 
-                await ws_manager.handle_play_card(
-                    match_id, player_id, card_index, cell_index, websocket
+                # Ход — в ящик актора; сокет сразу читает дальше (ping и т.п.)
+                ws_manager.post(
+                    match_id, ws_manager.handle_play_card,
+                    match_id, player_id, card_index, cell_index, websocket,
                 )
 
             else:
@@ -722,15 +822,63 @@ async def ws_match_endpoint(websocket: WebSocket, match_id: str):
     except Exception as e:
         logger.exception("[WS] Unexpected error: player=%s match=%s: %s", player_id, match_id, e)
     finally:
-        if player_id:
-            ws_manager.disconnect(match_id, player_id)
+        # Снимаем только СВОЙ сокет: если игрок уже переподключился или его
+        # выселили как медленного (дроп тогда уже запущен) — ничего не делаем.
+        if player_id and ws_manager.disconnect(match_id, player_id, websocket):
             logger.info("[WS] Cleaned up: player=%s match=%s", player_id, match_id)
             # Если игрок вылетел во время активной партии — уведомляем
             # оппонента и запускаем таймер форфейта.
+            ws_manager.post(match_id, ws_manager.handle_player_drop, match_id, player_id)
+
+
+@router.websocket("/ws/spectate/{match_id}")
+async def ws_spectate_endpoint(websocket: WebSocket, match_id: str):
+    """Read-only трансляция матча: снапшот при входе, дальше публичные
+    события партии (card_played, game_over, ...). Рук игроков тут нет."""
+    await websocket.accept()
+    sub = None
+    try:
+        try:
+            from routers.matchmaking import get_match
+            match_data = await get_match(match_id)
+        except Exception as e:
+            logger.error("[SPECTATE] get_match error: %s", e)
+            match_data = None
+        if not match_data:
+            await _send_json(websocket, {"type": "error", "message": "Match not found"})
+            await websocket.close(1008)
+            return
+
+        sub = await ws_manager.call(match_id, ws_manager.add_spectator, websocket, match_id, match_data)
+        if sub is None:
+            await _send_json(websocket, {"type": "error", "message": "Too many spectators"})
+            await websocket.close(1013)
+            return
+
+        while True:
             try:
-                await ws_manager.handle_player_drop(match_id, player_id)
-            except Exception as e:
-                logger.warning("[WS] handle_player_drop error: %s", e)
+                raw = await websocket.receive_text()
+            except Exception:
+                # Дисконнект или сокет уже закрыт писателем (отстающий
+                # зритель, см. game.fanout) — receive_text больше не ждёт.
+                break
+            try:
+                data = loads(raw)
+            except ValueError:
+                continue
+            msg_type = data.get("type") if isinstance(data, dict) else None
+            if msg_type == "ping":
+                sub.push(dumps({"type": "pong"}))
+            elif msg_type == "get_state":
+                # Дыра в seq (выпали старые кадры) — свежий снапшот.
+                sub.push(ws_manager.spectator_snapshot(match_id, match_data))
+    except WebSocketDisconnect:
+        pass
+    except Exception as e:
+        logger.warning("[SPECTATE] error match=%s: %s", match_id, e)
+    finally:
+        if sub is not None:
+            spectator_hub.unsubscribe(match_id, sub)
 
 
 def _make_random_hand(owner_id: str) -> List[dict]:
@@ -0,0 +1,148 @@
+"""Подписант транзакций эскроу: пул ключей доступа вместо одного аккаунта под
+глобальным локом.
+
+У аккаунта эскроу может быть несколько ключей (ESCROW_PRIVATE_KEYS через
+запятую, плюс основной ESCROW_PRIVATE_KEY). У каждого ключа свой nonce, поэтому
+транзакции на разных ключах не конфликтуют и уходят параллельно. На одном ключе
+в полёте не больше одной транзакции — его nonce ведётся локально объектом
+py_near Account (инкремент без чтения с чейна).
+
+Ключи должны быть full access: nft_transfer требует депозит 1 yoctoNEAR, а
+function-call ключ депозит прикладывать не может.
+
+Ошибка InvalidNonce (кто-то подписал этим ключом мимо нас, tx потерялась по
+таймауту) — пересинхронизируем только этот ключ (перечитываем nonce) и сразу
+повторяем. Прочие ошибки отдаём вызывающему, не сбрасывая ключ."""
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Awaitable, Callable, Deque, List, Optional
+
+logger = logging.getLogger(__name__)
+
+_LATENCY_WINDOW = 256
+
+
+def _is_invalid_nonce(exc: Exception) -> bool:
+    return "InvalidNonce" in type(exc).__name__ or "InvalidNonce" in str(exc)
+
+
+def _percentile(values, q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class _KeySlot:
+    __slots__ = ("index", "key", "account", "txs", "errors", "resyncs")
+
+    def __init__(self, index: int, key: str):
+        self.index = index
+        self.key = key if key.startswith("ed25519:") else "ed25519:" + key
+        self.account = None
+        self.txs = 0
+        self.errors = 0
+        self.resyncs = 0
+
+
+class EscrowSigner:
+    def __init__(self, account_id: str, keys: List[str], rpc_url: str = ""):
+        self.account_id = account_id
+        self.rpc_url = rpc_url
+        seen = set()
+        self._slots: List[_KeySlot] = []
+        for key in keys:
+            key = key.strip()
+            if key and key not in seen:
+                seen.add(key)
+                self._slots.append(_KeySlot(len(self._slots), key))
+        self._free: Optional[asyncio.Queue] = None
+        self.waiting = 0
+        self.in_flight = 0
+        self._wait_s: Deque[float] = deque(maxlen=_LATENCY_WINDOW)
+        self._tx_s: Deque[float] = deque(maxlen=_LATENCY_WINDOW)
+
+    @property
+    def configured(self) -> bool:
+        return bool(self._slots)
+
+    async def function_call(self, contract_id: str, method_name: str, args: dict, gas: int, amount: int):
+        return await self._submit(
+            lambda acc: acc.function_call(contract_id, method_name, args, gas=gas, amount=amount)
+        )
+
+    async def sign_and_submit_tx(self, receiver_id: str, actions: list):
+        return await self._submit(lambda acc: acc.sign_and_submit_tx(receiver_id, actions))
+
+    # ── внутреннее ────────────────────────────────────────────────
+
+    def _queue(self) -> asyncio.Queue:
+        # Создаём лениво — уже внутри работающего event loop.
+        if self._free is None:
+            self._free = asyncio.Queue()
+            for slot in self._slots:
+                self._free.put_nowait(slot)
+        return self._free
+
+    async def _account(self, slot: _KeySlot):
+        if slot.account is None:
+            from py_near.account import Account
+            acc = (Account(self.account_id, slot.key, self.rpc_url) if self.rpc_url
+                   else Account(self.account_id, slot.key))
+            await acc.startup()
+            slot.account = acc
+        return slot.account
+
+    async def _submit(self, send: Callable[[object], Awaitable]):
+        if not self._slots:
+            raise RuntimeError("Escrow signer has no keys configured")
+        t0 = time.monotonic()
+        self.waiting += 1
+        try:
+            slot = await self._queue().get()
+        finally:
+            self.waiting -= 1
+        t1 = time.monotonic()
+        self._wait_s.append(t1 - t0)
+        self.in_flight += 1
+        try:
+            for attempt in range(2):
+                try:
+                    result = await send(await self._account(slot))
+                except Exception as e:
+                    if attempt == 0 and _is_invalid_nonce(e):
+                        # Перечитаем nonce этого ключа и повторим — на других
+                        # ключах транзакции тем временем идут как шли.
+                        slot.resyncs += 1
+                        slot.account = None
+                        logger.info("[ESCROW_SIGNER] key #%d nonce resync: %s", slot.index, e)
+                        continue
+                    slot.errors += 1
+                    raise
+                slot.txs += 1
+                self._tx_s.append(time.monotonic() - t1)
+                return result
+        finally:
+            self.in_flight -= 1
+            self._queue().put_nowait(slot)
+
+    def stats(self) -> dict:
+        wait_ms = [s * 1000 for s in self._wait_s]
+        tx_ms = [s * 1000 for s in self._tx_s]
+        return {
+            "keys": len(self._slots),
+            "queue_depth": self.waiting,
+            "in_flight": self.in_flight,
+            "wait_ms_p50": round(_percentile(wait_ms, 0.5), 1),
+            "wait_ms_p95": round(_percentile(wait_ms, 0.95), 1),
+            "tx_ms_p50": round(_percentile(tx_ms, 0.5), 1),
+            "tx_ms_p95": round(_percentile(tx_ms, 0.95), 1),
+            "per_key": [
+                {"key": s.index, "txs": s.txs, "errors": s.errors, "nonce_resyncs": s.resyncs}
+                for s in self._slots
+            ],
+        }
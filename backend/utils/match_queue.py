@@ -0,0 +1,166 @@
+"""Очередь матчмейкинга с индексами вместо линейного прохода.
+
+Записи лежат в трёх структурах сразу:
+  * FIFO (dict в порядке входа) — порядок очереди;
+  * ищущие (без match_id) — {user_id: запись}: матчмейкер (plan_pairs
+    сортирует их по Elo сам) не перебирает тех, кому матч уже нашли;
+  * дерево Фенвика по порядковому номеру входа — позиция в очереди за
+    O(log n) вместо list(keys()).index().
+
+Номера входа монотонные; когда они упираются в ёмкость дерева, живые записи
+перенумеровываются (амортизированно O(1) на вставку)."""
+from __future__ import annotations
+
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+class QueueEntry:
+    __slots__ = (
+        "user_id", "elo", "deck_rating", "deck", "joined_at", "last_poll",
+        "match_id", "open_match_id", "max_elo_diff", "order",
+    )
+
+    def __init__(
+            self,
+            user_id: str,
+            elo: int,
+            deck_rating: int,
+            deck: list,
+            joined_at: datetime,
+            open_match_id: Optional[str] = None,
+            max_elo_diff: int = 300,
+    ):
+        self.user_id = user_id
+        self.elo = elo
+        self.deck_rating = deck_rating
+        self.deck = deck
+        self.joined_at = joined_at
+        self.last_poll = joined_at
+        self.match_id: Optional[str] = None
+        # «Лобби с готовыми картами»: следующего соперника подсаживаем в этот матч.
+        self.open_match_id = open_match_id
+        self.max_elo_diff = max_elo_diff
+        self.order = 0
+
+
+class _Fenwick:
+    __slots__ = ("size", "tree")
+
+    def __init__(self, size: int):
+        self.size = size
+        self.tree = [0] * (size + 1)
+
+    def add(self, i: int, delta: int):
+        tree, n = self.tree, self.size
+        while i <= n:
+            tree[i] += delta
+            i += i & -i
+
+    def prefix(self, i: int) -> int:
+        tree, s = self.tree, 0
+        while i > 0:
+            s += tree[i]
+            i -= i & -i
+        return s
+
+
+class MatchQueue:
+    def __init__(self, capacity: int = 1024):
+        self._fifo: Dict[str, QueueEntry] = {}
+        self._searching: Dict[str, QueueEntry] = {}
+        self._ranks = _Fenwick(capacity)
+        self._next = 1
+
+    # ── dict-подобный доступ ───────────────────────────────────────
+
+    def __contains__(self, user_id) -> bool:
+        return user_id in self._fifo
+
+    def __len__(self) -> int:
+        return len(self._fifo)
+
+    def __getitem__(self, user_id: str) -> QueueEntry:
+        return self._fifo[user_id]
+
+    def __delitem__(self, user_id: str):
+        if self.pop(user_id) is None:
+            raise KeyError(user_id)
+
+    def get(self, user_id: str) -> Optional[QueueEntry]:
+        return self._fifo.get(user_id)
+
+    def keys(self) -> List[str]:
+        return list(self._fifo)
+
+    def items(self) -> List[Tuple[str, QueueEntry]]:
+        return list(self._fifo.items())
+
+    def values(self) -> List[QueueEntry]:
+        return list(self._fifo.values())
+
+    # ── изменение ─────────────────────────────────────────────────
+
+    def add(self, entry: QueueEntry) -> QueueEntry:
+        """Ставит запись в конец очереди (старая запись игрока заменяется)."""
+        self.pop(entry.user_id)
+        if self._next > self._ranks.size:
+            self._renumber()
+        entry.order = self._next
+        self._next += 1
+        self._ranks.add(entry.order, 1)
+        self._fifo[entry.user_id] = entry
+        if entry.match_id is None:
+            self._searching[entry.user_id] = entry
+        return entry
+
+    def pop(self, user_id: str, default=None) -> Optional[QueueEntry]:
+        entry = self._fifo.pop(user_id, None)
+        if entry is None:
+            return default
+        self._searching.pop(user_id, None)
+        self._ranks.add(entry.order, -1)
+        return entry
+
+    def set_match(self, user_id: str, match_id: Optional[str]):
+        """Игроку нашли матч: запись остаётся (до опроса клиентом), но из
+        поиска соперников уходит. match_id=None — матч не состоялся, игрок
+        снова ищет."""
+        entry = self._fifo.get(user_id)
+        if entry is not None:
+            entry.match_id = match_id
+            if match_id is None:
+                self._searching[user_id] = entry
+            else:
+                self._searching.pop(user_id, None)
+
+    def update(self, entry: QueueEntry, elo: int, deck_rating: int):
+        """Elo/колода игрока поменялись, пока он в очереди."""
+        entry.elo = elo
+        entry.deck_rating = deck_rating
+
+    # ── поиск ─────────────────────────────────────────────────────
+
+    def position(self, user_id: str) -> int:
+        """Место в очереди, с 1 (0 — игрока в очереди нет)."""
+        entry = self._fifo.get(user_id)
+        return self._ranks.prefix(entry.order) if entry is not None else 0
+
+    def searching(self) -> List[QueueEntry]:
+        """Все ищущие записи (без match_id)."""
+        return list(self._searching.values())
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self._fifo),
+            "searching": len(self._searching),
+        }
+
+    # ── внутреннее ────────────────────────────────────────────────
+
+    def _renumber(self):
+        live = list(self._fifo.values())
+        self._ranks = _Fenwick(max(1024, 2 * (len(live) + 1)))
+        for i, entry in enumerate(live, start=1):
+            entry.order = i
+            self._ranks.add(i, 1)
+        self._next = len(live) + 1
@@ -0,0 +1,193 @@
+"""Реестр матчей в памяти (бывший голый dict active_matches) с выселением.
+
+Живые матчи лежат сколько нужно. Завершённые (finished / cancelled) — в том
+числе подгруженные из БД ради истории — держатся MATCH_TERMINAL_TTL_SECONDS
+с последнего обращения, а при переполнении (MATCH_REGISTRY_MAX) выселяются
+раньше, от давно не трогавшихся (LRU). Перед выселением матч, чьё последнее
+сохранение в PvPMatch не удалось, ещё раз пишется в БД (write-through);
+не записался — остаётся до следующего прохода (выселяется несохранённым,
+только если реестр уже переполнен).
+
+Прочее состояние на матч (блокировки эскроу, WS-состояние партии, таймеры
+реконнекта) висит на хуках on_evict: владельцы подписываются сами и
+отпускают своё, когда матч уходит из реестра.
+
+Проход выселения — периодический таймер в utils.timing_wheel; стоит
+O(выселяемых), а не O(всех матчей): завершённые упорядочены по времени."""
+from __future__ import annotations
+
+import json
+import logging
+import os
+import time
+from collections import OrderedDict
+from itertools import islice
+from typing import Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+from utils.timing_wheel import wheel
+
+logger = logging.getLogger(__name__)
+
+MATCH_TERMINAL_TTL_SECONDS = float(os.getenv("MATCH_TERMINAL_TTL_SECONDS", "600"))
+MATCH_REGISTRY_MAX = int(os.getenv("MATCH_REGISTRY_MAX", "20000"))
+MATCH_REGISTRY_SWEEP_SECONDS = float(os.getenv("MATCH_REGISTRY_SWEEP_SECONDS", "30"))
+
+TERMINAL_STATUSES = ("finished", "cancelled")
+
+
+class MatchRegistry:
+    def __init__(self, ttl: float = MATCH_TERMINAL_TTL_SECONDS, max_size: int = MATCH_REGISTRY_MAX):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._matches: Dict[str, dict] = {}
+        # match_id -> монотонное время последнего обращения (только завершённые)
+        self._terminal: "OrderedDict[str, float]" = OrderedDict()
+        self._dirty: Set[str] = set()
+        self._hooks: List[Callable[[str], None]] = []
+        # Запись матча в БД перед выселением: async (match) -> bool.
+        self.persist: Optional[Callable[[dict], Awaitable[bool]]] = None
+        self.evicted_total = 0
+        self.persist_retries = 0
+
+    # ── dict-подобный доступ ───────────────────────────────────────
+
+    def __contains__(self, match_id) -> bool:
+        return match_id in self._matches
+
+    def __len__(self) -> int:
+        return len(self._matches)
+
+    def __getitem__(self, match_id: str) -> dict:
+        match = self._matches[match_id]
+        self._touch(match_id)
+        return match
+
+    def __setitem__(self, match_id: str, match: dict):
+        self._matches[match_id] = match
+        self.track(match)
+
+    def get(self, match_id: str, default=None):
+        match = self._matches.get(match_id)
+        if match is None:
+            return default
+        self._touch(match_id)
+        return match
+
+    def keys(self) -> List[str]:
+        return list(self._matches)
+
+    def items(self) -> List[Tuple[str, dict]]:
+        return list(self._matches.items())
+
+    def values(self) -> List[dict]:
+        return list(self._matches.values())
+
+    # ── жизненный цикл ────────────────────────────────────────────
+
+    def track(self, match: dict):
+        """Сверить статус матча: завершённый встаёт в очередь на выселение,
+        ожившего (reopen и т.п.) из неё убираем. Зовётся на каждом сохранении."""
+        mid = match.get("match_id")
+        if not mid or self._matches.get(mid) is not match:
+            return
+        if match.get("status") in TERMINAL_STATUSES:
+            self._terminal[mid] = time.monotonic()
+            self._terminal.move_to_end(mid)
+        else:
+            self._terminal.pop(mid, None)
+
+    def mark_saved(self, match_id: str, ok: bool):
+        """Итог записи в PvPMatch: неудачно сохранённый матч не выселяем,
+        пока не допишем."""
+        if ok:
+            self._dirty.discard(match_id)
+        else:
+            self._dirty.add(match_id)
+
+    def on_evict(self, fn: Callable[[str], None]):
+        self._hooks.append(fn)
+
+    def start(self):
+        wheel.schedule(("registry",), MATCH_REGISTRY_SWEEP_SECONDS, self._sweep_fired)
+
+    async def _sweep_fired(self):
+        try:
+            await self.sweep()
+        except Exception as e:
+            logger.warning("[REGISTRY] sweep error: %s", e)
+        self.start()
+
+    async def sweep(self) -> int:
+        """Выселить завершённые матчи старше TTL и, если реестр переполнен,
+        самые давние завершённые сверх лимита."""
+        cutoff = time.monotonic() - self.ttl
+        victims = []
+        for mid, seen in self._terminal.items():
+            if seen > cutoff and len(self._matches) - len(victims) <= self.max_size:
+                break
+            victims.append(mid)
+
+        evicted = 0
+        for mid in victims:
+            match = self._matches.get(mid)
+            if match is None:
+                self._terminal.pop(mid, None)
+                continue
+            if mid in self._dirty:
+                ok = False
+                if self.persist is not None:
+                    self.persist_retries += 1
+                    try:
+                        ok = bool(await self.persist(match))
+                    except Exception as e:
+                        logger.warning("[REGISTRY] persist before evict failed match=%s: %s", mid, e)
+                if not ok:
+                    if len(self._matches) <= self.max_size:
+                        self._touch(mid)
+                        continue
+                    # Память важнее: реестр переполнен, а БД всё не принимает.
+                    logger.warning("[REGISTRY] evicting unsaved match=%s (registry over limit)", mid)
+                self._dirty.discard(mid)
+            # Пока писали в БД, матч могли оживить или заменить.
+            if self._matches.get(mid) is not match or match.get("status") not in TERMINAL_STATUSES:
+                continue
+            self._evict(mid)
+            evicted += 1
+        return evicted
+
+    def _evict(self, mid: str):
+        del self._matches[mid]
+        self._terminal.pop(mid, None)
+        self._dirty.discard(mid)
+        self.evicted_total += 1
+        for fn in self._hooks:
+            try:
+                fn(mid)
+            except Exception as e:
+                logger.warning("[REGISTRY] evict hook error match=%s: %s", mid, e)
+
+    def _touch(self, mid: str):
+        if mid in self._terminal:
+            self._terminal[mid] = time.monotonic()
+            self._terminal.move_to_end(mid)
+
+    def stats(self) -> dict:
+        # Память — оценка по JSON-размеру выборки матчей, без обхода всех.
+        sample = list(islice(self._matches.values(), 32))
+        approx = 0
+        if sample:
+            per_match = sum(len(json.dumps(m, default=str)) for m in sample) / len(sample)
+            approx = int(per_match * len(self._matches))
+        return {
+            "size": len(self._matches),
+            "terminal": len(self._terminal),
+            "dirty": len(self._dirty),
+            "evicted_total": self.evicted_total,
+            "persist_retries": self.persist_retries,
+            "ttl_seconds": self.ttl,
+            "max_size": self.max_size,
+            "approx_bytes": approx,
+        }
+
+
+match_registry = MatchRegistry()
@@ -0,0 +1,340 @@
+"""Кэш NFT по (контракт, token_id): метаданные и владелец.
+
+Два уровня:
+  * LRU в процессе (NFT_CACHE_MAX записей);
+  * таблица nft_tokens в БД — переживает рестарты и деплои.
+Промах по обоим — один view-вызов nft_token через blockchain.near_rpc,
+результат пишется в оба уровня. Одновременные промахи по одному ключу
+склеиваются (single-flight): в RPC уходит один запрос, остальные ждут его.
+
+Метаданные (картинка, название) почти не меняются и живут без TTL. Владелец
+меняется — он хранится с временем проверки и высотой блока; cached_owner
+отдаёт его, только если он не старше запрошенного max_age (иначе вызывающий
+перечитывает из RPC и кладёт обратно через note_owner). Ответ RPC с блока
+ниже уже известного (отстающая нода за балансировщиком) владельца не
+перезаписывает: запись всегда соответствует самому свежему увиденному блоку,
+max_age лишь ограничивает, как долго ей верить. Наши же переводы из
+эскроу сбрасывают владельца сразу (forget_owner). Владелец в cached_owner —
+только увиденный этим процессом: owner_id в nft_tokens лишь справочный (его
+могли записать до нашего возврата NFT), в LRU из БД он не поднимается.
+
+Прогрев (warm_up): картинки, названия и ранги коллекции из nft.json
+(NFT_METADATA_PATH) — в LRU и пачкой в nft_tokens, так что картинки карт для
+депозитов и колод почти никогда не требуют RPC."""
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import os
+import time
+from collections import OrderedDict
+from datetime import datetime
+from pathlib import Path
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import func, select, tuple_
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from blockchain.near_rpc import near_rpc
+from database.models.nft_token import NftToken
+from database.session import get_session
+
+logger = logging.getLogger(__name__)
+
+NFT_CACHE_MAX = int(os.getenv("NFT_CACHE_MAX", "50000"))
+NFT_CACHE_RPC_CONCURRENCY = int(os.getenv("NFT_CACHE_RPC_CONCURRENCY", "8"))
+NFT_CONTRACT_ID = os.getenv("NFT_CONTRACT_ID", "")
+NFT_METADATA_PATH = os.getenv("NFT_METADATA_PATH", "")
+
+_IPFS_GATEWAY = "https://ipfs.near.social/ipfs/"
+
+
+def _media_url(media: Optional[str]) -> str:
+    if not media:
+        return ""
+    if media.startswith("ipfs://"):
+        return _IPFS_GATEWAY + media[7:]
+    if media.startswith("http"):
+        return media
+    return _IPFS_GATEWAY + media
+
+
+class NftInfo:
+    __slots__ = ("media", "title", "rank", "owner", "owner_at", "owner_height", "forgot_at")
+
+    def __init__(self, media: str = "", title: Optional[str] = None, rank: Optional[int] = None):
+        self.media = media
+        self.title = title
+        self.rank = rank
+        self.owner: Optional[str] = None
+        # monotonic-время проверки владельца (None — не знаем) и высота блока.
+        self.owner_at: Optional[float] = None
+        self.owner_height = 0
+        # когда владельца сбросили нашим переводом (см. forget_owner)
+        self.forgot_at = 0.0
+
+
+def _behind(info: NftInfo, block_height: int) -> bool:
+    """Ответ с блока block_height старше того, на котором владелец уже известен."""
+    return bool(block_height) and info.owner_at is not None and block_height < info.owner_height
+
+
+class NftCache:
+    def __init__(self, max_size: int = NFT_CACHE_MAX):
+        self.max_size = max_size
+        self._lru: "OrderedDict[Tuple[str, str], NftInfo]" = OrderedDict()
+        self._inflight: Dict[Tuple, asyncio.Future] = {}
+        self._rpc_sem: Optional[asyncio.Semaphore] = None
+        self.hits = 0
+        self.db_hits = 0
+        self.rpc_fetches = 0
+        self.shared_waits = 0
+
+    # ── чтение ────────────────────────────────────────────────────
+
+    async def image(self, contract_id: str, token_id: str) -> str:
+        info = await self.info(contract_id, token_id)
+        return info.media if info is not None else ""
+
+    async def info(self, contract_id: str, token_id: str) -> Optional[NftInfo]:
+        key = (contract_id, str(token_id))
+        info = self._get(key)
+        if info is not None and info.media:
+            self.hits += 1
+            return info
+        return await self.once(("info",) + key, lambda: self._load(key))
+
+    async def images(self, contract_id: str, token_ids: Iterable[str]) -> Dict[str, str]:
+        """Картинки пачкой: LRU, затем один запрос в БД, затем RPC параллельно."""
+        ids = [str(t) for t in token_ids if t]
+        out: Dict[str, str] = {}
+        misses = []
+        for tid in ids:
+            info = self._get((contract_id, tid))
+            if info is not None and info.media:
+                self.hits += 1
+                out[tid] = info.media
+            else:
+                misses.append(tid)
+        if misses:
+            for tid, info in (await self._db_many(contract_id, misses)).items():
+                if info.media:
+                    out[tid] = info.media
+            rest = [tid for tid in misses if tid not in out]
+            infos = await asyncio.gather(*(self.info(contract_id, tid) for tid in rest),
+                                         return_exceptions=True)
+            for tid, info in zip(rest, infos):
+                out[tid] = info.media if isinstance(info, NftInfo) else ""
+        return out
+
+    def cached_owner(self, contract_id: str, token_id: str, max_age: float) -> Optional[str]:
+        info = self._lru.get((contract_id, str(token_id)))
+        if info is None or info.owner_at is None or time.monotonic() - info.owner_at >= max_age:
+            return None
+        return info.owner
+
+    # ── запись ────────────────────────────────────────────────────
+
+    def note_owner(self, contract_id: str, token_id: str, owner: Optional[str], block_height: int = 0):
+        """Владелец узнан в обход кэша (проверка лока эскроу и т.п.)."""
+        key = (contract_id, str(token_id))
+        info = self._get(key) or self._put(key, NftInfo())
+        if _behind(info, block_height):
+            return
+        info.owner = owner
+        info.owner_at = time.monotonic()
+        info.owner_height = block_height
+
+    def forget_owner(self, contract_id: str, token_id: str):
+        key = (contract_id, str(token_id))
+        info = self._lru.get(key) or self._put(key, NftInfo())
+        info.owner_at = None
+        info.forgot_at = time.monotonic()
+
+    async def warm_up(self, path: str = NFT_METADATA_PATH, contract_id: str = NFT_CONTRACT_ID) -> int:
+        """Метаданные коллекции из nft.json — в LRU и в nft_tokens."""
+        if not contract_id:
+            return 0
+        candidates = [path] if path else [
+            Path(__file__).resolve().parents[1] / "nft.json",
+            Path(__file__).resolve().parents[2] / "nft.json",
+        ]
+        src = next((Path(p) for p in candidates if p and Path(p).is_file()), None)
+        if src is None:
+            logger.info("[NFT_CACHE] nft.json not found — warm-up skipped")
+            return 0
+        try:
+            items = await asyncio.to_thread(lambda: json.loads(src.read_text(encoding="utf-8")))
+        except Exception as e:
+            logger.warning("[NFT_CACHE] cannot read %s: %s", src, e)
+            return 0
+        rows = []
+        for it in items if isinstance(items, list) else []:
+            tid = str(it.get("id") or "")
+            if not tid:
+                continue
+            media = _media_url(it.get("image") or it.get("media"))
+            rank = it.get("rank") if isinstance(it.get("rank"), int) else None
+            info = self._get((contract_id, tid))
+            if info is None:
+                self._put((contract_id, tid), NftInfo(media, it.get("title"), rank))
+            else:
+                info.media = info.media or media
+                info.title = info.title or it.get("title")
+                info.rank = rank if rank is not None else info.rank
+            rows.append({"contract_id": contract_id, "token_id": tid,
+                         "media": media, "title": it.get("title"), "rank": rank})
+        if rows:
+            try:
+                async for session in get_session():
+                    for start in range(0, len(rows), 1000):
+                        stmt = pg_insert(NftToken).values(rows[start:start + 1000])
+                        await session.execute(stmt.on_conflict_do_update(
+                            index_elements=[NftToken.contract_id, NftToken.token_id],
+                            set_={
+                                "media": func.coalesce(NftToken.media, stmt.excluded.media),
+                                "title": func.coalesce(NftToken.title, stmt.excluded.title),
+                                "rank": stmt.excluded.rank,
+                            },
+                        ))
+                    await session.commit()
+                    break
+            except Exception as e:
+                logger.warning("[NFT_CACHE] warm-up DB write failed: %s", e)
+        logger.info("[NFT_CACHE] warmed %d tokens from %s", len(rows), src)
+        return len(rows)
+
+    # ── single-flight ─────────────────────────────────────────────
+
+    async def once(self, key: Tuple, fn: Callable[[], Awaitable]):
+        """Одновременные вызовы с одним ключом получают результат одного fn().
+        fn() идёт в своей задаче: отмена первого вызывающего (клиент ушёл)
+        не оставляет остальных ждать вечно и не обрывает сам запрос."""
+        task = self._inflight.get(key)
+        if task is not None:
+            self.shared_waits += 1
+            return await asyncio.shield(task)
+        task = asyncio.ensure_future(fn())
+        self._inflight[key] = task
+        task.add_done_callback(lambda t: self._once_done(key, t))
+        return await asyncio.shield(task)
+
+    def _once_done(self, key: Tuple, task: asyncio.Future):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        # Все ждавшие могли уйти — не логируем исключение как потерянное.
+        if not task.cancelled():
+            task.exception()
+
+    # ── внутреннее ────────────────────────────────────────────────
+
+    def _get(self, key: Tuple[str, str]) -> Optional[NftInfo]:
+        info = self._lru.get(key)
+        if info is not None:
+            self._lru.move_to_end(key)
+        return info
+
+    def _put(self, key: Tuple[str, str], info: NftInfo) -> NftInfo:
+        self._lru[key] = info
+        self._lru.move_to_end(key)
+        while len(self._lru) > self.max_size:
+            self._lru.popitem(last=False)
+        return info
+
+    async def _load(self, key: Tuple[str, str]) -> Optional[NftInfo]:
+        info = (await self._db_many(key[0], [key[1]])).get(key[1])
+        if info is not None and info.media:
+            return info
+        return await self._fetch(key)
+
+    async def _db_many(self, contract_id: str, token_ids: List[str]) -> Dict[str, NftInfo]:
+        found: Dict[str, NftInfo] = {}
+        try:
+            async for session in get_session():
+                rows = (await session.execute(
+                    select(NftToken).where(
+                        tuple_(NftToken.contract_id, NftToken.token_id).in_(
+                            [(contract_id, tid) for tid in token_ids]
+                        )
+                    )
+                )).scalars().all()
+                for row in rows:
+                    info = NftInfo(row.media or "", row.title, row.rank)
+                    found[row.token_id] = self._merge((contract_id, row.token_id), info)
+                break
+        except Exception as e:
+            logger.warning("[NFT_CACHE] DB read failed: %s", e)
+        self.db_hits += sum(1 for info in found.values() if info.media)
+        return found
+
+    def _merge(self, key: Tuple[str, str], info: NftInfo) -> NftInfo:
+        """Метаданные из БД в LRU; владелец остаётся тем, что видел процесс."""
+        cur = self._lru.get(key)
+        if cur is not None:
+            info.owner, info.owner_at, info.owner_height = cur.owner, cur.owner_at, cur.owner_height
+            info.forgot_at = cur.forgot_at
+            if info.rank is None:
+                info.rank = cur.rank
+        return self._put(key, info)
+
+    def _rpc_semaphore(self) -> asyncio.Semaphore:
+        if self._rpc_sem is None:
+            self._rpc_sem = asyncio.Semaphore(NFT_CACHE_RPC_CONCURRENCY)
+        return self._rpc_sem
+
+    async def _fetch(self, key: Tuple[str, str]) -> Optional[NftInfo]:
+        contract_id, token_id = key
+        t0 = time.monotonic()
+        async with self._rpc_semaphore():
+            self.rpc_fetches += 1
+            token, height = await near_rpc.view_call_with_height(
+                contract_id, "nft_token", {"token_id": token_id}, timeout=8
+            )
+        if not token:
+            return None
+        metadata = token.get("metadata") or {}
+        prev = self._lru.get(key)
+        info = NftInfo(_media_url(metadata.get("media")), metadata.get("title"),
+                       prev.rank if prev is not None else None)
+        if prev is not None and prev.forgot_at >= t0:
+            # Пока шёл запрос, мы сами перевели токен — ответ RPC мог
+            # застать старого владельца, в кэш его не кладём.
+            info.forgot_at = prev.forgot_at
+        elif prev is not None and _behind(prev, height):
+            info.owner, info.owner_at, info.owner_height = prev.owner, prev.owner_at, prev.owner_height
+        else:
+            info.owner = token.get("owner_id")
+            info.owner_at = time.monotonic()
+            info.owner_height = height
+        self._put(key, info)
+        try:
+            async for session in get_session():
+                values = {"media": info.media or None, "title": info.title,
+                          "owner_id": info.owner, "owner_checked_at": datetime.utcnow()}
+                await session.execute(
+                    pg_insert(NftToken)
+                    .values(contract_id=contract_id, token_id=token_id, **values)
+                    .on_conflict_do_update(
+                        index_elements=[NftToken.contract_id, NftToken.token_id], set_=values,
+                    )
+                )
+                await session.commit()
+                break
+        except Exception as e:
+            logger.warning("[NFT_CACHE] DB write failed for %s: %s", token_id, e)
+        return info
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self._lru),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "db_hits": self.db_hits,
+            "rpc_fetches": self.rpc_fetches,
+            "shared_waits": self.shared_waits,
+            "inflight": len(self._inflight),
+        }
+
+
+nft_cache = NftCache()
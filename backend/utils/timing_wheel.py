@@ -0,0 +1,197 @@
+"""Иерархическое колесо таймеров — единый владелец всех дедлайнов сервера.
+
+Форфейт по реконнекту, таймаут лока эскроу, «зависший» active-матч,
+предел ожидания reopen-лобби и протухание записи очереди — всё это ключи
+в одном колесе вместо отдельной asyncio-задачи на каждого отвалившегося и
+полного прохода по active_matches раз в 30 секунд.
+
+Три уровня по 64 слота (тик TIMING_WHEEL_TICK_SECONDS, по умолчанию 1 с):
+  L0 — ближайшие 64 тика, L1 — 64*64, L2 — 64^3 (~73 ч при тике 1 с).
+Таймер кладётся в слот своего уровня и при повороте старшего уровня
+спускается ниже («каскад»). schedule/cancel — O(1): таймер знает свой слот,
+слот — это dict. Один драйвер run() крутит колесо; стоимость таймаутов не
+зависит от числа матчей — только от числа реально сработавших таймеров.
+
+Ключи произвольные hashable, повторный schedule с тем же ключом заменяет
+таймер. Колбэк — обычная функция или корутина (запускается отдельной
+задачей, драйвер не ждёт её завершения)."""
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+import time
+from datetime import datetime, timezone
+from typing import Callable, Dict, Hashable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+TIMING_WHEEL_TICK_SECONDS = float(os.getenv("TIMING_WHEEL_TICK_SECONDS", "1.0"))
+
+_BITS = 6
+_SLOTS = 1 << _BITS          # 64
+_MASK = _SLOTS - 1
+_LEVELS = 3
+_SPAN = 1 << (_BITS * _LEVELS)  # тиков, которые колесо держит без переукладки
+
+
+class Timer:
+    __slots__ = ("key", "due", "tick", "fn", "args", "level", "slot")
+
+    def __init__(self, key: Hashable, due: float, tick: int, fn: Callable, args: tuple):
+        self.key = key
+        self.due = due    # монотонное время, когда таймер ДОЛЖЕН сработать
+        self.tick = tick
+        self.fn = fn
+        self.args = args
+        self.level = -1
+        self.slot = -1
+
+
+class TimingWheel:
+    def __init__(self, tick: float = TIMING_WHEEL_TICK_SECONDS):
+        self.tick = tick
+        self._origin = time.monotonic()
+        self._now_tick = 0  # следующий необработанный тик
+        self._wheels: List[List[Dict[Hashable, Timer]]] = [
+            [{} for _ in range(_SLOTS)] for _ in range(_LEVELS)
+        ]
+        self._timers: Dict[Hashable, Timer] = {}
+        self._task: Optional[asyncio.Task] = None
+        # Метрики: сработавшие таймеры и отставание срабатывания от дедлайна.
+        self.fired = 0
+        self.lag_last = 0.0
+        self.lag_max = 0.0
+        self.lag_total = 0.0
+
+    # ── API ────────────────────────────────────────────────────────
+
+    def schedule(self, key: Hashable, delay: float, fn: Callable, *args) -> Timer:
+        """Запланировать fn(*args) через delay секунд (замена по ключу)."""
+        self.cancel(key)
+        due = time.monotonic() + max(0.0, delay)
+        tick = int((due - self._origin) / self.tick + 0.999999)
+        timer = Timer(key, due, max(tick, self._now_tick), fn, args)
+        self._timers[key] = timer
+        self._place(timer)
+        return timer
+
+    def schedule_at(self, key: Hashable, when: datetime, fn: Callable, *args) -> Timer:
+        """То же по «настенному» UTC-времени (как в match_data: *_at, utcnow)."""
+        if when.tzinfo is not None:
+            when = when.astimezone(timezone.utc).replace(tzinfo=None)
+        return self.schedule(key, (when - datetime.utcnow()).total_seconds(), fn, *args)
+
+    def cancel(self, key: Hashable) -> bool:
+        timer = self._timers.pop(key, None)
+        if timer is None:
+            return False
+        self._wheels[timer.level][timer.slot].pop(key, None)
+        return True
+
+    def __len__(self) -> int:
+        return len(self._timers)
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self._task and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    def stats(self) -> dict:
+        pending: Dict[str, int] = {}
+        for key in self._timers:
+            kind = key[0] if isinstance(key, tuple) and key else "other"
+            pending[kind] = pending.get(kind, 0) + 1
+        return {
+            "pending": len(self._timers),
+            "pending_by_kind": pending,
+            "fired": self.fired,
+            "lag_last_ms": round(self.lag_last * 1000, 3),
+            "lag_max_ms": round(self.lag_max * 1000, 3),
+            "lag_avg_ms": round(self.lag_total / self.fired * 1000, 3) if self.fired else 0.0,
+        }
+
+    # ── драйвер ────────────────────────────────────────────────────
+
+    async def run(self):
+        while True:
+            target = int((time.monotonic() - self._origin) / self.tick)
+            while self._now_tick <= target:
+                self._advance()
+            next_at = self._origin + self._now_tick * self.tick
+            await asyncio.sleep(max(0.0, next_at - time.monotonic()))
+
+    def _place(self, timer: Timer):
+        delta = timer.tick - self._now_tick
+        if delta < _SLOTS:
+            level, slot = 0, timer.tick & _MASK
+        elif delta < _SLOTS * _SLOTS:
+            level, slot = 1, (timer.tick >> _BITS) & _MASK
+        else:
+            # Дальше горизонта колеса — в самый дальний слот L2, при каскаде
+            # таймер просто переложится ещё раз.
+            tick = min(timer.tick, self._now_tick + _SPAN - 1)
+            level, slot = 2, (tick >> (2 * _BITS)) & _MASK
+        timer.level = level
+        timer.slot = slot
+        self._wheels[level][slot][timer.key] = timer
+
+    def _cascade(self, level: int):
+        bucket = self._wheels[level][(self._now_tick >> (level * _BITS)) & _MASK]
+        if not bucket:
+            return
+        timers = list(bucket.values())
+        bucket.clear()
+        for timer in timers:
+            self._place(timer)
+
+    def _advance(self):
+        now_tick = self._now_tick
+        if now_tick & _MASK == 0:
+            if (now_tick >> _BITS) & _MASK == 0:
+                self._cascade(2)
+            self._cascade(1)
+        bucket = self._wheels[0][now_tick & _MASK]
+        self._now_tick = now_tick + 1
+        if not bucket:
+            return
+        due = [t for t in bucket.values() if t.tick <= now_tick]
+        for timer in due:
+            # колбэк предыдущего таймера мог отменить или переставить этот
+            if self._timers.get(timer.key) is not timer:
+                continue
+            del bucket[timer.key]
+            del self._timers[timer.key]
+            self._fire(timer)
+
+    def _fire(self, timer: Timer):
+        lag = max(0.0, time.monotonic() - timer.due)
+        self.fired += 1
+        self.lag_last = lag
+        self.lag_total += lag
+        if lag > self.lag_max:
+            self.lag_max = lag
+        try:
+            result = timer.fn(*timer.args)
+            if asyncio.iscoroutine(result):
+                asyncio.create_task(self._guard(timer.key, result))
+        except Exception as e:
+            logger.exception("[WHEEL] timer %s failed: %s", timer.key, e)
+
+    @staticmethod
+    async def _guard(key: Hashable, coro):
+        try:
+            await coro
+        except Exception as e:
+            logger.exception("[WHEEL] timer %s failed: %s", key, e)
+
+
+# Единственный экземпляр на процесс; драйвер запускается в lifespan (main.py).
+wheel = TimingWheel()
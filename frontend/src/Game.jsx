@@ -255,6 +255,8 @@ export default function Game({ onExit, me, playerDeck, matchId, mode = "ai" }) {
     const myPlayerIdRef = useRef(null);
     const myRoleRef = useRef(null);
     const pvpStateRef = useRef(null);
+    // Последняя применённая версия состояния партии (seq с сервера).
+    const lastSeqRef = useRef(null);
 
     const { accountId: nearAccountId } = useWalletConnect();
 
@@ -371,6 +373,27 @@ export default function Game({ onExit, me, playerDeck, matchId, mode = "ai" }) {
         return null;
     };
 
+    const requestFullState = () => {
+        try {
+            if (wsRef.current?.readyState === WebSocket.OPEN)
+                wsRef.current.send(JSON.stringify({ type: "get_state" }));
+        } catch { }
+    };
+
+    // Дельты применяем строго по порядку. true — можно применять; при дыре
+    // (потерянное/переставленное сообщение) просим полный снапшот.
+    const acceptSeq = (seq) => {
+        if (typeof seq !== "number") return true;
+        const last = lastSeqRef.current;
+        if (last != null && seq <= last) return false;
+        if (last == null || seq !== last + 1) {
+            requestFullState();
+            return false;
+        }
+        lastSeqRef.current = seq;
+        return true;
+    };
+
     const haptic = (kind = "light") => {
         try { window.Telegram?.WebApp?.HapticFeedback?.impactOccurred?.(kind); } catch { }
     };
@@ -389,6 +412,7 @@ export default function Game({ onExit, me, playerDeck, matchId, mode = "ai" }) {
             setOpponentConnected(data.opponent_connected !== false);
             setPvpState(state);
             pvpStateRef.current = state;
+            if (typeof state.seq === "number") lastSeqRef.current = state.seq;
 
             let myId = myPlayerIdRef.current;
             if (!myId) {
@@ -462,9 +486,10 @@ export default function Game({ onExit, me, playerDeck, matchId, mode = "ai" }) {
     const handleCardPlayed = (data) => {
         if (!mountedRef.current) return;
         try {
-            const { cell_index, card, captured, player_id } = data;
+            const { cell_index, card, captured, player_id, hand_index, current_turn } = data;
             if (cell_index == null || !card) return;
             if (cell_index < 0 || cell_index > 8) return;
+            if (!acceptSeq(data.seq)) return;
 
             const myId = getEffectiveMyPlayerId(data);
             const isMyCard = myId ? String(player_id) === String(myId) : false;
@@ -488,13 +513,25 @@ export default function Game({ onExit, me, playerDeck, matchId, mode = "ai" }) {
                 return next;
             });
 
-            if (!isMyCard) {
+            if (isMyCard) {
+                // Сервер прислал индекс ушедшей карты — рука в том же порядке, что и на сервере.
+                if (typeof hand_index === "number") {
+                    setHands(h => ({
+                        ...h,
+                        player: h.player.filter((_, i) => i !== hand_index),
+                    }));
+                }
+            } else {
                 setHands(h => ({
                     ...h,
                     enemy: h.enemy.length > 0 ? h.enemy.slice(0, -1) : [],
                 }));
             }
 
+            if (current_turn != null && myId) {
+                setTurn(String(current_turn) === String(myId) ? "player" : "enemy");
+            }
+
             haptic("medium");
         } catch (e) {
             console.error("[handleCardPlayed]", e);
@@ -515,6 +552,12 @@ export default function Game({ onExit, me, playerDeck, matchId, mode = "ai" }) {
     const handleGameOver = (data) => {
         if (!mountedRef.current) return;
         try {
+            // game_over хода несёт тот же seq, что и card_played; форфейт — следующий.
+            if (typeof data.seq === "number") {
+                const last = lastSeqRef.current;
+                if (last == null || data.seq > last + 1) requestFullState();
+                else if (data.seq > last) lastSeqRef.current = data.seq;
+            }
             setMatchOver(true);
             setRoundOver(true);
             const myId = getEffectiveMyPlayerId(data);
@@ -604,10 +647,7 @@ export default function Game({ onExit, me, playerDeck, matchId, mode = "ai" }) {
                             setOpponentConnected(true);
                             setWaitingForOpponent(false);
                             setReconnectDeadline(null);
-                            try {
-                                if (wsRef.current?.readyState === WebSocket.OPEN)
-                                    wsRef.current.send(JSON.stringify({ type: "get_state" }));
-                            } catch { }
+                            requestFullState();
                             break;
                         // [PATCH] Сервер говорит что NFT ещё не залочены
                         case "waiting_for_escrow":
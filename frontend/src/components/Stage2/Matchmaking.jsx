@@ -8,6 +8,34 @@ function getStoredToken() {
         return localStorage.getItem("token") || localStorage.getItem("accessToken") || localStorage.getItem("access_token") || "";
     } catch (e) { return ""; }
 }
+// Лобби-канал: сервер сам присылает matched / escrow / ready / cancelled
+// вместо опроса join_queue каждые 3 секунды. onFail — сокет не открылся или
+// оборвался: тогда вызывающий возвращается к опросу.
+function openLobby(token, onEvent, onFail) {
+    var apiUrl = import.meta.env.VITE_API_BASE_URL || import.meta.env.VITE_API_URL || "";
+    if (!apiUrl || typeof WebSocket === "undefined") { onFail(); return null; }
+    var ws;
+    try {
+        ws = new WebSocket(apiUrl.replace(/^https:/, "wss:").replace(/^http:/, "ws:") + "/api/matchmaking/lobby");
+    } catch (e) { onFail(); return null; }
+    ws.onopen = function () {
+        try { ws.send(JSON.stringify({ type: "auth", token: token })); } catch (e) { }
+    };
+    ws.onmessage = function (ev) {
+        var data;
+        try { data = JSON.parse(ev.data); } catch (e) { return; }
+        onEvent(data);
+    };
+    ws.onclose = function () { onFail(); };
+    return ws;
+}
+
+function closeLobby(ws) {
+    if (!ws) return;
+    ws.onclose = null;
+    try { ws.close(); } catch (e) { }
+}
+
 // СТАЛО:
 function LockWaitTimer({ timeoutMs, onTimeout }) {
     var startRef = useRef(Date.now());
@@ -56,6 +84,9 @@ export default function Matchmaking({ me, playerDeck, onBack, onMatched, resumeM
     var [myLockDone, setMyLockDone] = useState(false);
     var pollRef = useRef(null);
     var lockPollRef = useRef(null);
+    var lobbyRef = useRef(null);
+    var foundMidRef = useRef("");     // матч, о котором уже сообщили (снапшот + событие)
+    var lockWaitMidRef = useRef("");  // матч, лок соперника в котором ждём
 
     var escrowContractId = (import.meta.env.VITE_NEAR_ESCROW_CONTRACT_ID || "").trim();
     var stage2Enabled = Boolean(escrowContractId);
@@ -74,6 +105,10 @@ export default function Matchmaking({ me, playerDeck, onBack, onMatched, resumeM
     }, [resumeMatchId]);
 
     var stopSearch = function () {
+        closeLobby(lobbyRef.current);
+        lobbyRef.current = null;
+        foundMidRef.current = "";
+        lockWaitMidRef.current = "";
         if (pollRef.current) {
             clearInterval(pollRef.current);
             pollRef.current = null;
@@ -100,6 +135,7 @@ export default function Matchmaking({ me, playerDeck, onBack, onMatched, resumeM
         return function () {
             if (pollRef.current) clearInterval(pollRef.current);
             if (lockPollRef.current) clearInterval(lockPollRef.current);
+            closeLobby(lobbyRef.current);
         };
     }, []);
 
@@ -133,28 +169,15 @@ export default function Matchmaking({ me, playerDeck, onBack, onMatched, resumeM
 
             if (res.opponent_id && res.match_id) {
                 // Found opponent immediately
-                onOpponentFound(res.match_id, res.opponent_id);
+                onOpponentFound(res.match_id, res.opponent_id, res.mode);
                 return;
             }
 
-            // Polling for opponent
-            pollRef.current = setInterval(async function () {
-                try {
-                    var r = await apiFetch("/api/matchmaking/join_queue", {
-                        method: "POST",
-                        token: token,
-                        body: JSON.stringify({ max_elo_diff: 500 }),
-                    });
-                    if (r.opponent_id && r.match_id) {
-                        clearInterval(pollRef.current);
-                        pollRef.current = null;
-                        onOpponentFound(r.match_id, r.opponent_id);
-                    }
-                } catch (e) {
-                    // keep polling
-                }
-            }, 3000);
-
+            // Ждём соперника в лобби-канале; без сокета — опрос, как раньше.
+            lobbyRef.current = openLobby(token, onLobbyEvent, function () {
+                lobbyRef.current = null;
+                if (!foundMidRef.current && !pollRef.current) startPolling(token);
+            });
         } catch (e) {
             setPhase("idle");
             setSearchMode(null);
@@ -162,23 +185,98 @@ export default function Matchmaking({ me, playerDeck, onBack, onMatched, resumeM
         }
     };
 
+    var startPolling = function (token) {
+        pollRef.current = setInterval(async function () {
+            try {
+                var r = await apiFetch("/api/matchmaking/join_queue", {
+                    method: "POST",
+                    token: token,
+                    body: JSON.stringify({ max_elo_diff: 500 }),
+                });
+                if (r.opponent_id && r.match_id) {
+                    clearInterval(pollRef.current);
+                    pollRef.current = null;
+                    onOpponentFound(r.match_id, r.opponent_id, r.mode);
+                }
+            } catch (e) {
+                // keep polling
+            }
+        }, 3000);
+    };
+
+    var onLobbyEvent = function (data) {
+        if (data.type === "matched" && !data.you_locked) {
+            onOpponentFound(data.match_id, data.opponent_id, data.mode);
+        } else if (data.type === "ready") {
+            if (data.mode === "bot") {
+                onOpponentFound(data.match_id, data.opponent_id, "bot");
+            } else if (lockWaitMidRef.current === data.match_id) {
+                finishLockWait(data.match_id);
+            }
+        } else if (data.type === "cancelled" && lockWaitMidRef.current === data.match_id) {
+            cancelLockWait();
+        }
+    };
+
     // Шаг2
-    var onOpponentFound = function (newMatchId, opponentId) {
+    var onOpponentFound = function (newMatchId, opponentId, matchMode) {
+        if (foundMidRef.current === newMatchId) return;
+        foundMidRef.current = newMatchId;
+        if (pollRef.current) {
+            clearInterval(pollRef.current);
+            pollRef.current = null;
+        }
         setMatchId(newMatchId);
         setOpponentInfo({ id: opponentId });
         setPhase("found");
 
         try { window.Telegram?.WebApp?.HapticFeedback?.notificationOccurred?.("success"); } catch (e) { }
 
+        // Сервер подобрал бота (мало онлайна): ставки нет, лок NFT не нужен —
+        // сразу в WS-партию.
+        if (matchMode === "bot") {
+            closeLobby(lobbyRef.current);
+            lobbyRef.current = null;
+            onMatched({ mode: "pvp", matchId: newMatchId });
+            return;
+        }
+
         if (stage2Enabled) {
             setTimeout(function () {
                 setShowLockModal(true);
             }, 500);
         } else {
+            closeLobby(lobbyRef.current);
+            lobbyRef.current = null;
             onMatched({ mode: "pvp", matchId: newMatchId });
         }
     };
 
+    var finishLockWait = function (mid) {
+        if (lockWaitMidRef.current !== mid) return;
+        lockWaitMidRef.current = "";
+        if (lockPollRef.current) {
+            clearInterval(lockPollRef.current);
+            lockPollRef.current = null;
+        }
+        closeLobby(lobbyRef.current);
+        lobbyRef.current = null;
+        setWaitingForOpponentLock(false);
+        setPhase("ready");
+        setTimeout(function () { onMatched({ mode: "pvp", matchId: mid }); }, 500);
+    };
+
+    var cancelLockWait = function () {
+        if (!lockWaitMidRef.current) return;
+        lockWaitMidRef.current = "";
+        if (lockPollRef.current) {
+            clearInterval(lockPollRef.current);
+            lockPollRef.current = null;
+        }
+        alert("Соперник так и не нашёлся — NFT возвращены на кошелёк.");
+        stopSearch();
+    };
+
     // Экран ожидания соперника: опрашиваем матч (mid передаём явно, чтобы не
     // ловить устаревший matchId из замыкания). Как только оба залочили — в игру;
     // если сервер отменил и вернул карты — выходим.
@@ -187,27 +285,26 @@ export default function Matchmaking({ me, playerDeck, onBack, onMatched, resumeM
         setMyLockDone(true);
         setPhase("locking");
         setWaitingForOpponentLock(true);
+        lockWaitMidRef.current = mid;
         var token = getStoredToken();
+        // ready/cancelled приходят по лобби-каналу; опрос матча остаётся
+        // страховкой — редкой, если сокет открыт.
+        if (!lobbyRef.current) {
+            lobbyRef.current = openLobby(token, onLobbyEvent, function () { lobbyRef.current = null; });
+        }
         if (lockPollRef.current) clearInterval(lockPollRef.current);
         lockPollRef.current = setInterval(async function () {
             try {
                 var matchData = await apiFetch("/api/matches/" + mid, { token: token });
                 if (matchData.escrow_locked) {
-                    clearInterval(lockPollRef.current);
-                    lockPollRef.current = null;
-                    setWaitingForOpponentLock(false);
-                    setPhase("ready");
-                    setTimeout(function () { onMatched({ mode: "pvp", matchId: mid }); }, 500);
+                    finishLockWait(mid);
                     return;
                 }
                 if (matchData.status === "cancelled") {
-                    clearInterval(lockPollRef.current);
-                    lockPollRef.current = null;
-                    alert("Соперник так и не нашёлся — NFT возвращены на кошелёк.");
-                    stopSearch();
+                    cancelLockWait();
                 }
             } catch (e) { /* keep polling */ }
-        }, 2000);
+        }, lobbyRef.current ? 10000 : 2000);
     };
 
     // Шаг3 — после успешного лока
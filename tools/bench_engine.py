@@ -0,0 +1,221 @@
+# bench_engine.py — микро-бенчмарк серверного хода: прежняя логика WSManager
+# (поле из словарей, _get_neighbors на каждый ход, копия карты при захвате)
+# против game.engine.MatchState (массивы + статическая таблица соседей).
+#
+# Руки нормализуются в CardRecord при создании партии (как в try_start_game),
+# поэтому в замер попадает только сам ход.
+#
+# В конце меряет game.replay.verify по журналам этих же партий.
+#
+# Сначала прогоняет одни и те же случайные партии через обе реализации и
+# сверяет captured/победителя на КАЖДОМ ходу, потом меряет CPU на ход.
+#
+# Запуск (из корня репозитория):
+#   python tools/bench_engine.py [games]
+# Пример:
+#   python tools/bench_engine.py 20000
+
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend"))
+
+from game.engine import ACE_VALUE, ELEMENTS, MatchState, normalize_card  # noqa: E402
+from game import replay  # noqa: E402
+
+
+# ── прежняя реализация (копия WSManager до переноса в game.engine) ──────────
+
+def legacy_get_neighbors(idx):
+    x = idx % 3
+    y = idx // 3
+    dirs = [
+        (0, -1, "top", "bottom"),
+        (1, 0, "right", "left"),
+        (0, 1, "bottom", "top"),
+        (-1, 0, "left", "right"),
+    ]
+    result = []
+    for dx, dy, a, b in dirs:
+        nx, ny = x + dx, y + dy
+        if 0 <= nx <= 2 and 0 <= ny <= 2:
+            result.append({"ni": ny * 3 + nx, "a": a, "b": b})
+    return result
+
+
+def legacy_safe_val(raw):
+    try:
+        v = int(raw)
+        return max(1, min(ACE_VALUE, v))
+    except (TypeError, ValueError):
+        return 5
+
+
+def legacy_effective_val(base, card_elem, cell_elem):
+    if base == ACE_VALUE:
+        return ACE_VALUE
+    if cell_elem:
+        bonus = +1 if card_elem == cell_elem else -1
+    else:
+        bonus = 0
+    return max(1, min(9, base + bonus))
+
+
+def legacy_resolve_placement(placed_idx, board, board_elems, placed_card):
+    flipped = []
+    placed_owner = placed_card["owner"]
+    placed_elem = placed_card.get("element")
+    placed_cell_elem = board_elems[placed_idx] if placed_idx < len(board_elems) else None
+    for nb in legacy_get_neighbors(placed_idx):
+        ni = nb["ni"]
+        a = nb["a"]
+        b = nb["b"]
+        target = board[ni]
+        if not target:
+            continue
+        if target.get("owner") == placed_owner:
+            continue
+        attack_base = legacy_safe_val(placed_card["values"].get(a, 5))
+        defend_base = legacy_safe_val(target["values"].get(b, 5))
+        target_cell_elem = board_elems[ni] if ni < len(board_elems) else None
+        target_elem = target.get("element")
+        attack_val = legacy_effective_val(attack_base, placed_elem, placed_cell_elem)
+        defend_val = legacy_effective_val(defend_base, target_elem, target_cell_elem)
+        if attack_val > defend_val:
+            board[ni] = {**target, "owner": placed_owner}
+            flipped.append(ni)
+    return flipped
+
+
+def legacy_check_game_over(board, p1, p2):
+    if any(cell is None for cell in board):
+        return None
+    s1 = sum(1 for c in board if c and c.get("owner") == p1)
+    s2 = sum(1 for c in board if c and c.get("owner") == p2)
+    if s1 > s2:
+        return p1
+    if s2 > s1:
+        return p2
+    return p1
+
+
+class LegacyState:
+    def __init__(self, p1, p2, h1, h2, elems, first):
+        self.p1, self.p2 = p1, p2
+        self.board = [None] * 9
+        self.elems = elems
+        self.hands = {p1: h1, p2: h2}
+        self.turn = first
+        self.winner = None
+
+    def play(self, pid, card_index, cell_index, card):
+        placed = {**card, "owner": pid}
+        self.board[cell_index] = placed
+        captured = legacy_resolve_placement(cell_index, self.board, self.elems, placed)
+        self.hands[pid].pop(card_index)
+        self.turn = self.p2 if self.turn == self.p1 else self.p1
+        self.winner = legacy_check_game_over(self.board, self.p1, self.p2)
+        return captured
+
+
+# ── генерация партий ─────────────────────────────────────────────────────────
+
+def random_card(rng, n):
+    values = {s: rng.randint(1, 9) for s in ("top", "right", "bottom", "left")}
+    if rng.random() < 0.15:
+        values[rng.choice(list(values))] = ACE_VALUE
+    return {
+        "id": f"c{n}",
+        "token_id": str(n),
+        "values": values,
+        "element": rng.choice(ELEMENTS),
+        "rank": "rare",
+        "rankLabel": "R",
+        "imageUrl": "",
+        "image": "",
+    }
+
+
+def random_game(rng):
+    elems = [rng.choice(ELEMENTS) if rng.random() < 0.38 else None for _ in range(9)]
+    h1 = [random_card(rng, i) for i in range(5)]
+    h2 = [random_card(rng, 5 + i) for i in range(5)]
+    first = rng.choice(["1", "2"])
+    cells = list(range(9))
+    rng.shuffle(cells)
+    picks = [rng.randint(0, 4 - (k // 2)) for k in range(9)]
+    return elems, h1, h2, first, list(zip(picks, cells))
+
+
+def new_legacy(game):
+    elems, h1, h2, first, _ = game
+    return LegacyState("1", "2", list(h1), list(h2), elems, first)
+
+
+def new_engine(game):
+    elems, h1, h2, first, _ = game
+    return MatchState("m", "1", "2", [normalize_card(c) for c in h1],
+                      [normalize_card(c) for c in h2], elems, first)
+
+
+def play_legacy(st, moves):
+    trace = []
+    for card_index, cell in moves:
+        pid = st.turn
+        hand = st.hands[pid]
+        ci = min(card_index, len(hand) - 1)
+        trace.append(st.play(pid, ci, cell, hand[ci]))
+    return trace, st.winner
+
+
+def play_engine(st, moves):
+    trace = []
+    for card_index, cell in moves:
+        pid = st.current_turn
+        ci = min(card_index, len(st.get_hand(pid)) - 1)
+        trace.append(st.apply_move(pid, ci, cell))
+    return trace, st.winner
+
+
+def main():
+    games_n = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    rng = random.Random(42)
+    games = [random_game(rng) for _ in range(games_n)]
+
+    for i, g in enumerate(games):
+        if play_legacy(new_legacy(g), g[4]) != play_engine(new_engine(g), g[4]):
+            print(f"MISMATCH in game #{i}")
+            sys.exit(1)
+    print(f"equivalence: {games_n} games, {games_n * 9} moves — identical captures/winners")
+
+    # Меряем только сами ходы: состояние партии создаётся один раз на матч.
+    for name, make, play in (
+            ("before (dict board)", new_legacy, play_legacy),
+            ("after  (game.engine)", new_engine, play_engine),
+    ):
+        best = None
+        for _ in range(3):
+            states = [(make(g), g[4]) for g in games]
+            t0 = time.perf_counter()
+            for st, moves in states:
+                play(st, moves)
+            dt = time.perf_counter() - t0
+            best = dt if best is None else min(best, dt)
+        print(f"{name}: {best / (games_n * 9) * 1e6:.2f} µs/move")
+
+    # Перепроверка сохранённых журналов (PvPMatch.event_log) — споры/аналитика.
+    logs = []
+    for g in games:
+        st = new_engine(g)
+        play_engine(st, g[4])
+        logs.append(st.event_log("normal"))
+    t0 = time.perf_counter()
+    bad = sum(1 for log in logs if not replay.verify(log)["ok"])
+    dt = time.perf_counter() - t0
+    print(f"replay verify: {games_n / dt:,.0f} games/s ({bad} mismatches)")
+
+
+if __name__ == "__main__":
+    main()
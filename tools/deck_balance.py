@@ -0,0 +1,69 @@
+# deck_balance.py — офлайн-прогон симулятора баланса колод (game.balance).
+#
+# Считает рейтинг колод (промилле побед против эталонного пула) на большом
+# числе партий — для калибровки коридора в find_opponent и проверки новых
+# карт, — и печатает пропускную способность пакетной симуляции.
+#
+# Сначала сверяет NumPy-путь с запасным путём на game.engine (одна и та же
+# политика ходов): доли побед должны совпасть в пределах шума.
+#
+# Запуск (из корня репозитория):
+#   python tools/deck_balance.py [decks.json] [games]
+# decks.json — список колод (по 5 карт в формате UserDeck.full_cards);
+# без файла рейтингуются случайные колоды.
+# Пример:
+#   python tools/deck_balance.py decks.json 1000000
+
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend"))
+
+from game import balance  # noqa: E402
+from game.ai import _sample_card  # noqa: E402
+
+
+def random_deck(rng):
+    sides = ("top", "right", "bottom", "left")
+    return [{"id": f"r{rng.random()}", "values": dict(zip(sides, s)), "element": e}
+            for s, e in (_sample_card(rng) for _ in range(5))]
+
+
+def main():
+    args = sys.argv[1:]
+    decks = None
+    if args and not args[0].isdigit():
+        with open(args.pop(0), encoding="utf-8") as f:
+            decks = json.load(f)
+    games = int(args[0]) if args else 200000
+    if decks is None:
+        rng = random.Random(1)
+        decks = [random_deck(rng) for _ in range(8)]
+
+    if balance.np is None:
+        print("numpy is not installed — only the slow engine fallback is available")
+        return
+
+    cards = balance.deck_cards(decks[0])
+    fast = balance._rate_numpy(cards, 20000, 1)
+    slow = balance._rate_python(cards, 2000, 1)
+    print(f"numpy vs engine fallback: {fast:.3f} vs {slow:.3f} (2000 engine games, ±{1 / 2000 ** 0.5:.3f})")
+
+    t0 = time.perf_counter()
+    for deck in decks:
+        rating = int(round(float(balance._rate_numpy(balance.deck_cards(deck), games, 7)) * 1000))
+        print(f"{balance.deck_signature(deck)[:12]}  rating={rating}")
+    dt = time.perf_counter() - t0
+    total = games * len(decks)
+    print(f"{total:,} games in {dt:.2f}s — {total / dt:,.0f} games/s")
+
+    t0 = time.perf_counter()
+    balance.rate_deck(random_deck(random.Random(2)))
+    print(f"online rating ({balance.DECK_RATING_GAMES} games): {(time.perf_counter() - t0) * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()